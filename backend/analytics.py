@@ -0,0 +1,208 @@
+"""
+Rolling Analytics
+Incremental return statistics (Welford mean/variance, max drawdown, EWMA
+volatility) over configurable windows, fed from the APY history as it grows
+"""
+
+import math
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from apy_history import APYHistoryStore
+
+class RollingStats:
+    """Welford mean/variance over the last `size` observations (all of them when size is None)"""
+
+    def __init__(self, size: Optional[int] = None):
+        self.size = size
+        self._values = deque()
+        self.count = 0
+        self.mean = 0.0
+        self.total = 0.0
+        self._m2 = 0.0
+
+    def push(self, x: float):
+        if self.size is not None:
+            if self.count == self.size:
+                self._remove(self._values.popleft())
+            self._values.append(x)
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (x - self.mean)
+        self.total += x
+
+    @property
+    def variance(self) -> float:
+        """Population variance"""
+        return self._m2 / self.count if self.count else 0.0
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance)
+
+    def _remove(self, x: float):
+        # Inverse Welford step
+        if self.count == 1:
+            self.count, self.mean, self.total, self._m2 = 0, 0.0, 0.0, 0.0
+            return
+        self.count -= 1
+        delta = x - self.mean
+        self.mean -= delta / self.count
+        self._m2 = max(0.0, self._m2 - delta * (x - self.mean))
+        self.total -= x
+
+class DrawdownTracker:
+    """Running peak and maximum peak-to-trough decline of a value series"""
+
+    def __init__(self):
+        self.peak = 0.0
+        self.current = 0.0
+        self.max_drawdown = 0.0
+
+    def push(self, value: float):
+        self.peak = max(self.peak, value)
+        self.current = (self.peak - value) / self.peak if self.peak > 0 else 0.0
+        self.max_drawdown = max(self.max_drawdown, self.current)
+
+class EWMAVolatility:
+    """Exponentially weighted mean and variance; lam is the per-observation decay (RiskMetrics uses 0.94)"""
+
+    def __init__(self, lam: float = 0.94):
+        self.lam = lam
+        self.count = 0
+        self.mean = 0.0
+        self.variance = 0.0
+
+    def push(self, x: float):
+        self.count += 1
+        if self.count == 1:
+            self.mean = x
+            return
+        delta = x - self.mean
+        self.mean += (1 - self.lam) * delta
+        self.variance = self.lam * (self.variance + (1 - self.lam) * delta * delta)
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance)
+
+class AnalyticsEngine:
+    """
+    Daily return analytics for one APY history series. Each day's return is the last
+    recorded APY of the day / 365; a day is folded into the statistics once a sample
+    from a later day arrives, so every query is O(1) in the length of the history
+    """
+
+    def __init__(self, store: APYHistoryStore, protocol: str, token: str = 'USDC',
+                 windows: Tuple[int, ...] = (7, 30, 90), ewma_lambdas: Tuple[float, ...] = (0.94, 0.97),
+                 recent_days: int = 30):
+        self.store = store
+        self.protocol = protocol.encode()
+        self.token = token.encode()
+        self.window_days = tuple(windows)
+
+        # Per window: simple daily returns (mean/variance) and log returns (compounded return)
+        self._windows: Dict[str, Tuple[RollingStats, RollingStats]] = {
+            name: (RollingStats(size), RollingStats(size))
+            for name, size in [(f"{days}d", days) for days in self.window_days] + [('all', None)]
+        }
+        self._ewma = {lam: EWMAVolatility(lam) for lam in ewma_lambdas}
+        # Drawdown of the compounded value, and of the APY level (the value only falls when APY < 0)
+        self._drawdown = DrawdownTracker()
+        self._apy_drawdown = DrawdownTracker()
+        # Last recent_days completed days as (day, daily_return, growth since the first day)
+        self._recent = deque(maxlen=recent_days)
+
+        self._growth = 1.0
+        self._first_day: Optional[int] = None
+        self._pending: Optional[Tuple[int, float]] = None  # (day, apy) of the day still in progress
+        self._position = 0
+        # Samples of this series folded in so far; changes whenever the derived figures can change
+        self.samples = 0
+        self._lock = threading.Lock()
+
+    @property
+    def days(self) -> int:
+        return self._windows['all'][0].count + (1 if self._pending else 0)
+
+    def sync(self) -> int:
+        """Fold in records appended to the store since the last sync; returns how many were for this series"""
+        with self._lock:
+            new = self.store.since(self._position)
+            self._position += len(new)
+            if not len(new):
+                return 0
+            mine = new[(new['protocol'] == self.protocol) & (new['token'] == self.token)]
+            if not len(mine):
+                return 0
+            self.samples += len(mine)
+
+            # Reduce the batch to the last sample of each day before touching the statistics
+            days = mine['timestamp'] // 86400
+            last_of_day = np.append(np.nonzero(np.diff(days))[0], len(days) - 1)
+            for day, apy in zip(days[last_of_day].tolist(), mine['apy'][last_of_day].tolist()):
+                self.add(day, apy)
+            return len(mine)
+
+    def add(self, day: int, apy: float):
+        """Record the latest APY seen on day (days are unix days and must not go backwards)"""
+        if self._pending is not None and day > self._pending[0]:
+            self._close_day(*self._pending)
+        if self._first_day is None:
+            self._first_day = day
+        self._pending = (day, apy)
+
+    def summary(self, window: str = '30d') -> Dict[str, float]:
+        """Statistics of completed daily returns in one window"""
+        returns, log_returns = self._windows[window]
+        mean, std = returns.mean, returns.std
+        return {
+            'days': returns.count,
+            'mean_daily_return': mean,
+            'volatility': std,
+            'compounded_return': math.expm1(log_returns.total),
+            'sharpe_ratio': mean / std if std > 0 else 0.0
+        }
+
+    def ewma_volatility(self) -> Dict[float, float]:
+        """Daily EWMA volatility per decay factor"""
+        return {lam: ewma.std for lam, ewma in self._ewma.items()}
+
+    def drawdown(self) -> Dict[str, float]:
+        """Current and largest decline of the compounded value from its running peak, as a fraction of the peak"""
+        return {'current': self._drawdown.current, 'max': self._drawdown.max_drawdown}
+
+    def apy_drawdown(self) -> Dict[str, float]:
+        """Current and largest decline of the daily APY from its running peak, as a fraction of the peak"""
+        return {'current': self._apy_drawdown.current, 'max': self._apy_drawdown.max_drawdown}
+
+    def total_return(self) -> float:
+        """Compounded return since the first recorded day, including the day in progress"""
+        return self._growth * (1 + self._pending_return()) - 1 if self._pending else 0.0
+
+    def recent(self) -> List[Tuple[int, float, float]]:
+        """(day, daily_return, growth) for the last completed days plus the day in progress"""
+        recent = list(self._recent)
+        if self._pending:
+            recent.append((self._pending[0], self._pending_return(), self._growth * (1 + self._pending_return())))
+        return recent[-self._recent.maxlen:]
+
+    def _pending_return(self) -> float:
+        return self._pending[1] / 100 / 365
+
+    def _close_day(self, day: int, apy: float):
+        daily_return = apy / 100 / 365
+        self._growth *= 1 + daily_return
+        log_return = math.log1p(daily_return)
+        for returns, log_returns in self._windows.values():
+            returns.push(daily_return)
+            log_returns.push(log_return)
+        for ewma in self._ewma.values():
+            ewma.push(daily_return)
+        self._drawdown.push(self._growth)
+        self._apy_drawdown.push(apy)
+        self._recent.append((day, daily_return, self._growth))
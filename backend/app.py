@@ -1,14 +1,31 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, make_response
 from flask_cors import CORS
-import requests
-import json
 import time
 import math
+import hmac
 import logging
 import os
 from datetime import datetime, timedelta
 from functools import wraps
-from defi_service import defi_service
+from analytics import AnalyticsEngine, RollingStats
+from apy_history import DEFAULT_HISTORY_PATH, APYHistoryStore
+from defi_service import OPTIMIZATION_STRATEGIES, build_market_table, defi_service
+from http_client import http_client
+from memory_tracker import deep_sizeof, memory_tracker
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, metrics
+from profiling import RequestProfiler, StackSampler
+from protocol_cache import ProtocolDataCache
+from rate_limiter import TokenBucketLimiter
+from refresher import ProtocolRefresher
+from response_cache import ResponseCache
+
+try:
+    from web3 import Web3
+    from contract_reads import (
+        AGGREGATOR_VIEW_ABI, BlockTracker, CachedContractReader, ContractReader, read_aggregator_state
+    )
+except ImportError:  # web3 is only needed for on-chain reads; the rest of the API works without it
+    Web3 = None
 
 app = Flask(__name__)
 CORS(app, origins=[
@@ -22,13 +39,43 @@ CORS(app, origins=[
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Rate limiting: token buckets per (endpoint, client IP), shared by all workers through SQLite
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Reverse proxies in front of the app (Railway adds one); the client IP is that many entries from the end of X-Forwarded-For
+RATE_LIMIT_PROXY_HOPS = int(os.environ.get('RATE_LIMIT_PROXY_HOPS', 1))
+rate_limiter = TokenBucketLimiter(
+    path=os.environ.get('RATE_LIMIT_DB') or (
+        os.path.join(os.environ['DEFI_LOCK_DIR'], 'rate_limits.sqlite3') if os.environ.get('DEFI_LOCK_DIR') else None
+    )
+)
+
+def client_ip():
+    forwarded = [ip.strip() for ip in request.headers.get('X-Forwarded-For', '').split(',') if ip.strip()]
+    if RATE_LIMIT_PROXY_HOPS and forwarded:
+        return forwarded[-min(RATE_LIMIT_PROXY_HOPS, len(forwarded))]
+    return request.remote_addr or 'unknown'
+
 # Rate limiting decorator
 def rate_limit(max_requests=100, window=60):
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            # Simple rate limiting - in production, use Redis or similar
-            return f(*args, **kwargs)
+            if not RATE_LIMIT_ENABLED:
+                return f(*args, **kwargs)
+            
+            result = rate_limiter.check(f"{f.__name__}:{client_ip()}", max_requests, window)
+            if not result.allowed:
+                response = jsonify({
+                    "error": "Too many requests",
+                    "message": f"Rate limit of {max_requests} requests per {window} seconds exceeded. Retry in {result.retry_after} seconds."
+                })
+                response.status_code = 429
+                response.headers['Retry-After'] = str(result.retry_after)
+            else:
+                response = make_response(f(*args, **kwargs))
+            response.headers['X-RateLimit-Limit'] = str(result.limit)
+            response.headers['X-RateLimit-Remaining'] = str(result.remaining)
+            return response
         return decorated_function
     return decorator
 
@@ -46,6 +93,21 @@ def handle_errors(f):
             }), 500
     return decorated_function
 
+# Admin endpoints require `X-Admin-Token: <ADMIN_TOKEN>` and are disabled when ADMIN_TOKEN is unset
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+def require_admin(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        token = request.headers.get('X-Admin-Token', '')
+        if not ADMIN_TOKEN or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+            return jsonify({
+                "error": "Forbidden",
+                "message": "A valid X-Admin-Token header is required."
+            }), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
 # Real DeFi protocol data fetching
 def fetch_real_protocol_data():
     """Fetch real APY data from DeFi protocols"""
@@ -53,7 +115,7 @@ def fetch_real_protocol_data():
     
     try:
         # Fetch Compound data from their API
-        compound_response = requests.get('https://api.compound.finance/api/v2/ctoken', timeout=10)
+        compound_response = http_client.get('https://api.compound.finance/api/v2/ctoken', timeout=10)
         if compound_response.status_code == 200:
             compound_data = compound_response.json()
             # Find USDC market
@@ -79,7 +141,7 @@ def fetch_real_protocol_data():
     
     try:
         # Fetch Aave data from their API
-        aave_response = requests.get('https://aave-api-v2.aave.com/data/liquidity/v2?poolId=mainnet', timeout=10)
+        aave_response = http_client.get('https://aave-api-v2.aave.com/data/liquidity/v2?poolId=mainnet', timeout=10)
         if aave_response.status_code == 200:
             aave_data = aave_response.json()
             # Find USDC market
@@ -105,7 +167,7 @@ def fetch_real_protocol_data():
     
     try:
         # Fetch Yearn data from their API
-        yearn_response = requests.get('https://api.yearn.finance/v1/chains/1/vaults/all', timeout=10)
+        yearn_response = http_client.get('https://api.yearn.finance/v1/chains/1/vaults/all', timeout=10)
         if yearn_response.status_code == 200:
             yearn_data = yearn_response.json()
             # Find USDC vault
@@ -131,7 +193,7 @@ def fetch_real_protocol_data():
     
     try:
         # Fetch Curve data from their API
-        curve_response = requests.get('https://api.curve.fi/api/getPools/ethereum/main', timeout=10)
+        curve_response = http_client.get('https://api.curve.fi/api/getPools/ethereum/main', timeout=10)
         if curve_response.status_code == 200:
             curve_data = curve_response.json()
             # Find USDC pool
@@ -157,9 +219,149 @@ def fetch_real_protocol_data():
     
     return protocols
 
-# Cache for protocol data (refresh every 5 minutes)
-protocol_cache = {"data": None, "timestamp": 0}
-CACHE_DURATION = 300  # 5 minutes
+# Cache for protocol data (refresh every 5 minutes, serve stale data while revalidating)
+CACHE_DURATION = int(os.environ.get('PROTOCOL_CACHE_TTL', 300))  # 5 minutes
+CACHE_MAX_STALE = int(os.environ.get('PROTOCOL_CACHE_MAX_STALE', 3600))  # 1 hour
+protocol_cache = ProtocolDataCache(
+    defi_service.get_real_protocol_data,
+    ttl=CACHE_DURATION,
+    max_stale=CACHE_MAX_STALE
+)
+
+# Allocation plans depend only on the snapshot, so rebuild them once per published version
+protocol_cache.add_listener(lambda snapshot: defi_service.precompute_plans(snapshot.data, snapshot.version))
+
+# Fetches that missed DEFI_FETCH_DEADLINE keep running and replace their stale entry when they land
+defi_service.add_late_result_listener(protocol_cache.update)
+
+# Background refresher keeps the snapshot current; started per worker (see gunicorn.conf.py)
+REFRESHER_ENABLED = os.environ.get('PROTOCOL_REFRESHER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Append-only APY history on disk, shared by every worker (written by the refresher and the yield updater)
+apy_history = APYHistoryStore(
+    DEFAULT_HISTORY_PATH,
+    min_interval=float(os.environ.get('APY_HISTORY_MIN_INTERVAL', 60))
+)
+MAX_HISTORY_SAMPLES = int(os.environ.get('APY_HISTORY_MAX_SAMPLES', 10000))
+
+# Series the yield updater records with the weighted APY it pushes on-chain
+PERFORMANCE_SERIES = ('weighted', 'USDC')
+PERFORMANCE_DAYS = 30
+
+# Rolling return statistics kept up to date from the history; 7- and 30-day windows back the endpoints
+ANALYTICS_WINDOWS = tuple(sorted({7, PERFORMANCE_DAYS} | {
+    int(days) for days in os.environ.get('ANALYTICS_WINDOWS', '7,30,90').split(',') if days.strip()
+}))
+ANALYTICS_EWMA_LAMBDAS = tuple(
+    float(lam) for lam in os.environ.get('ANALYTICS_EWMA_LAMBDAS', '0.94,0.97').split(',') if lam.strip()
+)
+analytics_engine = AnalyticsEngine(
+    apy_history,
+    *PERFORMANCE_SERIES,
+    windows=ANALYTICS_WINDOWS,
+    ewma_lambdas=ANALYTICS_EWMA_LAMBDAS,
+    recent_days=PERFORMANCE_DAYS
+)
+
+protocol_refresher = ProtocolRefresher(defi_service, protocol_cache, history=apy_history)
+
+# On-chain reads are batched into one Multicall3 call or JSON-RPC batch and cached per block
+CONTRACT_ADDRESS = os.environ.get('CONTRACT_ADDRESS')
+CONTRACT_RPC_URL = os.environ.get('RPC_URL') or os.environ.get('SEPOLIA_URL')
+MAX_CONTRACT_READ_ADDRESSES = int(os.environ.get('CONTRACT_READ_MAX_ADDRESSES', 50))
+_contract_reader = None
+_aggregator_contract = None
+
+def get_contract_reader():
+    """Lazily build the shared contract reader, or return (None, None) when on-chain reads are not configured"""
+    global _contract_reader, _aggregator_contract
+    if Web3 is None or not CONTRACT_ADDRESS or not CONTRACT_RPC_URL:
+        return None, None
+    if _contract_reader is None:
+        w3 = Web3(Web3.HTTPProvider(CONTRACT_RPC_URL))
+        _aggregator_contract = w3.eth.contract(address=Web3.to_checksum_address(CONTRACT_ADDRESS), abi=AGGREGATOR_VIEW_ABI)
+        _contract_reader = CachedContractReader(
+            ContractReader(w3, rpc_url=CONTRACT_RPC_URL, mode=os.environ.get('CONTRACT_READ_MODE', 'auto')),
+            BlockTracker(
+                w3,
+                poll_interval=float(os.environ.get('BLOCK_POLL_INTERVAL', 1)),
+                reorg_depth=int(os.environ.get('REORG_DEPTH', 6))
+            )
+        )
+    return _contract_reader, _aggregator_contract
+
+# Serialized bodies of snapshot-derived endpoints, rebuilt (and compressed) once per version;
+# every other response is compressed per request when it is at least COMPRESSION_MIN_SIZE bytes
+response_cache = ResponseCache(
+    min_size=int(os.environ.get('COMPRESSION_MIN_SIZE', 1024)),
+    gzip_level=int(os.environ.get('GZIP_LEVEL', 6)),
+    brotli_quality=int(os.environ.get('BROTLI_QUALITY', 5))
+)
+
+# Per-route latency for /metrics; recorded after compression (hooks run in reverse registration order)
+REQUEST_LATENCY = metrics.histogram(
+    'http_request_duration_seconds', 'Latency of API requests by route', ['route', 'method', 'status']
+)
+SNAPSHOT_AGE = metrics.gauge('defi_protocol_snapshot_age_seconds', 'Age of the protocol snapshot held by this worker')
+CACHE_HIT_RATIO = metrics.gauge('defi_protocol_cache_hit_ratio', 'Share of protocol snapshot lookups served from cache by this worker')
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        REQUEST_LATENCY.observe(
+            time.perf_counter() - started,
+            # The URL rule, not the path, so addresses in the URL do not explode the label set
+            route=request.url_rule.rule if request.url_rule else 'unmatched',
+            method=request.method,
+            status=response.status_code
+        )
+    return response
+
+app.after_request(response_cache.compress_response)
+
+def collect_cache_metrics():
+    cache_stats = protocol_cache.stats()
+    CACHE_HIT_RATIO.set(cache_stats['hit_ratio'])
+    if cache_stats['age_seconds'] is not None:
+        SNAPSHOT_AGE.set(cache_stats['age_seconds'])
+
+metrics.add_collector(collect_cache_metrics)
+
+# Opt-in profiling: single requests selected by `X-Profile: <ADMIN_TOKEN>` or PROFILE_SAMPLE_RATE,
+# and an always-on low-rate stack sampler per worker (STACK_SAMPLER_ENABLED)
+PROFILE_DIR = os.environ.get('PROFILE_DIR') or (
+    os.path.join(os.environ['DEFI_LOCK_DIR'], 'profiles') if os.environ.get('DEFI_LOCK_DIR') else None
+)
+request_profiler = RequestProfiler(
+    PROFILE_DIR,
+    routes=[route.strip() for route in os.environ.get('PROFILE_ROUTES', '/api/optimize,/api/protocols').split(',') if route.strip()],
+    admin_token=ADMIN_TOKEN or None,
+    sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+)
+app.before_request(request_profiler.start)
+# Registered last so it runs first, timing only the view
+app.after_request(request_profiler.finish)
+app.teardown_request(request_profiler.discard)
+
+# Memory accounting for sizing workers: tracing is switched for all workers through /api/admin/memory
+app.before_request(memory_tracker.sync)
+memory_tracker.add_component(
+    'protocol_snapshot', lambda: deep_sizeof(protocol_cache.snapshot.data) if protocol_cache.snapshot else 0
+)
+memory_tracker.add_component('defi_service', defi_service.memory_usage)
+memory_tracker.add_component('response_cache', response_cache.memory_usage)
+memory_tracker.add_component('apy_history_mapped', lambda: apy_history.stats()['file_bytes'])
+
+STACK_SAMPLER_ENABLED = os.environ.get('STACK_SAMPLER_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+stack_sampler = StackSampler(
+    PROFILE_DIR,
+    interval=float(os.environ.get('STACK_SAMPLER_INTERVAL', 0.01)),
+    flush_interval=float(os.environ.get('STACK_SAMPLER_FLUSH_INTERVAL', 60))
+)
 
 def advanced_portfolio_optimization(amount, risk_tolerance):
     """
@@ -340,11 +542,20 @@ def home():
         "timestamp": datetime.now().isoformat(),
         "endpoints": {
             "protocols": "/api/protocols",
+            "markets": "/api/markets",
             "optimize": "/api/optimize",
+            "optimize_batch": "/api/optimize/batch",
             "portfolio": "/api/portfolio/<address>",
             "analytics": "/api/analytics",
             "transactions": "/api/transactions/<address>",
-            "performance": "/api/portfolio-performance/<address>"
+            "performance": "/api/portfolio-performance/<address>",
+            "cache_stats": "/api/cache/stats",
+            "upstream_stats": "/api/upstream/stats",
+            "metrics": "/metrics",
+            "profiling_stats": "/api/profiling/stats",
+            "admin_memory": "/api/admin/memory",
+            "history": "/api/history?protocol=<id>&token=<symbol>&start=<unix>&end=<unix>",
+            "contract_state": "/api/contract/state?addresses=<address,...>"
         }
     })
 
@@ -354,25 +565,31 @@ def home():
 def get_protocols():
     """Get all available DeFi protocols with their current yields using real DeFi service"""
     try:
-        # Use the new DeFi service to get real protocol data
-        protocol_data = defi_service.get_real_protocol_data()
+        # Use the cached DeFi service snapshot to get real protocol data
+        snapshot = protocol_cache.get_snapshot()
         
-        # Convert to the expected format
-        protocols = {}
-        for protocol_id, protocol_info in protocol_data.items():
-            protocols[protocol_id] = {
-                "name": protocol_info.protocol.title(),
-                "apy": protocol_info.apy,
-                "tvl": protocol_info.tvl,
-                "risk": defi_service._get_risk_level(protocol_info.risk_score).lower(),
-                "tokens": protocol_info.tokens
+        def build():
+            # Convert to the expected format
+            protocols = {}
+            for protocol_id, protocol_info in snapshot.data.items():
+                protocols[protocol_id] = {
+                    "name": protocol_info.protocol.title(),
+                    "apy": protocol_info.apy,
+                    "tvl": protocol_info.tvl,
+                    "risk": defi_service._get_risk_level(protocol_info.risk_score).lower(),
+                    "tokens": protocol_info.tokens,
+                    "status": protocol_info.status,
+                    "age_seconds": protocol_info.age
+                }
+            return {
+                "protocols": protocols,
+                # Time the snapshot was fetched, so the body is identical for the whole version
+                "timestamp": datetime.fromtimestamp(snapshot.fetched_at).isoformat(),
+                "source": "real_defi_service"
             }
         
-        return jsonify({
-            "protocols": protocols,
-            "timestamp": datetime.now().isoformat(),
-            "source": "real_defi_service"
-        })
+        # Serialized once per snapshot version; pollers holding the ETag get a 304
+        return response_cache.respond('protocols', snapshot.version, build)
         
     except Exception as e:
         app.logger.error(f"Error fetching protocol data: {e}")
@@ -389,6 +606,31 @@ def get_protocols():
             "source": "mock_data_fallback"
         })
 
+@app.route('/api/markets', methods=['GET'])
+@handle_errors
+@rate_limit(max_requests=60, window=60)
+def get_markets():
+    """Get the per-(protocol, token) APY/TVL table from the current snapshot"""
+    snapshot = protocol_cache.get_snapshot()
+    token_filter = request.args.get('token')
+    
+    markets = [
+        {
+            "protocol": protocol_id,
+            "token": token,
+            "apy": market.apy,
+            "tvl": market.tvl
+        }
+        for (protocol_id, token), market in build_market_table(snapshot.data).items()
+        if not token_filter or token == token_filter.upper()
+    ]
+    
+    return jsonify({
+        "markets": markets,
+        "snapshot_version": snapshot.version,
+        "timestamp": datetime.now().isoformat()
+    })
+
 @app.route('/api/optimize', methods=['POST'])
 @handle_errors
 @rate_limit(max_requests=30, window=60)
@@ -397,10 +639,20 @@ def optimize_portfolio():
     data = request.get_json()
     amount = data.get('amount', 10000)
     risk_tolerance = data.get('risk_tolerance', 'medium')
+    strategy = data.get('strategy', 'tiered')
+    
+    if strategy not in OPTIMIZATION_STRATEGIES:
+        return jsonify({
+            "error": "Bad request",
+            "message": f"'strategy' must be one of {', '.join(OPTIMIZATION_STRATEGIES)}"
+        }), 400
     
     try:
-        # Use the new DeFi service for real optimization
-        optimization_result = defi_service.optimize_portfolio(amount, risk_tolerance)
+        # Use the new DeFi service for real optimization on the cached snapshot
+        snapshot = protocol_cache.get_snapshot()
+        optimization_result = defi_service.optimize_portfolio(
+            amount, risk_tolerance, snapshot.data, strategy=strategy, snapshot_version=snapshot.version
+        )
         
         # Add execution strategy
         execution_result = defi_service.execute_yield_strategy(
@@ -412,6 +664,7 @@ def optimize_portfolio():
         # Combine optimization and execution results
         result = {
             **optimization_result,
+            "strategy": strategy,
             "execution": execution_result,
             "timestamp": datetime.now().isoformat(),
             "source": "real_defi_optimization"
@@ -424,6 +677,198 @@ def optimize_portfolio():
         # Fallback to mock optimization
         return jsonify(advanced_portfolio_optimization(amount, risk_tolerance))
 
+@app.route('/api/cache/stats', methods=['GET'])
+@handle_errors
+def get_cache_stats():
+    """Get protocol data cache hit/miss counters and snapshot age"""
+    return jsonify({
+        "protocol_cache": protocol_cache.stats(),
+        "refresher": protocol_refresher.status(),
+        "apy_history": apy_history.stats(),
+        "responses": response_cache.stats(),
+        "rate_limiter": rate_limiter.stats(),
+        "timestamp": datetime.now().isoformat()
+    })
+
+@app.route('/api/profiling/stats', methods=['GET'])
+@handle_errors
+@require_admin
+def get_profiling_stats():
+    """Get request profiler and stack sampler counters"""
+    return jsonify({
+        "requests": request_profiler.stats(),
+        "sampler": stack_sampler.stats(),
+        "timestamp": datetime.now().isoformat()
+    })
+
+@app.route('/api/admin/memory', methods=['GET', 'POST'])
+@handle_errors
+@require_admin
+def admin_memory():
+    """
+    Memory report of the worker serving the request; POST {"action": "start" | "stop" | "baseline"}
+    switches tracemalloc on or off in every worker, or marks the point growth is measured from
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        action = data.get('action')
+        if action == 'start':
+            try:
+                frames = int(data.get('frames') or memory_tracker.frames)
+            except (TypeError, ValueError):
+                return jsonify({"error": "Bad request", "message": "'frames' must be a number"}), 400
+            memory_tracker.enable(max(1, min(frames, 50)))
+        elif action == 'stop':
+            memory_tracker.disable()
+        elif action == 'baseline':
+            memory_tracker.set_baseline()
+        else:
+            return jsonify({"error": "Bad request", "message": "'action' must be 'start', 'stop' or 'baseline'"}), 400
+    
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    return jsonify({
+        **memory_tracker.report(limit=limit),
+        "timestamp": datetime.now().isoformat()
+    })
+
+@app.route('/api/upstream/stats', methods=['GET'])
+@handle_errors
+def get_upstream_stats():
+    """Get per-host upstream request and connection reuse counts"""
+    return jsonify({
+        "hosts": http_client.stats(),
+        "conditional_requests": http_client.conditional_stats(),
+        "coalescing": defi_service.coalescing_stats(),
+        "circuits": defi_service.circuit_stats(),
+        "deadline": defi_service.deadline_stats(),
+        "timestamp": datetime.now().isoformat()
+    })
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus text exposition merged across every worker and the yield updater"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/api/contract/state', methods=['GET'])
+@handle_errors
+@rate_limit(max_requests=30, window=60)
+def get_contract_state():
+    """Get on-chain contract stats and user positions, read in a single round trip"""
+    reader, contract = get_contract_reader()
+    if reader is None:
+        return jsonify({
+            "error": "Not configured",
+            "message": "On-chain reads need web3, CONTRACT_ADDRESS and RPC_URL"
+        }), 503
+    
+    addresses = [address.strip() for address in request.args.get('addresses', '').split(',') if address.strip()]
+    if len(addresses) > MAX_CONTRACT_READ_ADDRESSES or not all(Web3.is_address(address) for address in addresses):
+        return jsonify({
+            "error": "Bad request",
+            "message": f"'addresses' must be at most {MAX_CONTRACT_READ_ADDRESSES} comma-separated addresses"
+        }), 400
+    
+    state = read_aggregator_state(reader, contract, addresses)
+    return jsonify({
+        **state,
+        "contract": contract.address,
+        "reads": reader.stats(),
+        "timestamp": datetime.now().isoformat()
+    })
+
+@app.route('/api/history', methods=['GET'])
+@handle_errors
+@rate_limit(max_requests=60, window=60)
+def get_apy_history():
+    """Get recorded APY/TVL samples for one (protocol, token) series"""
+    protocol = request.args.get('protocol')
+    token = request.args.get('token', 'USDC').upper()
+    try:
+        start = float(request.args['start']) if 'start' in request.args else None
+        end = float(request.args['end']) if 'end' in request.args else None
+        limit = min(int(request.args.get('limit', 1000)), MAX_HISTORY_SAMPLES)
+    except ValueError:
+        return jsonify({"error": "Bad request", "message": "'start', 'end' and 'limit' must be numbers"}), 400
+    if not protocol:
+        return jsonify({"error": "Bad request", "message": "'protocol' is required"}), 400
+    
+    # Most recent samples win when the range holds more than limit
+    samples = apy_history.series(protocol, token, start, end, limit=limit) if limit > 0 else []
+    return jsonify({
+        "protocol": protocol,
+        "token": token,
+        "samples": [
+            {"timestamp": int(timestamp), "apy": float(apy), "tvl": float(tvl)}
+            for timestamp, apy, tvl in zip(samples['timestamp'], samples['apy'], samples['tvl'])
+        ] if len(samples) else [],
+        "count": len(samples),
+        "timestamp": datetime.now().isoformat()
+    })
+
+# Upper bound on quotes per batch call to keep a single request's CPU time bounded
+MAX_BATCH_SIZE = int(os.environ.get('OPTIMIZE_MAX_BATCH_SIZE', 1000))
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+def batch_item_error(item):
+    """Why one /api/optimize/batch item is invalid, or None"""
+    if not isinstance(item, dict):
+        return "must be an object"
+    amount = item.get('amount', 10000)
+    if not _is_number(amount) or amount <= 0:
+        return "'amount' must be a positive number"
+    constraints = item.get('constraints')
+    if constraints is None:
+        return None
+    if not isinstance(constraints, dict):
+        return "'constraints' must be an object"
+    if 'max_risk' in constraints and (not _is_number(constraints['max_risk']) or constraints['max_risk'] <= 0):
+        return "'constraints.max_risk' must be a positive number"
+    if 'max_allocation' in constraints and (not _is_number(constraints['max_allocation'])
+                                           or not 0 < constraints['max_allocation'] <= 1):
+        return "'constraints.max_allocation' must be a number in (0, 1]"
+    protocols = constraints.get('protocols')
+    if protocols is not None and (not isinstance(protocols, list) or not all(isinstance(p, str) for p in protocols)):
+        return "'constraints.protocols' must be a list of protocol ids"
+    return None
+
+@app.route('/api/optimize/batch', methods=['POST'])
+@handle_errors
+@rate_limit(max_requests=10, window=60)
+def optimize_portfolio_batch():
+    """Optimize many portfolios against one protocol snapshot"""
+    data = request.get_json() or {}
+    batch = data.get('requests', [])
+    strategy = data.get('strategy', 'tiered')
+    
+    if not isinstance(batch, list) or len(batch) > MAX_BATCH_SIZE:
+        return jsonify({
+            "error": "Bad request",
+            "message": f"'requests' must be a list of at most {MAX_BATCH_SIZE} items"
+        }), 400
+    if strategy not in OPTIMIZATION_STRATEGIES:
+        return jsonify({
+            "error": "Bad request",
+            "message": f"'strategy' must be one of {', '.join(OPTIMIZATION_STRATEGIES)}"
+        }), 400
+    for index, item in enumerate(batch):
+        error = batch_item_error(item)
+        if error:
+            return jsonify({"error": "Bad request", "message": f"requests[{index}]: {error}"}), 400
+    
+    snapshot = protocol_cache.get_snapshot()
+    results = defi_service.optimize_portfolio_batch(batch, snapshot.data, strategy=strategy)
+    
+    return jsonify({
+        "results": results,
+        "count": len(results),
+        "strategy": strategy,
+        "snapshot_version": snapshot.version,
+        "timestamp": datetime.now().isoformat(),
+        "source": "real_defi_optimization"
+    })
+
 @app.route('/api/portfolio/<address>', methods=['GET'])
 def get_portfolio(address):
     """Get user's current portfolio"""
@@ -453,7 +898,44 @@ def get_portfolio(address):
 @app.route('/api/analytics', methods=['GET'])
 def get_analytics():
     """Get portfolio analytics and performance metrics"""
-    # Mock analytics data
+    analytics_engine.sync()
+    if analytics_engine.days:
+        monthly = analytics_engine.summary(f"{PERFORMANCE_DAYS}d")
+        weekly = analytics_engine.summary('7d')
+        annualize = math.sqrt(365)
+        return jsonify({
+            "performance": {
+                "total_return": round(analytics_engine.total_return() * 100, 4),
+                "monthly_return": round(monthly['compounded_return'] * 100, 4),
+                "weekly_return": round(weekly['compounded_return'] * 100, 4),
+                "daily_return": round(analytics_engine.recent()[-1][1] * 100, 4)
+            },
+            "risk_metrics": {
+                "sharpe_ratio": round(monthly['sharpe_ratio'] * annualize, 2),
+                "max_drawdown": round(-analytics_engine.drawdown()['max'] * 100, 4) or 0.0,
+                # Largest fall of the APY itself from its peak, in percent of the peak
+                "max_apy_drawdown": round(-analytics_engine.apy_drawdown()['max'] * 100, 4) or 0.0,
+                # Annualized, in percent
+                "volatility": round(next(iter(analytics_engine.ewma_volatility().values()), 0.0) * annualize * 100, 4),
+                "volatility_by_window": {
+                    f"{days}d": round(analytics_engine.summary(f"{days}d")['volatility'] * annualize * 100, 4)
+                    for days in ANALYTICS_WINDOWS
+                },
+                "ewma_volatility": {
+                    str(lam): round(volatility * annualize * 100, 4)
+                    for lam, volatility in analytics_engine.ewma_volatility().items()
+                }
+            },
+            "allocation": {
+                "compound": 40,
+                "aave": 60
+            },
+            "days": analytics_engine.days,
+            "source": "apy_history",
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    # Mock analytics data until history has been recorded
     analytics = {
         "performance": {
             "total_return": 15.2,
@@ -477,6 +959,10 @@ def get_analytics():
 @app.route('/api/transactions/<address>', methods=['GET'])
 def get_transaction_history(address):
     """Get user's transaction history"""
+    # The mock history does not depend on the address and is rebuilt once a day
+    return response_cache.respond('transactions', datetime.now().date().isoformat(), _mock_transaction_history)
+
+def _mock_transaction_history():
     # Mock transaction history data
     transactions = [
         {
@@ -536,46 +1022,71 @@ def get_transaction_history(address):
         }
     ]
     
-    return jsonify({
+    return {
         "transactions": transactions,
         "total_transactions": len(transactions),
         "timestamp": datetime.now().isoformat()
-    })
+    }
 
 @app.route('/api/portfolio-performance/<address>', methods=['GET'])
 def get_portfolio_performance(address):
     """Get portfolio performance over time"""
-    # Mock performance data over the last 30 days
-    performance_data = []
+    # Performance is derived from the shared weighted APY series only, so one body serves every address
+    analytics_engine.sync()
+    if analytics_engine.days:
+        version = ('history', analytics_engine.samples)
+    else:
+        version = ('simulated', datetime.now().date().isoformat())
+    return response_cache.respond('portfolio-performance', version, _portfolio_performance)
+
+def _portfolio_performance():
     base_value = 100000  # Starting portfolio value
     
-    for i in range(30):
-        date = datetime.now() - timedelta(days=29-i)
-        # Simulate realistic portfolio growth with some volatility
-        daily_return = 0.0003 + (i % 7 - 3) * 0.0001  # Small daily returns with weekly patterns
-        value = base_value * (1 + daily_return) ** (i + 1)
-        
-        performance_data.append({
-            "date": date.strftime("%Y-%m-%d"),
-            "value": round(value, 2),
-            "daily_return": round(daily_return * 100, 3),
-            "cumulative_return": round(((value - base_value) / base_value) * 100, 2)
-        })
+    if analytics_engine.days:
+        source = "apy_history"
+        recent = analytics_engine.recent()
+        # Rebase so the window starts at base_value
+        start_growth = recent[0][2] / (1 + recent[0][1])
+        performance_data = [
+            {
+                "date": datetime.utcfromtimestamp(day * 86400).strftime("%Y-%m-%d"),
+                "value": round(base_value * growth / start_growth, 2),
+                "daily_return": round(daily_return * 100, 3),
+                "cumulative_return": round((growth / start_growth - 1) * 100, 2)
+            }
+            for day, daily_return, growth in recent
+        ]
+        window = analytics_engine.summary(f"{PERFORMANCE_DAYS}d")
+        mean_return, volatility = window['mean_daily_return'] * 100, window['volatility'] * 100
+    else:
+        # No recorded history yet: mock performance data over the last 30 days
+        source = "simulated"
+        performance_data = []
+        stats = RollingStats()
+        for i in range(PERFORMANCE_DAYS):
+            date = datetime.now() - timedelta(days=PERFORMANCE_DAYS-1-i)
+            # Simulate realistic portfolio growth with some volatility
+            daily_return = 0.0003 + (i % 7 - 3) * 0.0001  # Small daily returns with weekly patterns
+            value = base_value * (1 + daily_return) ** (i + 1)
+            stats.push(round(daily_return * 100, 3))
+            
+            performance_data.append({
+                "date": date.strftime("%Y-%m-%d"),
+                "value": round(value, 2),
+                "daily_return": round(daily_return * 100, 3),
+                "cumulative_return": round(((value - base_value) / base_value) * 100, 2)
+            })
+        mean_return, volatility = stats.mean, stats.std
     
-    # Calculate summary metrics
+    # Summary metrics come from the rolling statistics, not a pass over the history
     current_value = performance_data[-1]["value"]
     total_return = performance_data[-1]["cumulative_return"]
-    
-    # Calculate volatility (standard deviation of daily returns)
-    daily_returns = [p["daily_return"] for p in performance_data]
-    mean_return = sum(daily_returns) / len(daily_returns)
-    variance = sum((r - mean_return) ** 2 for r in daily_returns) / len(daily_returns)
-    volatility = round(variance ** 0.5, 3)
+    volatility = round(volatility, 3)
     
     # Calculate Sharpe ratio (assuming 0% risk-free rate)
     sharpe_ratio = round(mean_return / volatility if volatility > 0 else 0, 2)
     
-    return jsonify({
+    return {
         "performance_data": performance_data,
         "summary": {
             "current_value": current_value,
@@ -585,8 +1096,9 @@ def get_portfolio_performance(address):
             "best_day": max(performance_data, key=lambda x: x["daily_return"]),
             "worst_day": min(performance_data, key=lambda x: x["daily_return"])
         },
+        "source": source,
         "timestamp": datetime.now().isoformat()
-    })
+    }
 
 if __name__ == '__main__':
     import os
@@ -597,15 +1109,30 @@ if __name__ == '__main__':
     print("📊 API Endpoints:")
     print("  GET  / - Health check")
     print("  GET  /api/protocols - Get all protocols")
+    print("  GET  /api/markets - Get per-protocol, per-token markets")
     print("  POST /api/optimize - Optimize portfolio")
+    print("  POST /api/optimize/batch - Optimize many portfolios on one snapshot")
     print("  GET  /api/portfolio/<address> - Get portfolio")
     print("  GET  /api/analytics - Get analytics")
     print("  GET  /api/transactions/<address> - Get transaction history")
     print("  GET  /api/portfolio-performance/<address> - Get portfolio performance")
+    print("  GET  /api/cache/stats - Get protocol cache statistics")
+    print("  GET  /api/upstream/stats - Get upstream connection reuse statistics")
+    print("  GET  /metrics - Prometheus metrics for all workers")
+    print("  GET  /api/profiling/stats - Get request profiler and stack sampler statistics (admin)")
+    print("  GET  /api/admin/memory - Get memory report (POST to start/stop tracing or set a baseline)")
+    print("  GET  /api/history - Get recorded APY history for a protocol and token")
+    print("  GET  /api/contract/state - Get on-chain stats and user positions")
     print(f"🌐 Server running on port {port}")
     print(f"🔧 Debug mode: {debug}")
     print(f"🌍 Environment: {os.environ.get('FLASK_ENV', 'production')}")
     
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        if REFRESHER_ENABLED:
+            protocol_refresher.start()
+        if STACK_SAMPLER_ENABLED:
+            stack_sampler.start()
+    
     try:
         app.run(debug=debug, host='0.0.0.0', port=port, threaded=True)
     except Exception as e:
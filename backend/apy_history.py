@@ -0,0 +1,257 @@
+"""
+APY History Store
+Append-only, memory-mapped time series of (protocol, token, timestamp, apy, tvl)
+records shared by the refresher, the yield updater and the API workers
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+from defi_service import ProtocolAPY, build_market_table
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: fall back to in-process locking only
+    fcntl = None
+
+# Fixed-width on-disk record; timestamps are unix seconds and never decrease within a file
+RECORD_DTYPE = np.dtype([
+    ('timestamp', '<i8'),
+    ('protocol', 'S16'),
+    ('token', 'S8'),
+    ('apy', '<f8'),
+    ('tvl', '<f8')
+])
+
+# Header: magic, record size, record count (count is written after the records it covers)
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('record_size', '<u8'), ('count', '<u8')])
+HEADER_SIZE = 64
+MAGIC = b'APYHIST1'
+
+class APYHistoryStore:
+    def __init__(self, path: str, min_interval: float = 60, initial_capacity: int = 64 * 1024):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        # Samples for a series closer together than min_interval are dropped (each worker's refresher writes)
+        self.min_interval = min_interval
+        self.initial_capacity = initial_capacity
+
+        self._lock = threading.Lock()
+        self._header: Optional[np.memmap] = None
+        self._records: Optional[np.memmap] = None
+        self._mapped_pid: Optional[int] = None
+        # Last timestamp per (protocol, token), kept current by scanning only records added since
+        self._last_seen: Dict[Tuple[bytes, bytes], int] = {}
+        self._scanned = 0
+        # Record positions per (protocol, token) as [positions, used], so series() never scans other series
+        self._series_index: Dict[Tuple[bytes, bytes], list] = {}
+        self._indexed = 0
+        self._stats = {'appended': 0, 'skipped': 0, 'remaps': 0}
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._file_lock():
+            self._init_file()
+
+    def __len__(self) -> int:
+        self._ensure_mapped()
+        return int(self._header['count'][0])
+
+    def append(self, samples: Iterable[Tuple[str, str, float, float]], timestamp: Optional[float] = None) -> int:
+        """Append (protocol, token, apy, tvl) samples at timestamp; returns the number written"""
+        timestamp = int(timestamp if timestamp is not None else time.time())
+        rows = [(protocol.encode()[:16], token.encode()[:8], apy, tvl) for protocol, token, apy, tvl in samples]
+        if not rows:
+            return 0
+
+        with self._lock, self._file_lock():
+            self._ensure_mapped()
+            count = int(self._header['count'][0])
+            self._scan_new(count)
+            if count:
+                # Keep the file sorted by time even if writer clocks disagree slightly
+                timestamp = max(timestamp, int(self._records['timestamp'][count - 1]))
+
+            fresh = [row for row in rows if timestamp - self._last_seen.get(row[:2], -self.min_interval) >= self.min_interval]
+            self._stats['skipped'] += len(rows) - len(fresh)
+            if not fresh:
+                return 0
+
+            self._reserve(count + len(fresh))
+            block = self._records[count:count + len(fresh)]
+            block['timestamp'] = timestamp
+            block['protocol'] = [row[0] for row in fresh]
+            block['token'] = [row[1] for row in fresh]
+            block['apy'] = [row[2] for row in fresh]
+            block['tvl'] = [row[3] for row in fresh]
+            self._records.flush()
+            # Publish the records only once they are fully written
+            self._header['count'][0] = count + len(fresh)
+            self._header.flush()
+
+            for row in fresh:
+                self._last_seen[row[:2]] = timestamp
+            self._scanned = count + len(fresh)
+            self._stats['appended'] += len(fresh)
+            return len(fresh)
+
+    def append_markets(self, protocol_data: Dict[str, ProtocolAPY], timestamp: Optional[float] = None) -> int:
+        """Record every (protocol, token) market of a protocol snapshot"""
+        return self.append(
+            ((protocol_id, token, market.apy, market.tvl) for (protocol_id, token), market in build_market_table(protocol_data).items()),
+            timestamp
+        )
+
+    def range(self, start: Optional[float] = None, end: Optional[float] = None) -> np.ndarray:
+        """Zero-copy view of all records with start <= timestamp < end"""
+        self._ensure_mapped()
+        records = self._records[:int(self._header['count'][0])]
+        timestamps = records['timestamp']
+        lo = int(np.searchsorted(timestamps, start, side='left')) if start is not None else 0
+        hi = int(np.searchsorted(timestamps, end, side='left')) if end is not None else len(records)
+        return records[lo:hi]
+
+    def since(self, index: int) -> np.ndarray:
+        """Zero-copy view of the records appended after the first index records"""
+        self._ensure_mapped()
+        return self._records[index:int(self._header['count'][0])]
+
+    def series(self, protocol: str, token: str = 'USDC', start: Optional[float] = None,
+               end: Optional[float] = None, limit: Optional[int] = None) -> np.ndarray:
+        """Records of one (protocol, token) series within [start, end), only the latest limit when given"""
+        with self._lock:
+            self._ensure_mapped()
+            count = int(self._header['count'][0])
+            self._index_new(count)
+            entry = self._series_index.get((protocol.encode()[:16], token.encode()[:8]))
+            positions = entry[0][:entry[1]] if entry else np.empty(0, dtype=np.int64)
+
+        timestamps = self._records['timestamp'][:count]
+        lo = int(np.searchsorted(timestamps, start, side='left')) if start is not None else 0
+        hi = int(np.searchsorted(timestamps, end, side='left')) if end is not None else count
+        # Positions are sorted, so the range maps to a slice of them
+        first = int(np.searchsorted(positions, lo, side='left'))
+        last = int(np.searchsorted(positions, hi, side='left'))
+        if limit is not None:
+            first = max(first, last - limit)
+        return self._records[positions[first:last]]
+
+    def stats(self) -> Dict:
+        self._ensure_mapped()
+        count = int(self._header['count'][0])
+        return {
+            **self._stats,
+            'records': count,
+            'capacity': len(self._records),
+            'file_bytes': HEADER_SIZE + len(self._records) * RECORD_DTYPE.itemsize,
+            'first_timestamp': int(self._records['timestamp'][0]) if count else None,
+            'last_timestamp': int(self._records['timestamp'][count - 1]) if count else None
+        }
+
+    def _init_file(self):
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= HEADER_SIZE:
+            header = np.memmap(self.path, dtype=HEADER_DTYPE, mode='r', shape=(1,))
+            if header['magic'][0] != MAGIC or header['record_size'][0] != RECORD_DTYPE.itemsize:
+                raise ValueError(f"{self.path} is not an APY history file with {RECORD_DTYPE.itemsize}-byte records")
+            return
+
+        with open(self.path, 'wb') as f:
+            f.truncate(HEADER_SIZE + self.initial_capacity * RECORD_DTYPE.itemsize)
+        header = np.memmap(self.path, dtype=HEADER_DTYPE, mode='r+', shape=(1,))
+        header['magic'] = MAGIC
+        header['record_size'] = RECORD_DTYPE.itemsize
+        header['count'] = 0
+        header.flush()
+
+    def _ensure_mapped(self):
+        """Map the file, remapping after fork or after another process grew it"""
+        capacity = (os.path.getsize(self.path) - HEADER_SIZE) // RECORD_DTYPE.itemsize
+        if self._records is not None and self._mapped_pid == os.getpid() and len(self._records) == capacity:
+            return
+        self._header = np.memmap(self.path, dtype=HEADER_DTYPE, mode='r+', shape=(1,))
+        self._records = np.memmap(self.path, dtype=RECORD_DTYPE, mode='r+', offset=HEADER_SIZE, shape=(capacity,))
+        self._mapped_pid = os.getpid()
+        self._stats['remaps'] += 1
+
+    def _reserve(self, needed: int):
+        capacity = len(self._records)
+        if needed <= capacity:
+            return
+        # Double the file so appends stay amortised O(1)
+        while capacity < needed:
+            capacity *= 2
+        self._records.flush()
+        with open(self.path, 'r+b') as f:
+            f.truncate(HEADER_SIZE + capacity * RECORD_DTYPE.itemsize)
+        self._ensure_mapped()
+
+    def _scan_new(self, count: int):
+        if count < self._scanned:
+            # File was replaced underneath us; rebuild the per-series index
+            self._last_seen = {}
+            self._scanned = 0
+        if not count:
+            return
+        # Records older than min_interval before the newest one can never block a new sample
+        timestamps = self._records['timestamp'][:count]
+        horizon = int(np.searchsorted(timestamps, int(timestamps[-1]) - self.min_interval, side='left'))
+        new = self._records[max(self._scanned, horizon):count]
+        for protocol, token, timestamp in zip(new['protocol'], new['token'], new['timestamp']):
+            self._last_seen[(bytes(protocol), bytes(token))] = int(timestamp)
+        self._scanned = count
+
+    def _index_new(self, count: int):
+        """Add records appended since the last call to the per-series position index"""
+        if count < self._indexed:
+            # File was replaced underneath us; rebuild the index
+            self._series_index = {}
+            self._indexed = 0
+        if count == self._indexed:
+            return
+        new = self._records[self._indexed:count]
+        keys, inverse = np.unique(np.char.add(np.char.add(new['protocol'], b'|'), new['token']), return_inverse=True)
+        for group, key in enumerate(keys):
+            protocol, token = bytes(key).split(b'|', 1)
+            positions = np.flatnonzero(inverse == group) + self._indexed
+            entry = self._series_index.setdefault((protocol, token), [np.empty(max(64, len(positions)), dtype=np.int64), 0])
+            used = entry[1] + len(positions)
+            if used > len(entry[0]):
+                # Double so indexing stays amortised O(1) per record
+                grown = np.empty(max(used, 2 * len(entry[0])), dtype=np.int64)
+                grown[:entry[1]] = entry[0][:entry[1]]
+                entry[0] = grown
+            entry[0][entry[1]:used] = positions
+            entry[1] = used
+        self._indexed = count
+
+    def _file_lock(self):
+        return _FileLock(self.path + '.lock')
+
+class _FileLock:
+    """Exclusive cross-process lock on a sidecar file (no-op without fcntl)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._file = open(self.path, 'a+')
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+# Default store shared by the API, the refresher and the yield updater
+DEFAULT_HISTORY_PATH = os.environ.get(
+    'APY_HISTORY_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'apy_history.bin')
+)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Local Chain Check
+Exercises the yield updater's transaction pipeline and contract reads against a
+local Hardhat or anvil node forked from Sepolia, with the production contract deployed
+(contracts/scripts/deploy-production.js --network localhost)
+"""
+
+import os
+import sys
+import time
+
+from yield_updater import YieldUpdater
+
+# Account #0 of the default Hardhat/anvil mnemonic (public test key, owner of the deployed contract)
+LOCAL_DEPLOYER_KEY = "0xac0974bec39a17e36ba4a6b4d238ff944bacb478cbed5efcae784d7bf4f2ff80"
+
+def wait_for(condition, timeout, interval=0.1):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(interval)
+    return condition()
+
+def check(passed, message):
+    print(f"{'✅' if passed else '❌'} {message}")
+    if not passed:
+        raise SystemExit(1)
+
+def current_apy(updater):
+    # Read straight from the contract, bypassing the per-block read cache
+    return updater.contract.functions.getStats().call()[4]
+
+def submit_update(updater, new_apy):
+    updater.last_apy = current_apy(updater)
+    started = time.perf_counter()
+    submitted = updater.update_contract_yield(new_apy, "local_check")
+    return submitted, time.perf_counter() - started
+
+def main():
+    contract_address = os.getenv("CONTRACT_ADDRESS")
+    if not contract_address:
+        print("CONTRACT_ADDRESS must point at the contract deployed on the local node")
+        return 2
+
+    updater = YieldUpdater(
+        contract_address=contract_address,
+        rpc_url=os.getenv("RPC_URL", "http://127.0.0.1:8545"),
+        private_key=os.getenv("PRIVATE_KEY", LOCAL_DEPLOYER_KEY)
+    )
+    check(updater.w3.is_connected() and updater.w3.eth.chain_id == 31337, f"Connected to a local node at {updater.rpc_url}")
+    pipeline = updater.tx_pipeline
+    pipeline.poll_interval = 0.2
+    pipeline.start()
+    try:
+        state = updater.get_contract_state([updater.account.address])
+        check(state is not None, f"Read contract state ({updater.reader.stats()['misses']} calls in one round trip)")
+
+        # 1. Submission returns before the receipt; confirmation arrives from the tracker thread
+        start_apy = current_apy(updater)
+        target = start_apy + 150 if start_apy + 150 <= 5000 else 922
+        submitted, elapsed = submit_update(updater, target)
+        check(submitted, f"Submitted update to {target / 100:.2f}% APY in {elapsed * 1000:.0f} ms")
+        check(wait_for(lambda: updater.pending_apy is None, 30), "Receipt confirmed in the background")
+        check(current_apy(updater) == target, "Contract APY matches the update")
+
+        # 2. A transaction that is not mined gets re-sent with bumped fees, then confirms
+        updater.w3.provider.make_request("evm_setAutomine", [False])
+        try:
+            pipeline.replace_after = 1
+            replaced = pipeline.stats['replaced']
+            # The contract ignores changes under 1%
+            target -= 150
+            submitted, _ = submit_update(updater, target)
+            check(submitted, f"Submitted update to {target / 100:.2f}% APY with automine off")
+            check(wait_for(lambda: pipeline.stats['replaced'] > replaced, 10), "Stuck transaction replaced with bumped fees")
+        finally:
+            updater.w3.provider.make_request("evm_setAutomine", [True])
+        updater.w3.provider.make_request("evm_mine", [])
+        check(wait_for(lambda: updater.pending_apy is None, 30), "Replacement confirmed after mining")
+        check(current_apy(updater) == target, "Contract APY matches the replaced update")
+        print(f"📦 Pipeline stats: {pipeline.stats}")
+    finally:
+        pipeline.stop()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""
+Circuit Breaker
+Per-upstream closed/open/half-open breaker with error-rate and latency trip
+conditions, and a request timeout adapted to the observed p95 latency
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+from typing import Callable, Dict, TypeVar
+
+import numpy as np
+
+T = TypeVar('T')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"Circuit for {name} is open, retrying in {retry_in:.1f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+class CircuitBreaker:
+    def __init__(self, name: str, window: int = 20, min_calls: int = 4, error_rate_threshold: float = 0.5,
+                 slow_call_seconds: float = 5.0, slow_rate_threshold: float = 0.8, open_seconds: float = 30.0,
+                 half_open_max_calls: int = 1, min_timeout: float = 1.0, max_timeout: float = 10.0,
+                 timeout_multiplier: float = 2.0):
+        self.logger = logging.getLogger(__name__)
+        self.name = name
+        # Trips when, over the last `window` calls (at least min_calls), the failure rate or
+        # the share of calls slower than slow_call_seconds reaches its threshold
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate_threshold = error_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate_threshold = slow_rate_threshold
+        # Stays open for open_seconds, then lets half_open_max_calls trial calls through
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        # Timeout = timeout_multiplier * p95 of recent successful calls, clamped to [min_timeout, max_timeout]
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_multiplier = timeout_multiplier
+
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self._outcomes = deque(maxlen=window)  # (failed, slow)
+        self._latencies = deque(maxlen=100)
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def timeout(self) -> float:
+        """Request timeout for the next call, derived from recent latency"""
+        latencies = list(self._latencies)
+        if len(latencies) < self.min_calls:
+            return self.max_timeout
+        p95 = float(np.percentile(latencies, 95))
+        return min(self.max_timeout, max(self.min_timeout, p95 * self.timeout_multiplier))
+
+    def call(self, fn: Callable[[float], T]) -> T:
+        """Run fn(timeout) through the breaker; raises CircuitOpenError without calling fn while open"""
+        self._before_call()
+        started = time.monotonic()
+        try:
+            result = fn(self.timeout())
+        except Exception:
+            self._record(failed=True, latency=time.monotonic() - started)
+            raise
+        self._record(failed=False, latency=time.monotonic() - started)
+        return result
+
+    def status(self) -> Dict:
+        with self._lock:
+            state = self._current_state()
+            failures = sum(1 for failed, _ in self._outcomes if failed)
+            return {
+                **self._stats,
+                'state': state,
+                'error_rate': round(failures / len(self._outcomes), 4) if self._outcomes else 0,
+                'timeout_seconds': round(self.timeout(), 3),
+                'retry_in': round(max(0.0, self._opened_at + self.open_seconds - time.monotonic()), 2) if state == OPEN else None
+            }
+
+    def _current_state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._half_open_calls = 0
+        return self._state
+
+    def _before_call(self):
+        with self._lock:
+            state = self._current_state()
+            if state == OPEN or (state == HALF_OPEN and self._half_open_calls >= self.half_open_max_calls):
+                self._stats['rejected'] += 1
+                raise CircuitOpenError(self.name, max(0.0, self._opened_at + self.open_seconds - time.monotonic()))
+            if state == HALF_OPEN:
+                self._half_open_calls += 1
+            self._stats['calls'] += 1
+
+    def _record(self, failed: bool, latency: float):
+        with self._lock:
+            slow = latency >= self.slow_call_seconds
+            if failed:
+                self._stats['failures'] += 1
+            else:
+                self._latencies.append(latency)
+
+            if self._state == HALF_OPEN:
+                # One trial decides: healthy again, or back to open for another full period
+                if failed or slow:
+                    self._open()
+                else:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                    self.logger.info(f"Circuit for {self.name} closed")
+                return
+
+            self._outcomes.append((failed, slow))
+            if len(self._outcomes) < self.min_calls:
+                return
+            error_rate = sum(1 for failed, _ in self._outcomes if failed) / len(self._outcomes)
+            slow_rate = sum(1 for _, slow in self._outcomes if slow) / len(self._outcomes)
+            if self._state == CLOSED and (error_rate >= self.error_rate_threshold or slow_rate >= self.slow_rate_threshold):
+                self._open()
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self._stats['opened'] += 1
+        self.logger.warning(f"Circuit for {self.name} opened for {self.open_seconds:.0f}s")
@@ -0,0 +1,448 @@
+"""
+Contract Reads
+Groups view calls into one Multicall3 aggregate3 call or one JSON-RPC batch
+request and decodes the results in bulk
+"""
+
+import time
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from eth_abi import decode, encode
+from hexbytes import HexBytes
+from web3 import Web3
+
+from http_client import http_client
+from metrics import metrics
+
+RPC_LATENCY = metrics.histogram('rpc_request_seconds', 'Latency of JSON-RPC round trips', ['method'])
+
+# Canonical Multicall3 deployment (same address on mainnet, Sepolia and most forks)
+MULTICALL3_ADDRESS = '0xcA11bde05977b3631167028862bE2a173976CA11'
+
+# View functions of AIYieldAggregatorProduction used by the updater and the API
+AGGREGATOR_VIEW_ABI = [
+    {
+        "inputs": [],
+        "name": "getStats",
+        "outputs": [
+            {"name": "totalDeposits_", "type": "uint256"},
+            {"name": "totalFeesCollected_", "type": "uint256"},
+            {"name": "totalYieldGenerated_", "type": "uint256"},
+            {"name": "contractBalance_", "type": "uint256"},
+            {"name": "currentAPY_", "type": "uint256"},
+            {"name": "lastUpdate_", "type": "uint256"}
+        ],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "inputs": [{"name": "user", "type": "address"}],
+        "name": "getUserPosition",
+        "outputs": [
+            {"name": "totalDeposited", "type": "uint256"},
+            {"name": "totalWithdrawn", "type": "uint256"},
+            {"name": "currentYield", "type": "uint256"},
+            {"name": "totalFeesPaid", "type": "uint256"},
+            {"name": "isActive", "type": "bool"},
+            {"name": "realAPY", "type": "uint256"}
+        ],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "inputs": [],
+        "name": "USDC",
+        "outputs": [{"name": "", "type": "address"}],
+        "stateMutability": "view",
+        "type": "function"
+    }
+]
+
+ERC20_BALANCE_ABI = [
+    {
+        "inputs": [{"name": "account", "type": "address"}],
+        "name": "balanceOf",
+        "outputs": [{"name": "", "type": "uint256"}],
+        "stateMutability": "view",
+        "type": "function"
+    }
+]
+
+def _abi_type(param: Dict) -> str:
+    """Canonical type string for an ABI parameter, expanding tuple components"""
+    abi_type = param['type']
+    if abi_type.startswith('tuple'):
+        inner = ','.join(_abi_type(component) for component in param['components'])
+        return f"({inner}){abi_type[len('tuple'):]}"
+    return abi_type
+
+@dataclass(frozen=True)
+class ContractCall:
+    address: str
+    abi: Dict[str, Any]
+    args: Tuple = ()
+
+    @classmethod
+    def from_function(cls, function) -> 'ContractCall':
+        """Build from a bound web3 call such as contract.functions.getStats()"""
+        return cls(function.address, function.abi, tuple(function.args or ()))
+
+    @property
+    def input_types(self) -> List[str]:
+        return [_abi_type(param) for param in self.abi.get('inputs', [])]
+
+    @property
+    def output_types(self) -> List[str]:
+        return [_abi_type(param) for param in self.abi.get('outputs', [])]
+
+    @property
+    def name(self) -> str:
+        return self.abi['name']
+
+    def encode(self) -> bytes:
+        signature = f"{self.name}({','.join(self.input_types)})"
+        return bytes(Web3.keccak(text=signature)[:4]) + encode(self.input_types, list(self.args))
+
+    def decode(self, data: bytes) -> Any:
+        """Decoded return value; a single output is unwrapped from its tuple"""
+        values = decode(self.output_types, data)
+        return values[0] if len(values) == 1 else values
+
+class ContractReadError(Exception):
+    pass
+
+class ContractReader:
+    """
+    Reads many view functions in one round trip: through Multicall3 when it is
+    deployed on the chain, otherwise as a single JSON-RPC batch of eth_call
+    requests (which a local Hardhat node without Multicall3 supports)
+    """
+
+    def __init__(self, w3, rpc_url: Optional[str] = None, mode: str = 'auto',
+                 multicall_address: str = MULTICALL3_ADDRESS, max_batch_size: int = 100, timeout: float = 10):
+        if mode not in ('auto', 'multicall', 'batch'):
+            raise ValueError(f"Unknown contract read mode: {mode}")
+        self.logger = logging.getLogger(__name__)
+        self.w3 = w3
+        self.rpc_url = rpc_url or getattr(w3.provider, 'endpoint_uri', None)
+        self.mode = mode
+        self.multicall_address = Web3.to_checksum_address(multicall_address)
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout
+
+        self._multicall_available: Optional[bool] = None
+        self._lock = threading.Lock()
+        self._request_id = 0
+        self._stats = {'reads': 0, 'calls': 0, 'round_trips': 0, 'failed_calls': 0}
+
+    def read(self, calls: Sequence, block: Union[str, int] = 'latest', allow_failure: bool = False) -> List[Any]:
+        """
+        Execute calls (ContractCall or bound web3 functions) and return their decoded
+        results in order; failed calls come back as None when allow_failure is set
+        """
+        calls = [call if isinstance(call, ContractCall) else ContractCall.from_function(call) for call in calls]
+        if not calls:
+            return []
+
+        use_multicall = self._use_multicall()
+        results: List[Any] = []
+        for start in range(0, len(calls), self.max_batch_size):
+            chunk = calls[start:start + self.max_batch_size]
+            with RPC_LATENCY.time(method='multicall' if use_multicall else 'batch'):
+                if use_multicall:
+                    raw = self._read_multicall(chunk, block)
+                else:
+                    raw = self._read_batch(chunk, block)
+            results.extend(self._decode(chunk, raw, allow_failure))
+
+        with self._lock:
+            self._stats['reads'] += 1
+            self._stats['calls'] += len(calls)
+        return results
+
+    def stats(self) -> Dict:
+        """Calls served and JSON-RPC round trips they took"""
+        mode = self.mode if self.mode != 'auto' else ('multicall' if self._multicall_available else 'batch')
+        return {
+            **self._stats,
+            'mode': mode,
+            'calls_per_round_trip': round(self._stats['calls'] / self._stats['round_trips'], 2) if self._stats['round_trips'] else 0
+        }
+
+    def _use_multicall(self) -> bool:
+        if self.mode != 'auto':
+            return self.mode == 'multicall'
+        if self._multicall_available is None:
+            try:
+                self._multicall_available = len(self.w3.eth.get_code(self.multicall_address)) > 0
+            except Exception as e:
+                self.logger.warning(f"Could not check for Multicall3, using JSON-RPC batches: {e}")
+                self._multicall_available = False
+            self._count_round_trip()
+        return self._multicall_available
+
+    def _read_multicall(self, calls: List[ContractCall], block: str) -> List[Tuple[bool, bytes]]:
+        aggregate = ContractCall(
+            self.multicall_address,
+            {
+                "name": "aggregate3",
+                "inputs": [{"type": "tuple[]", "components": [
+                    {"type": "address"}, {"type": "bool"}, {"type": "bytes"}
+                ]}],
+                "outputs": [{"type": "tuple[]", "components": [{"type": "bool"}, {"type": "bytes"}]}]
+            },
+            # allowFailure is always set so one revert does not hide the other results
+            ([(Web3.to_checksum_address(call.address), True, call.encode()) for call in calls],)
+        )
+        data = self.w3.eth.call({'to': aggregate.address, 'data': aggregate.encode()}, block)
+        self._count_round_trip()
+        return [(bool(success), bytes(return_data)) for success, return_data in aggregate.decode(bytes(data))]
+
+    def _read_batch(self, calls: List[ContractCall], block: str) -> List[Tuple[bool, bytes]]:
+        if not self.rpc_url:
+            raise ContractReadError("JSON-RPC batch reads need an HTTP RPC URL")
+
+        with self._lock:
+            first_id = self._request_id
+            self._request_id += len(calls)
+        block_param = hex(block) if isinstance(block, int) else block
+        payload = [
+            {
+                'jsonrpc': '2.0',
+                'id': first_id + i,
+                'method': 'eth_call',
+                'params': [{'to': Web3.to_checksum_address(call.address), 'data': '0x' + call.encode().hex()}, block_param]
+            }
+            for i, call in enumerate(calls)
+        ]
+        response = http_client.post(self.rpc_url, json=payload, timeout=self.timeout)
+        self._count_round_trip()
+        response.raise_for_status()
+        body = response.json()
+        if not isinstance(body, list):
+            # Nodes answer a rejected batch with a single error object
+            raise ContractReadError(f"JSON-RPC batch rejected: {body.get('error', body)}")
+
+        by_id = {item.get('id'): item for item in body}
+        raw = []
+        for i in range(len(calls)):
+            item = by_id.get(first_id + i, {})
+            if 'result' in item:
+                raw.append((True, bytes.fromhex(item['result'][2:])))
+            else:
+                raw.append((False, item.get('error', {}).get('message', 'missing response').encode()))
+        return raw
+
+    def _decode(self, calls: List[ContractCall], raw: List[Tuple[bool, bytes]], allow_failure: bool) -> List[Any]:
+        results = []
+        for call, (success, data) in zip(calls, raw):
+            try:
+                if not success:
+                    raise ContractReadError(f"{call.name} on {call.address} failed: {data[:200]!r}")
+                results.append(call.decode(data))
+            except Exception:
+                with self._lock:
+                    self._stats['failed_calls'] += 1
+                if not allow_failure:
+                    raise
+                results.append(None)
+        return results
+
+    def _count_round_trip(self):
+        with self._lock:
+            self._stats['round_trips'] += 1
+
+class BlockTracker:
+    """
+    Follows the chain head with one latest-block header poll per poll_interval (or
+    headers pushed to observe() from a newHeads subscription) and remembers the
+    last reorg_depth block hashes so reorgs can be detected from parent hashes
+    """
+
+    def __init__(self, w3, poll_interval: float = 1.0, reorg_depth: int = 6):
+        self.logger = logging.getLogger(__name__)
+        self.w3 = w3
+        self.poll_interval = poll_interval
+        self.reorg_depth = reorg_depth
+
+        self._head: Optional[int] = None
+        self._hashes: Dict[int, HexBytes] = {}
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._reorg_listeners: List[Callable[[int], None]] = []
+        self._stats = {'polls': 0, 'polls_saved': 0, 'new_blocks': 0, 'reorgs': 0}
+
+    def head(self) -> int:
+        """Latest block number, polled at most once per poll_interval"""
+        if self._head is not None and time.monotonic() - self._checked_at < self.poll_interval:
+            self._stats['polls_saved'] += 1
+            return self._head
+
+        # The header, not just the number: a reorg can replace the head at the same height
+        block = self.w3.eth.get_block('latest')
+        self._checked_at = time.monotonic()
+        self._stats['polls'] += 1
+        if block['number'] != self._head or HexBytes(block['hash']) != self._hashes.get(block['number']):
+            self.observe(block['number'], block['hash'], block['parentHash'])
+        return self._head
+
+    def observe(self, number: int, block_hash, parent_hash):
+        """Record a new head; drops remembered blocks and notifies listeners when it forks from them"""
+        block_hash, parent_hash = HexBytes(block_hash), HexBytes(parent_hash)
+        with self._lock:
+            fork = None
+            if self._head is not None and number <= self._head:
+                # Same height with a new hash, or the chain was rewound (e.g. evm_revert on Hardhat)
+                if self._hashes.get(number) != block_hash:
+                    fork = number
+            elif self._hashes.get(number - 1) not in (None, parent_hash):
+                fork = self._find_fork(number - 1)
+            elif number - 1 not in self._hashes and self._head in self._hashes:
+                # Skipped blocks: make sure the last head we saw is still canonical
+                fork = self._find_fork(self._head)
+
+            if fork is not None:
+                for stale in [n for n in self._hashes if n >= fork]:
+                    del self._hashes[stale]
+                self._stats['reorgs'] += 1
+                self.logger.warning(f"Chain reorganised from block {fork}, new head {number}")
+
+            self._hashes[number] = block_hash
+            self._head = number
+            self._stats['new_blocks'] += 1
+            for old in [n for n in self._hashes if n <= number - self.reorg_depth]:
+                del self._hashes[old]
+
+        if fork is not None:
+            for listener in self._reorg_listeners:
+                listener(fork)
+
+    def add_reorg_listener(self, listener: Callable[[int], None]):
+        """Call listener with the first replaced block number whenever a reorg is detected"""
+        self._reorg_listeners.append(listener)
+
+    def stats(self) -> Dict:
+        return {**self._stats, 'head': self._head}
+
+    def _find_fork(self, number: int) -> Optional[int]:
+        """Lowest remembered block at or below number that is no longer canonical, or None"""
+        fork = None
+        while number in self._hashes:
+            if self.w3.eth.get_block(number)['hash'] == self._hashes[number]:
+                break
+            fork = number
+            number -= 1
+        return fork
+
+class CachedContractReader:
+    """
+    Caches view call results by (contract, calldata, block number): contract state
+    only changes with a new block, so repeated reads within a block are free
+    """
+
+    def __init__(self, reader: ContractReader, tracker: BlockTracker):
+        self.reader = reader
+        self.tracker = tracker
+        self._cache: Dict[Tuple[str, bytes, int], Any] = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'invalidated': 0}
+        tracker.add_reorg_listener(self._drop_from)
+
+    def read(self, calls: Sequence, allow_failure: bool = False) -> List[Any]:
+        """Same as ContractReader.read at the current head, serving cached results where possible"""
+        calls = [call if isinstance(call, ContractCall) else ContractCall.from_function(call) for call in calls]
+        head = self.tracker.head()
+        keys = [(Web3.to_checksum_address(call.address), call.encode(), head) for call in calls]
+
+        with self._lock:
+            # Results for earlier blocks can never be served again
+            for key in [key for key in self._cache if key[2] < head]:
+                del self._cache[key]
+            results = [self._cache.get(key) for key in keys]
+            missing = [i for i, key in enumerate(keys) if key not in self._cache]
+
+        if missing:
+            fetched = self.reader.read([calls[i] for i in missing], block=head, allow_failure=allow_failure)
+            with self._lock:
+                for i, value in zip(missing, fetched):
+                    results[i] = value
+                    # Failures are retried on the next read rather than cached
+                    if value is not None:
+                        self._cache[keys[i]] = value
+
+        with self._lock:
+            self._stats['hits'] += len(calls) - len(missing)
+            self._stats['misses'] += len(missing)
+        return results
+
+    def stats(self) -> Dict:
+        lookups = self._stats['hits'] + self._stats['misses']
+        return {
+            **self._stats,
+            'hit_ratio': round(self._stats['hits'] / lookups, 4) if lookups else 0,
+            'entries': len(self._cache),
+            'block': self.tracker.stats(),
+            'reader': self.reader.stats()
+        }
+
+    def _drop_from(self, fork_block: int):
+        with self._lock:
+            stale = [key for key in self._cache if key[2] >= fork_block]
+            for key in stale:
+                del self._cache[key]
+            self._stats['invalidated'] += len(stale)
+
+def format_stats(stats) -> Dict[str, float]:
+    """getStats() result in USDC and percent"""
+    return {
+        'total_deposits': stats[0] / 1e6,  # Convert from wei to USDC
+        'total_fees': stats[1] / 1e6,
+        'total_yield': stats[2] / 1e6,
+        'contract_balance': stats[3] / 1e6,
+        'current_apy': stats[4] / 100,  # Convert from basis points
+        'last_update': stats[5]
+    }
+
+def format_position(position) -> Dict[str, Any]:
+    """getUserPosition() result in USDC and percent"""
+    return {
+        'total_deposited': position[0] / 1e6,
+        'total_withdrawn': position[1] / 1e6,
+        'current_yield': position[2] / 1e6,
+        'total_fees_paid': position[3] / 1e6,
+        'is_active': position[4],
+        'real_apy': position[5] / 100
+    }
+
+# USDC is immutable in the aggregator, so it is read once per contract
+_usdc_addresses: Dict[str, str] = {}
+
+def read_aggregator_state(reader: ContractReader, contract, users: Sequence[str] = ()) -> Dict[str, Any]:
+    """Contract stats plus each user's position and USDC balance, in one round trip"""
+    users = [Web3.to_checksum_address(user) for user in users]
+    usdc = None
+    if users:
+        if contract.address not in _usdc_addresses:
+            _usdc_addresses[contract.address] = Web3.to_checksum_address(reader.read([contract.functions.USDC()])[0])
+        usdc = contract.w3.eth.contract(address=_usdc_addresses[contract.address], abi=ERC20_BALANCE_ABI)
+
+    calls = [contract.functions.getStats()]
+    for user in users:
+        calls.append(contract.functions.getUserPosition(user))
+        calls.append(usdc.functions.balanceOf(user))
+    results = reader.read(calls, allow_failure=True)
+
+    positions = {}
+    for i, user in enumerate(users):
+        position, balance = results[1 + 2 * i], results[2 + 2 * i]
+        positions[user] = {
+            **(format_position(position) if position is not None else {}),
+            'wallet_usdc': balance / 1e6 if balance is not None else None
+        }
+    return {
+        'stats': format_stats(results[0]) if results[0] is not None else None,
+        'positions': positions
+    }
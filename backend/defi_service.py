@@ -3,11 +3,62 @@ DeFi Protocol Integration Service
 Handles real integration with DeFi protocols for yield farming
 """
 
-import requests
 import time
 import logging
-from typing import Dict, List, Optional
-from dataclasses import dataclass
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from functools import partial
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from dataclasses import asdict, dataclass, field, replace
+
+import numpy as np
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from http_client import ChangedBody, http_client
+from json_stream import iter_array_items
+from memory_tracker import deep_sizeof, memory_tracker
+from metrics import metrics
+from optimizer import cap_weights, mean_variance_weights
+from singleflight import SharedLease, SingleFlight
+
+# Chunk size used when streaming large upstream payloads (Yearn vaults, Curve pools)
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Allocation strategies accepted by optimize_portfolio
+OPTIMIZATION_STRATEGIES = ('tiered', 'mean_variance')
+
+# Risk tolerance mapping (risk_aversion/max_allocation drive the mean-variance strategy)
+RISK_PROFILES = {
+    'low': {'max_risk': 2.5, 'prefer_stable': True, 'risk_aversion': 4.0, 'max_allocation': 0.6},
+    'medium': {'max_risk': 3.5, 'prefer_stable': False, 'risk_aversion': 1.5, 'max_allocation': 0.5},
+    'high': {'max_risk': 5.0, 'prefer_stable': False, 'risk_aversion': 0.5, 'max_allocation': 0.6}
+}
+
+# Percentages handed to the 1st..4th highest-APY protocols by the tiered strategy
+TIERED_ALLOCATION = (40, 30, 20, 10)
+
+UPSTREAM_LATENCY = metrics.histogram('defi_upstream_request_seconds', 'Latency of protocol API requests', ['protocol'])
+UPSTREAM_ERRORS = metrics.counter(
+    'defi_upstream_errors_total', 'Protocol API requests that failed, were rejected by an open circuit or could not be parsed',
+    ['protocol', 'reason']
+)
+OPTIMIZER_SECONDS = metrics.histogram(
+    'defi_optimizer_seconds', 'Time to compute allocations for one plan or one batch', ['strategy', 'mode']
+)
+
+# Upstream symbols accepted for each supported token
+TOKEN_ALIASES = {
+    'ETH': ('ETH', 'WETH'),
+    'WETH': ('WETH', 'ETH')
+}
+
+@dataclass
+class MarketAPY:
+    protocol: str
+    token: str
+    apy: float
+    tvl: float
 
 @dataclass
 class ProtocolAPY:
@@ -16,6 +67,40 @@ class ProtocolAPY:
     tvl: float
     risk_score: float
     tokens: List[str]
+    # Per-token markets extracted from the same payload; apy/tvl above are the USDC market
+    markets: Dict[str, MarketAPY] = field(default_factory=dict)
+    # 'live', 'stale' (last good result served because the fetch missed its deadline) or 'fallback' (built-in defaults)
+    status: str = 'live'
+    # Seconds since a stale result was fetched
+    age: Optional[float] = None
+
+    @classmethod
+    def from_dict(cls, payload: Dict) -> 'ProtocolAPY':
+        markets = {token: MarketAPY(**market) for token, market in payload.get('markets', {}).items()}
+        return cls(**{**payload, 'markets': markets})
+
+def build_market_table(protocol_data: Dict[str, ProtocolAPY]) -> Dict[Tuple[str, str], MarketAPY]:
+    """Flatten protocol data into a (protocol, token) -> market table"""
+    table = {}
+    for protocol_id, apy_data in protocol_data.items():
+        markets = apy_data.markets or {
+            # Fallback data only carries the USDC figures
+            'USDC': MarketAPY(protocol_id, 'USDC', apy_data.apy, apy_data.tvl)
+        }
+        for token, market in markets.items():
+            table[(protocol_id, token)] = market
+    return table
+
+@dataclass(frozen=True)
+class AllocationPlan:
+    """Amount-independent optimization result; allocations carry percentages but no amounts"""
+    expected_apy: float
+    risk_level: str
+    sharpe_ratio: float
+    risk_score: float
+    diversification: int
+    confidence: float
+    allocations: Tuple[Dict, ...]
 
 @dataclass
 class YieldStrategy:
@@ -26,51 +111,235 @@ class YieldStrategy:
     min_deposit: float
 
 class DeFiService:
-    def __init__(self):
+    def __init__(self, max_workers: Optional[int] = None, concurrent_fetch: bool = True):
         self.logger = logging.getLogger(__name__)
+        # Number of protocol adapters fetched in parallel (one per protocol by default)
+        self.max_workers = max_workers or int(os.environ.get('DEFI_FETCH_WORKERS', 4))
+        self.concurrent_fetch = concurrent_fetch
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+        self._executor_lock = threading.Lock()
+        # Last successfully parsed result per protocol, reused when the upstream payload is unchanged
+        self._last_results: Dict[str, ProtocolAPY] = {}
+        # get_real_protocol_data returns after fetch_deadline seconds whatever has completed (0 waits for all)
+        self.fetch_deadline = float(os.environ.get('DEFI_FETCH_DEADLINE', 1.5))
+        # Last live result per protocol with the time it was fetched, served stale when a fetch runs late
+        self._last_good: Dict[str, Tuple[ProtocolAPY, float]] = {}
+        self._late_listeners: List[Callable[[Dict[str, ProtocolAPY]], None]] = []
+        self._deadline_stats = {'missed': 0, 'failed': 0, 'circuit_open': 0, 'served_stale': 0, 'served_fallback': 0, 'late_results': 0}
+        self._deadline_lock = threading.Lock()
+        # Allocation plans per (risk tier, strategy) for the latest snapshot version
+        self._plan_cache: Dict[Tuple[str, str], AllocationPlan] = {}
+        self._plan_version: Optional[int] = None
+        self._plan_lock = threading.Lock()
+        # One in-flight fetch per protocol per process, and one per protocol across gunicorn workers
+        self._single_flight = SingleFlight()
+        self._shared_lease = SharedLease(
+            directory=os.environ.get('DEFI_LOCK_DIR'),
+            result_ttl=float(os.environ.get('DEFI_SHARED_RESULT_TTL', 15)),
+            encode=lambda apy_data: asdict(apy_data) if apy_data else None,
+            decode=lambda payload: ProtocolAPY.from_dict(payload) if payload else None,
+            # Stale and fallback results would be replayed to other workers as if just fetched
+            shareable=lambda apy_data: apy_data is not None and apy_data.status == 'live'
+        )
         self.protocols = {
             'compound': {
                 'name': 'Compound',
                 'api_url': 'https://api.compound.finance/api/v2/ctoken',
                 'apy_endpoint': 'https://api.compound.finance/api/v2/ctoken',
-                'risk_score': 2.5
+                'risk_score': 2.5,
+                'refresh_interval': 120,
+                'refresh_jitter': 15
             },
             'aave': {
                 'name': 'Aave',
                 'api_url': 'https://aave-api-v2.aave.com/data/liquidity/v2',
                 'apy_endpoint': 'https://aave-api-v2.aave.com/data/liquidity/v2',
-                'risk_score': 3.0
+                'risk_score': 3.0,
+                'refresh_interval': 60,
+                'refresh_jitter': 10
             },
             'yearn': {
                 'name': 'Yearn Finance',
                 'api_url': 'https://api.yearn.finance/v1/chains/1/vaults/all',
                 'apy_endpoint': 'https://api.yearn.finance/v1/chains/1/vaults/all',
-                'risk_score': 3.5
+                'risk_score': 3.5,
+                # Large, slowly changing payload
+                'refresh_interval': 900,
+                'refresh_jitter': 60
             },
             'curve': {
                 'name': 'Curve Finance',
                 'api_url': 'https://api.curve.fi/api/getPools/ethereum',
                 'apy_endpoint': 'https://api.curve.fi/api/getPools/ethereum',
-                'risk_score': 2.0
+                'risk_score': 2.0,
+                # Large, slowly changing payload
+                'refresh_interval': 900,
+                'refresh_jitter': 60
             }
         }
+        # One breaker per upstream so a dead API fails over to the last good result instantly
+        self._breakers = {
+            protocol_id: CircuitBreaker(
+                protocol_id,
+                error_rate_threshold=float(os.environ.get('CIRCUIT_ERROR_RATE', 0.5)),
+                slow_call_seconds=float(os.environ.get('CIRCUIT_SLOW_CALL_SECONDS', 5)),
+                open_seconds=float(os.environ.get('CIRCUIT_OPEN_SECONDS', 30)),
+                min_timeout=float(os.environ.get('UPSTREAM_MIN_TIMEOUT', 1)),
+                max_timeout=float(os.environ.get('UPSTREAM_MAX_TIMEOUT', 10))
+            )
+            for protocol_id in self.protocols
+        }
     
-    def get_real_protocol_data(self) -> Dict[str, ProtocolAPY]:
-        """Fetch real-time data from DeFi protocols"""
+    def get_real_protocol_data(self, concurrent: Optional[bool] = None, deadline: Optional[float] = None) -> Dict[str, ProtocolAPY]:
+        """Fetch real-time data from DeFi protocols, returning within the fetch deadline"""
+        if deadline is None:
+            deadline = self.fetch_deadline
+        return self.fetch_protocols(self.protocols.keys(), concurrent, deadline=deadline or None)
+    
+    def fetch_protocols(self, protocol_ids: Iterable[str], concurrent: Optional[bool] = None,
+                        deadline: Optional[float] = None) -> Dict[str, ProtocolAPY]:
+        """
+        Fetch the given protocols, in parallel unless concurrency is disabled. With a deadline
+        (seconds), protocols still in flight are returned stale or as fallback data and their
+        fetches finish in the background, handing results to the late result listeners. Only
+        the parallel path is bounded: sequential fetches check the deadline between protocols,
+        so one slow upstream can still overrun it
+        """
+        if concurrent is None:
+            concurrent = self.concurrent_fetch
+        
         protocol_data = {}
         
-        for protocol_id, protocol_info in self.protocols.items():
-            try:
-                apy_data = self._fetch_protocol_apy(protocol_id, protocol_info)
+        if not concurrent or self.max_workers <= 1:
+            started = time.monotonic()
+            for protocol_id in protocol_ids:
+                if deadline is not None and time.monotonic() - started >= deadline:
+                    protocol_data[protocol_id] = self._serve_last_good(protocol_id, 'missed')
+                    continue
+                apy_data = self.fetch_protocol_data(protocol_id)
                 if apy_data:
-                    protocol_data[protocol_id] = apy_data
-            except Exception as e:
-                self.logger.error(f"Error fetching data for {protocol_id}: {e}")
-                # Fallback to cached/default data
-                protocol_data[protocol_id] = self._get_fallback_data(protocol_id)
+                    protocol_data[protocol_id] = self._remember(protocol_id, apy_data)
+            return protocol_data
+        
+        # Run every adapter at once so a request waits for the slowest upstream, not the sum
+        executor = self._get_executor()
+        futures = {
+            protocol_id: executor.submit(self.fetch_protocol_data, protocol_id)
+            for protocol_id in protocol_ids
+        }
+        done, _ = wait(futures.values(), timeout=deadline)
+        
+        for protocol_id, future in futures.items():
+            if future not in done:
+                # Bounded by the deadline, not by the slowest upstream
+                protocol_data[protocol_id] = self._serve_last_good(protocol_id, 'missed')
+                future.add_done_callback(partial(self._deliver_late, protocol_id))
+                continue
+            apy_data = future.result()
+            if apy_data:
+                protocol_data[protocol_id] = self._remember(protocol_id, apy_data)
         
         return protocol_data
     
+    def add_late_result_listener(self, listener: Callable[[Dict[str, ProtocolAPY]], None]):
+        """Call listener with {protocol_id: result} for each fetch that finished after its deadline"""
+        self._late_listeners.append(listener)
+    
+    def deadline_stats(self) -> Dict:
+        """Fetches that missed the deadline, failed or hit an open circuit, and what was served in their place"""
+        with self._deadline_lock:
+            return {**self._deadline_stats, 'deadline_seconds': self.fetch_deadline or None}
+    
+    def _remember(self, protocol_id: str, apy_data: ProtocolAPY) -> ProtocolAPY:
+        if apy_data.status == 'live':
+            self._last_good[protocol_id] = (apy_data, time.time())
+        return apy_data
+    
+    def _serve_last_good(self, protocol_id: str, reason: str) -> ProtocolAPY:
+        """
+        Last good result for a protocol marked stale with its age, or fallback data if there
+        is none; reason ('missed', 'failed', 'circuit_open') is counted in deadline_stats
+        """
+        last = self._last_good.get(protocol_id)
+        self._count_deadline(reason, 'served_fallback' if last is None else 'served_stale')
+        if last is None:
+            return self._get_fallback_data(protocol_id)
+        apy_data, fetched_at = last
+        return replace(apy_data, status='stale', age=round(time.time() - fetched_at, 1))
+    
+    def _count_deadline(self, *keys: str):
+        # Pool threads serve stale results and deliver late ones concurrently
+        with self._deadline_lock:
+            for key in keys:
+                self._deadline_stats[key] += 1
+    
+    def _deliver_late(self, protocol_id: str, future: Future):
+        try:
+            apy_data = future.result()
+        except Exception as e:
+            self.logger.error(f"Late fetch for {protocol_id} failed: {e}")
+            return
+        if not apy_data or apy_data.status != 'live':
+            # A failed late fetch has nothing better than what was already served
+            return
+        self._count_deadline('late_results')
+        self._remember(protocol_id, apy_data)
+        for listener in self._late_listeners:
+            try:
+                listener({protocol_id: apy_data})
+            except Exception as e:
+                self.logger.error(f"Late result listener {getattr(listener, '__name__', listener)} failed: {e}")
+    
+    def fetch_protocol_data(self, protocol_id: str) -> Optional[ProtocolAPY]:
+        """Fetch a single protocol with the same fallback semantics as get_real_protocol_data"""
+        # Concurrent callers share one upstream request instead of each fetching the protocol
+        return self._single_flight.do(
+            protocol_id,
+            lambda: self._shared_lease.run(
+                protocol_id,
+                lambda: self._fetch_with_fallback(protocol_id, self.protocols[protocol_id])
+            )
+        )
+    
+    def circuit_stats(self) -> Dict[str, Dict]:
+        """State, error rate and current adaptive timeout of each upstream's circuit breaker"""
+        return {protocol_id: breaker.status() for protocol_id, breaker in self._breakers.items()}
+    
+    def memory_usage(self) -> Dict[str, int]:
+        """Estimated bytes held by the per-protocol result caches and the allocation plan cache"""
+        return {
+            'last_results': deep_sizeof(self._last_results),
+            'last_good_results': deep_sizeof(self._last_good),
+            'allocation_plans': deep_sizeof(self._plan_cache)
+        }
+    
+    def coalescing_stats(self) -> Dict[str, Dict[str, int]]:
+        """Counts of fetches executed versus coalesced in-process and across workers"""
+        return {
+            'in_process': self._single_flight.stats(),
+            'cross_process': self._shared_lease.stats()
+        }
+    
+    def _fetch_with_fallback(self, protocol_id: str, protocol_info: Dict) -> Optional[ProtocolAPY]:
+        """Fetch a single protocol, falling back to the last good or default data on unexpected errors"""
+        try:
+            return self._fetch_protocol_apy(protocol_id, protocol_info)
+        except Exception as e:
+            self.logger.error(f"Error fetching data for {protocol_id}: {e}")
+            return self._serve_last_good(protocol_id, 'failed')
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Return the fetch thread pool, recreating it after a fork (gunicorn workers)"""
+        with self._executor_lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='defi-fetch'
+                )
+                self._executor_pid = os.getpid()
+            return self._executor
+    
     def _fetch_protocol_apy(self, protocol_id: str, protocol_info: Dict) -> Optional[ProtocolAPY]:
         """Fetch APY data from specific protocol"""
         try:
@@ -86,148 +355,273 @@ class DeFiService:
             self.logger.error(f"Error fetching {protocol_id} data: {e}")
             return None
     
+    def _fetch_if_changed(self, protocol_id: str, parse: Callable[[ChangedBody], Optional[ProtocolAPY]]) -> Optional[ProtocolAPY]:
+        """Conditionally fetch a protocol's API, reusing the last result when the payload is unchanged"""
+        previous = self._last_results.get(protocol_id)
+        started = time.perf_counter()
+        try:
+            body = self._breakers[protocol_id].call(lambda timeout: http_client.get_if_changed(
+                self.protocols[protocol_id]['api_url'],
+                key=f"defi:{protocol_id}",
+                force=previous is None,
+                timeout=timeout,
+                # The breaker and the fetch deadline own retries; one attempt keeps the timeout a real bound
+                retry=False
+            ))
+        except CircuitOpenError as e:
+            # Known-dead upstream: serve the last good result, marked stale, without touching the network
+            UPSTREAM_ERRORS.inc(protocol=protocol_id, reason='circuit_open')
+            self.logger.warning(str(e))
+            return self._serve_last_good(protocol_id, 'circuit_open')
+        except Exception:
+            UPSTREAM_LATENCY.observe(time.perf_counter() - started, protocol=protocol_id)
+            UPSTREAM_ERRORS.inc(protocol=protocol_id, reason='request')
+            raise
+        UPSTREAM_LATENCY.observe(time.perf_counter() - started, protocol=protocol_id)
+        if body is None:
+            # 304 or identical payload hash: skip parsing and keep the existing ProtocolAPY
+            return previous
+        
+        with body:
+            try:
+                # Peak allocation while decoding the payload (Yearn/Curve stream, the others load it whole)
+                with memory_tracker.measure(f"parse:{protocol_id}"):
+                    result = parse(body)
+            except Exception:
+                UPSTREAM_ERRORS.inc(protocol=protocol_id, reason='parse')
+                raise
+            if result:
+                body.commit()
+                self._last_results[protocol_id] = result
+            else:
+                UPSTREAM_ERRORS.inc(protocol=protocol_id, reason='parse')
+            return result
+    
     def _fetch_compound_data(self) -> ProtocolAPY:
         """Fetch Compound protocol data"""
         try:
-            response = requests.get('https://api.compound.finance/api/v2/ctoken', timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                # Find USDC market
-                usdc_market = next((market for market in data['cToken'] if market['symbol'] == 'cUSDC'), None)
-                if usdc_market:
-                    apy = float(usdc_market['supply_rate']['value']) * 100
-                    tvl = float(usdc_market['total_supply']['value'])
-                    return ProtocolAPY(
-                        protocol='compound',
-                        apy=apy,
-                        tvl=tvl,
-                        risk_score=2.5,
-                        tokens=['USDC', 'USDT', 'DAI']
-                    )
+            result = self._fetch_if_changed('compound', self._parse_compound_data)
+            if result:
+                return result
         except Exception as e:
             self.logger.error(f"Error fetching Compound data: {e}")
         
-        # Fallback data
-        return ProtocolAPY(
-            protocol='compound',
-            apy=8.5,
-            tvl=2500000000,
-            risk_score=2.5,
-            tokens=['USDC', 'USDT', 'DAI']
-        )
+        # Last good result marked stale, or fallback data if there is none
+        return self._serve_last_good('compound', 'failed')
+    
+    def _parse_compound_data(self, body: ChangedBody) -> Optional[ProtocolAPY]:
+        data = body.json()
+        # Index markets by underlying symbol once, then read every supported token from it
+        index = {market['symbol'][1:]: market for market in data['cToken'] if market['symbol'].startswith('c')}
+        tokens = ['USDC', 'USDT', 'DAI']
+        markets = {}
+        for token in tokens:
+            market = self._lookup(index, token)
+            if market:
+                markets[token] = MarketAPY(
+                    protocol='compound',
+                    token=token,
+                    apy=float(market['supply_rate']['value']) * 100,
+                    tvl=float(market['total_supply']['value'])
+                )
+        return self._build_protocol_apy('compound', 2.5, tokens, markets)
     
     def _fetch_aave_data(self) -> ProtocolAPY:
         """Fetch Aave protocol data"""
         try:
-            response = requests.get('https://aave-api-v2.aave.com/data/liquidity/v2', timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                # Find USDC reserve
-                usdc_reserve = next((reserve for reserve in data['reserves'] if reserve['symbol'] == 'USDC'), None)
-                if usdc_reserve:
-                    apy = float(usdc_reserve['liquidityRate']) * 100
-                    tvl = float(usdc_reserve['totalLiquidity'])
-                    return ProtocolAPY(
-                        protocol='aave',
-                        apy=apy,
-                        tvl=tvl,
-                        risk_score=3.0,
-                        tokens=['USDC', 'USDT', 'DAI', 'ETH']
-                    )
+            result = self._fetch_if_changed('aave', self._parse_aave_data)
+            if result:
+                return result
         except Exception as e:
             self.logger.error(f"Error fetching Aave data: {e}")
         
-        # Fallback data
-        return ProtocolAPY(
-            protocol='aave',
-            apy=12.3,
-            tvl=1800000000,
-            risk_score=3.0,
-            tokens=['USDC', 'USDT', 'DAI', 'ETH']
-        )
+        # Last good result marked stale, or fallback data if there is none
+        return self._serve_last_good('aave', 'failed')
+    
+    def _parse_aave_data(self, body: ChangedBody) -> Optional[ProtocolAPY]:
+        data = body.json()
+        # Index reserves by symbol once, then read every supported token from it
+        index = {reserve['symbol']: reserve for reserve in data['reserves']}
+        tokens = ['USDC', 'USDT', 'DAI', 'ETH']
+        markets = {}
+        for token in tokens:
+            reserve = self._lookup(index, token)
+            if reserve:
+                markets[token] = MarketAPY(
+                    protocol='aave',
+                    token=token,
+                    apy=float(reserve['liquidityRate']) * 100,
+                    tvl=float(reserve['totalLiquidity'])
+                )
+        return self._build_protocol_apy('aave', 3.0, tokens, markets)
     
     def _fetch_yearn_data(self) -> ProtocolAPY:
         """Fetch Yearn Finance data"""
         try:
-            response = requests.get('https://api.yearn.finance/v1/chains/1/vaults/all', timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                # Find USDC vault
-                usdc_vault = next((vault for vault in data if vault['token']['symbol'] == 'USDC'), None)
-                if usdc_vault:
-                    apy = float(usdc_vault['apy']['net_apy']) * 100
-                    tvl = float(usdc_vault['tvl']['tvl'])
-                    return ProtocolAPY(
-                        protocol='yearn',
-                        apy=apy,
-                        tvl=tvl,
-                        risk_score=3.5,
-                        tokens=['USDC', 'USDT', 'DAI', 'WETH']
-                    )
+            result = self._fetch_if_changed('yearn', self._parse_yearn_data)
+            if result:
+                return result
         except Exception as e:
             self.logger.error(f"Error fetching Yearn data: {e}")
         
-        # Fallback data
-        return ProtocolAPY(
-            protocol='yearn',
-            apy=15.7,
-            tvl=800000000,
-            risk_score=3.5,
-            tokens=['USDC', 'USDT', 'DAI', 'WETH']
-        )
+        # Last good result marked stale, or fallback data if there is none
+        return self._serve_last_good('yearn', 'failed')
+    
+    def _parse_yearn_data(self, body: ChangedBody) -> Optional[ProtocolAPY]:
+        tokens = ['USDC', 'USDT', 'DAI', 'WETH']
+        wanted = self._wanted_symbols(tokens)
+        # Stream the vault list once, keeping the first vault per supported token
+        index = {}
+        for vault in iter_array_items(
+            body.iter_content(STREAM_CHUNK_SIZE),
+            predicate=lambda vault: vault['token']['symbol'] in wanted
+        ):
+            index.setdefault(vault['token']['symbol'], vault)
+            if all(self._lookup(index, token) for token in tokens):
+                break
+        
+        markets = {}
+        for token in tokens:
+            vault = self._lookup(index, token)
+            if vault:
+                markets[token] = MarketAPY(
+                    protocol='yearn',
+                    token=token,
+                    apy=float(vault['apy']['net_apy']) * 100,
+                    tvl=float(vault['tvl']['tvl'])
+                )
+        return self._build_protocol_apy('yearn', 3.5, tokens, markets)
     
     def _fetch_curve_data(self) -> ProtocolAPY:
         """Fetch Curve Finance data"""
         try:
-            response = requests.get('https://api.curve.fi/api/getPools/ethereum', timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                # Find USDC pool
-                usdc_pool = next((pool for pool in data['data']['poolData'] if 'USDC' in pool['name']), None)
-                if usdc_pool:
-                    apy = float(usdc_pool['apy']) * 100
-                    tvl = float(usdc_pool['tvl'])
-                    return ProtocolAPY(
-                        protocol='curve',
-                        apy=apy,
-                        tvl=tvl,
-                        risk_score=2.0,
-                        tokens=['USDC', 'USDT', 'DAI', 'FRAX']
-                    )
+            result = self._fetch_if_changed('curve', self._parse_curve_data)
+            if result:
+                return result
         except Exception as e:
             self.logger.error(f"Error fetching Curve data: {e}")
         
-        # Fallback data
+        # Last good result marked stale, or fallback data if there is none
+        return self._serve_last_good('curve', 'failed')
+    
+    def _parse_curve_data(self, body: ChangedBody) -> Optional[ProtocolAPY]:
+        tokens = ['USDC', 'USDT', 'DAI', 'FRAX']
+        # Stream the pool list once, keeping the first pool whose name mentions each token
+        index = {}
+        for pool in iter_array_items(body.iter_content(STREAM_CHUNK_SIZE), path=('data', 'poolData')):
+            for token in tokens:
+                if token not in index and token in pool['name']:
+                    index[token] = pool
+            if len(index) == len(tokens):
+                break
+        
+        markets = {
+            token: MarketAPY(
+                protocol='curve',
+                token=token,
+                apy=float(pool['apy']) * 100,
+                tvl=float(pool['tvl'])
+            )
+            for token, pool in index.items()
+        }
+        return self._build_protocol_apy('curve', 2.0, tokens, markets)
+    
+    def _lookup(self, index: Dict[str, Dict], token: str) -> Optional[Dict]:
+        """Find a token's entry in a symbol index, accepting known aliases"""
+        for symbol in TOKEN_ALIASES.get(token, (token,)):
+            if symbol in index:
+                return index[symbol]
+        return None
+    
+    def _wanted_symbols(self, tokens: List[str]) -> set:
+        return {symbol for token in tokens for symbol in TOKEN_ALIASES.get(token, (token,))}
+    
+    def _build_protocol_apy(self, protocol_id: str, risk_score: float, tokens: List[str],
+                            markets: Dict[str, MarketAPY]) -> Optional[ProtocolAPY]:
+        """Build the protocol summary from its markets; USDC stays the headline market"""
+        usdc_market = markets.get('USDC')
+        if not usdc_market:
+            return None
         return ProtocolAPY(
-            protocol='curve',
-            apy=6.2,
-            tvl=3200000000,
-            risk_score=2.0,
-            tokens=['USDC', 'USDT', 'DAI', 'FRAX']
+            protocol=protocol_id,
+            apy=usdc_market.apy,
+            tvl=usdc_market.tvl,
+            risk_score=risk_score,
+            tokens=tokens,
+            markets=markets
         )
     
     def _get_fallback_data(self, protocol_id: str) -> ProtocolAPY:
         """Get fallback data when API calls fail"""
         fallback_data = {
-            'compound': ProtocolAPY('compound', 8.5, 2500000000, 2.5, ['USDC', 'USDT', 'DAI']),
-            'aave': ProtocolAPY('aave', 12.3, 1800000000, 3.0, ['USDC', 'USDT', 'DAI', 'ETH']),
-            'yearn': ProtocolAPY('yearn', 15.7, 800000000, 3.5, ['USDC', 'USDT', 'DAI', 'WETH']),
-            'curve': ProtocolAPY('curve', 6.2, 3200000000, 2.0, ['USDC', 'USDT', 'DAI', 'FRAX'])
+            'compound': ProtocolAPY('compound', 8.5, 2500000000, 2.5, ['USDC', 'USDT', 'DAI'], status='fallback'),
+            'aave': ProtocolAPY('aave', 12.3, 1800000000, 3.0, ['USDC', 'USDT', 'DAI', 'ETH'], status='fallback'),
+            'yearn': ProtocolAPY('yearn', 15.7, 800000000, 3.5, ['USDC', 'USDT', 'DAI', 'WETH'], status='fallback'),
+            'curve': ProtocolAPY('curve', 6.2, 3200000000, 2.0, ['USDC', 'USDT', 'DAI', 'FRAX'], status='fallback')
         }
         return fallback_data.get(protocol_id, fallback_data['compound'])
     
-    def optimize_portfolio(self, amount: float, risk_tolerance: str) -> Dict:
+    def optimize_portfolio(self, amount: float, risk_tolerance: str, protocol_data: Optional[Dict[str, ProtocolAPY]] = None,
+                           strategy: str = 'tiered', snapshot_version: Optional[int] = None) -> Dict:
         """AI-powered portfolio optimization"""
-        protocol_data = self.get_real_protocol_data()
+        if protocol_data is None:
+            protocol_data = self.get_real_protocol_data()
+        
+        # Allocation percentages only depend on the snapshot and risk tier; amount just scales them
+        tier = risk_tolerance.lower() if risk_tolerance.lower() in RISK_PROFILES else 'medium'
+        if strategy not in OPTIMIZATION_STRATEGIES:
+            raise ValueError(f"Unknown optimization strategy '{strategy}'")
+        if snapshot_version is None:
+            plan = self._build_plan(protocol_data, tier, strategy)
+        else:
+            plan = self._get_cached_plan(protocol_data, snapshot_version, tier, strategy)
         
-        # Risk tolerance mapping
-        risk_mapping = {
-            'low': {'max_risk': 2.5, 'prefer_stable': True},
-            'medium': {'max_risk': 3.5, 'prefer_stable': False},
-            'high': {'max_risk': 5.0, 'prefer_stable': False}
+        daily_earnings = (amount * plan.expected_apy / 100) / 365
+        monthly_earnings = daily_earnings * 30
+        
+        return {
+            'expected_apy': round(plan.expected_apy, 2),
+            'daily_earnings': round(daily_earnings, 2),
+            'monthly_earnings': round(monthly_earnings, 2),
+            'risk_level': plan.risk_level,
+            'sharpe_ratio': plan.sharpe_ratio,
+            'risk_score': plan.risk_score,
+            'diversification': plan.diversification,
+            'confidence': plan.confidence,
+            'allocations': [
+                {**alloc, 'amount': amount * alloc['allocation_percentage'] / 100}
+                for alloc in plan.allocations
+            ]
         }
+    
+    def precompute_plans(self, protocol_data: Dict[str, ProtocolAPY], snapshot_version: int):
+        """Build every (risk tier, strategy) plan for a new snapshot so requests only scale them"""
+        for tier in RISK_PROFILES:
+            for strategy in OPTIMIZATION_STRATEGIES:
+                self._get_cached_plan(protocol_data, snapshot_version, tier, strategy)
+    
+    def _get_cached_plan(self, protocol_data: Dict[str, ProtocolAPY], snapshot_version: int,
+                         tier: str, strategy: str) -> AllocationPlan:
+        """Return the plan for a snapshot version, invalidating plans from older versions"""
+        with self._plan_lock:
+            if snapshot_version != self._plan_version:
+                if self._plan_version is not None and snapshot_version < self._plan_version:
+                    # A request still holding an older snapshot: compute without evicting newer plans
+                    return self._build_plan(protocol_data, tier, strategy)
+                self._plan_cache = {}
+                self._plan_version = snapshot_version
+            plan = self._plan_cache.get((tier, strategy))
         
-        risk_config = risk_mapping.get(risk_tolerance.lower(), risk_mapping['medium'])
+        if plan is None:
+            plan = self._build_plan(protocol_data, tier, strategy)
+            with self._plan_lock:
+                if self._plan_version == snapshot_version:
+                    self._plan_cache[(tier, strategy)] = plan
+        return plan
+    
+    def _build_plan(self, protocol_data: Dict[str, ProtocolAPY], tier: str, strategy: str) -> AllocationPlan:
+        started = time.perf_counter()
+        risk_config = RISK_PROFILES[tier]
         
         # Filter protocols by risk tolerance
         suitable_protocols = [
@@ -238,25 +632,112 @@ class DeFiService:
         # Sort by APY (descending)
         suitable_protocols.sort(key=lambda x: x.apy, reverse=True)
         
-        # Calculate optimal allocation
-        allocations = self._calculate_optimal_allocation(suitable_protocols, amount, risk_config)
+        # Calculate optimal allocation (amounts are filled in per request)
+        if strategy == 'mean_variance':
+            allocations = self._calculate_mean_variance_allocation(suitable_protocols, 0, risk_config)
+        else:
+            allocations = self._calculate_optimal_allocation(suitable_protocols, 0, risk_config)
+        for alloc in allocations:
+            del alloc['amount']
         
         # Calculate expected returns
         expected_apy = sum(alloc['allocation_percentage'] * alloc['expected_apy'] / 100 for alloc in allocations)
-        daily_earnings = (amount * expected_apy / 100) / 365
-        monthly_earnings = daily_earnings * 30
         
-        return {
-            'expected_apy': round(expected_apy, 2),
-            'daily_earnings': round(daily_earnings, 2),
-            'monthly_earnings': round(monthly_earnings, 2),
-            'risk_level': self._determine_risk_level(expected_apy, risk_config),
-            'sharpe_ratio': self._calculate_sharpe_ratio(allocations),
-            'risk_score': round(sum(alloc['risk_score'] * alloc['allocation_percentage'] / 100 for alloc in allocations), 2),
-            'diversification': len(allocations) * 25,  # 25% per protocol
-            'confidence': min(95, 70 + (expected_apy * 2)),  # Higher APY = higher confidence
-            'allocations': allocations
-        }
+        OPTIMIZER_SECONDS.observe(time.perf_counter() - started, strategy=strategy, mode='plan')
+        return AllocationPlan(
+            expected_apy=expected_apy,
+            risk_level=self._determine_risk_level(expected_apy, risk_config),
+            sharpe_ratio=self._calculate_sharpe_ratio(allocations),
+            risk_score=round(sum(alloc['risk_score'] * alloc['allocation_percentage'] / 100 for alloc in allocations), 2),
+            diversification=len(allocations) * 25,  # 25% per protocol
+            confidence=min(95, 70 + (expected_apy * 2)),  # Higher APY = higher confidence
+            allocations=tuple(allocations)
+        )
+    
+    def optimize_portfolio_batch(self, requests: List[Dict], protocol_data: Dict[str, ProtocolAPY],
+                                 strategy: str = 'tiered') -> List[Dict]:
+        """
+        Optimize many (amount, risk_tolerance, constraints) requests against one snapshot.
+        Weights and portfolio metrics for all requests are computed as arrays in one pass,
+        over one candidate per protocol (its USDC market).
+        Both strategies honour max_allocation; the tiered one hands the excess of a capped
+        tier to the lower tiers in proportion to their size (a cap below what the eligible
+        tiers can cover is raised to an even split, as for mean-variance).
+        """
+        if not requests:
+            return []
+        
+        started = time.perf_counter()
+        protocols = sorted(protocol_data.values(), key=lambda x: x.apy, reverse=True)
+        apys = np.array([protocol.apy for protocol in protocols])
+        risk_scores = np.array([protocol.risk_score for protocol in protocols])
+        
+        amounts = np.empty(len(requests))
+        risk_configs = []
+        eligible = np.zeros((len(requests), len(protocols)), dtype=bool)
+        risk_aversion = np.empty(len(requests))
+        max_allocation = np.empty((len(requests), 1))
+        
+        for row, item in enumerate(requests):
+            constraints = item.get('constraints') or {}
+            risk_config = RISK_PROFILES.get(str(item.get('risk_tolerance', 'medium')).lower(), RISK_PROFILES['medium'])
+            allowed = constraints.get('protocols')
+            
+            amounts[row] = float(item.get('amount', 10000))
+            risk_configs.append(risk_config)
+            eligible[row] = risk_scores <= float(constraints.get('max_risk', risk_config['max_risk']))
+            if allowed:
+                eligible[row] &= np.array([protocol.protocol in allowed for protocol in protocols], dtype=bool)
+            risk_aversion[row] = risk_config['risk_aversion']
+            max_allocation[row] = float(constraints.get('max_allocation', risk_config['max_allocation']))
+        
+        if not protocols:
+            percentages = np.zeros(eligible.shape)
+        elif strategy == 'mean_variance':
+            weights = mean_variance_weights(apys, risk_scores, risk_aversion, max_allocation, mask=eligible)
+            percentages = np.round(weights * 100, 2)
+        else:
+            # Rank eligible protocols per row (already APY-sorted) and hand out the fixed tiers,
+            # then move whatever exceeds max_allocation down to the lower tiers
+            rank = np.cumsum(eligible, axis=1) - 1
+            tiers = np.array(TIERED_ALLOCATION, dtype=np.float64) / 100
+            weights = np.where(eligible & (rank < len(tiers)), tiers[np.minimum(rank, len(tiers) - 1)], 0.0)
+            percentages = np.round(cap_weights(weights, max_allocation) * 100, 2)
+        
+        # Portfolio metrics for every request at once
+        expected_apy = percentages @ apys / 100
+        weighted_risk = percentages @ risk_scores / 100
+        daily_earnings = (amounts * expected_apy / 100) / 365
+        sharpe = np.divide(expected_apy - 5.0, weighted_risk, out=np.zeros_like(expected_apy), where=weighted_risk != 0)
+        
+        results = []
+        for row in range(len(requests)):
+            order = np.argsort(-percentages[row], kind='stable')
+            allocations = [
+                {
+                    'protocol': protocols[index].protocol,
+                    'allocation_percentage': float(percentages[row, index]),
+                    'expected_apy': protocols[index].apy,
+                    'risk_level': self._get_risk_level(protocols[index].risk_score),
+                    'amount': float(amounts[row] * percentages[row, index] / 100),
+                    'risk_score': protocols[index].risk_score
+                }
+                for index in order if percentages[row, index] > 0
+            ]
+            results.append({
+                'expected_apy': round(float(expected_apy[row]), 2),
+                'daily_earnings': round(float(daily_earnings[row]), 2),
+                'monthly_earnings': round(float(daily_earnings[row] * 30), 2),
+                'risk_level': self._determine_risk_level(expected_apy[row], risk_configs[row]),
+                'sharpe_ratio': round(float(sharpe[row]), 2),
+                'risk_score': round(float(weighted_risk[row]), 2),
+                'diversification': len(allocations) * 25,  # 25% per protocol
+                'confidence': min(95, 70 + (float(expected_apy[row]) * 2)),  # Higher APY = higher confidence
+                'allocations': allocations
+            })
+        
+        OPTIMIZER_SECONDS.observe(time.perf_counter() - started, strategy=strategy, mode='batch')
+        return results
     
     def _calculate_optimal_allocation(self, protocols: List[ProtocolAPY], amount: float, risk_config: Dict) -> List[Dict]:
         """Calculate optimal allocation across protocols"""
@@ -294,6 +775,35 @@ class DeFiService:
         
         return allocations
     
+    def _calculate_mean_variance_allocation(self, protocols: List[ProtocolAPY], amount: float, risk_config: Dict) -> List[Dict]:
+        """Mean-variance allocation with per-protocol caps; risk_score is used as the volatility proxy"""
+        if not protocols:
+            return []
+        
+        weights = mean_variance_weights(
+            np.array([protocol.apy for protocol in protocols]),
+            np.array([protocol.risk_score for protocol in protocols]),
+            risk_aversion=risk_config['risk_aversion'],
+            max_allocation=risk_config['max_allocation']
+        )
+        
+        allocations = []
+        for index in np.argsort(-weights):
+            if weights[index] < 1e-4:
+                break
+            protocol = protocols[index]
+            allocation_pct = round(float(weights[index]) * 100, 2)
+            allocations.append({
+                'protocol': protocol.protocol,
+                'allocation_percentage': allocation_pct,
+                'expected_apy': protocol.apy,
+                'risk_level': self._get_risk_level(protocol.risk_score),
+                'amount': amount * allocation_pct / 100,
+                'risk_score': protocol.risk_score
+            })
+        
+        return allocations
+    
     def _determine_risk_level(self, expected_apy: float, risk_config: Dict) -> str:
         """Determine overall risk level based on expected APY"""
         if expected_apy < 8:
@@ -0,0 +1,25 @@
+"""
+Gunicorn configuration
+Starts and stops per-worker background services alongside the worker lifecycle
+"""
+
+def on_starting(server):
+    """Drop metric files and the memory tracing switch left by the previous run"""
+    from memory_tracker import memory_tracker
+    from metrics import metrics
+    metrics.clear()
+    memory_tracker.reset()
+
+def post_worker_init(worker):
+    """Start the protocol refresher and stack sampler once the worker has loaded the app"""
+    from app import REFRESHER_ENABLED, STACK_SAMPLER_ENABLED, protocol_refresher, stack_sampler
+    if REFRESHER_ENABLED:
+        protocol_refresher.start()
+    if STACK_SAMPLER_ENABLED:
+        stack_sampler.start()
+
+def worker_exit(server, worker):
+    """Stop the protocol refresher and stack sampler before the worker process exits"""
+    from app import protocol_refresher, stack_sampler
+    protocol_refresher.stop()
+    stack_sampler.stop()
@@ -0,0 +1,227 @@
+"""
+Shared HTTP Client
+Pooled keep-alive sessions with retry/backoff for all upstream DeFi API calls
+"""
+
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from typing import Any, Dict, Iterator, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+class ChangedBody:
+    """Response body that differs from the last committed one for its key"""
+
+    def __init__(self, client: 'HttpClient', key: str, spool, validators: Dict[str, Optional[str]]):
+        self._client = client
+        self._key = key
+        self._spool = spool
+        self.validators = validators
+
+    def iter_content(self, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        self._spool.seek(0)
+        while True:
+            chunk = self._spool.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def json(self) -> Any:
+        self._spool.seek(0)
+        return json.load(self._spool)
+
+    def commit(self):
+        """Remember this body's validators and hash once it has been parsed successfully"""
+        self._client._validators[self._key] = self.validators
+
+    def close(self):
+        self._spool.close()
+
+    def __enter__(self) -> 'ChangedBody':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class HttpClient:
+    def __init__(self, pool_connections: int = 10, pool_maxsize: int = 8, retries: int = 2,
+                 backoff_factor: float = 0.3, timeout: float = 10):
+        self.logger = logging.getLogger(__name__)
+        # pool_connections = number of per-host pools kept, pool_maxsize = keep-alive sockets per host
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+
+        self._session: Optional[requests.Session] = None
+        # Same pool settings without urllib3 retries, for callers that own their retry policy
+        self._direct_session: Optional[requests.Session] = None
+        self._session_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._requests_per_host: Dict[str, int] = {}
+        self._validators: Dict[str, Dict[str, Optional[str]]] = {}
+        self._conditional_stats: Dict[str, Dict[str, int]] = {}
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """Drop-in replacement for requests.get that reuses pooled connections"""
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """Drop-in replacement for requests.post that reuses pooled connections"""
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method: str, url: str, retry: bool = True, **kwargs) -> requests.Response:
+        """With retry=False the request is sent once, so its timeout bounds the whole call"""
+        kwargs.setdefault('timeout', self.timeout)
+        session = self.session if retry else self.direct_session
+        host = urlsplit(url).netloc
+        with self._lock:
+            self._requests_per_host[host] = self._requests_per_host.get(host, 0) + 1
+        return session.request(method, url, **kwargs)
+
+    def get_if_changed(self, url: str, key: Optional[str] = None, force: bool = False,
+                       spool_size: int = 1024 * 1024, **kwargs) -> Optional[ChangedBody]:
+        """
+        Conditional GET: returns None when the upstream answers 304 or the body hash
+        matches the last committed body for key, otherwise the new body (spooled to
+        disk past spool_size so large payloads never sit in memory whole)
+        """
+        key = key or url
+        previous = None if force else self._validators.get(key)
+        headers = dict(kwargs.pop('headers', None) or {})
+        if previous:
+            if previous.get('etag'):
+                headers['If-None-Match'] = previous['etag']
+            if previous.get('last_modified'):
+                headers['If-Modified-Since'] = previous['last_modified']
+
+        response = self.get(url, headers=headers, stream=True, **kwargs)
+        with response:
+            if response.status_code == 304 and previous:
+                self._count_conditional(key, 'not_modified')
+                return None
+            response.raise_for_status()
+
+            digest = hashlib.sha256()
+            spool = tempfile.SpooledTemporaryFile(max_size=spool_size)
+            try:
+                for chunk in response.iter_content(64 * 1024):
+                    digest.update(chunk)
+                    spool.write(chunk)
+            except Exception:
+                spool.close()
+                raise
+
+        validators = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'sha256': digest.hexdigest()
+        }
+        if previous and previous.get('sha256') == validators['sha256']:
+            spool.close()
+            # Refresh validators in case the upstream started sending them
+            self._validators[key] = validators
+            self._count_conditional(key, 'unchanged_body')
+            return None
+
+        self._count_conditional(key, 'changed')
+        return ChangedBody(self, key, spool, validators)
+
+    def conditional_stats(self) -> Dict[str, Dict[str, int]]:
+        """Per-key counts of 304 responses, identical bodies and changed bodies"""
+        return {key: dict(counts) for key, counts in self._conditional_stats.items()}
+
+    def _count_conditional(self, key: str, outcome: str):
+        with self._lock:
+            counts = self._conditional_stats.setdefault(key, {'not_modified': 0, 'unchanged_body': 0, 'changed': 0})
+            counts[outcome] += 1
+
+    @property
+    def session(self) -> requests.Session:
+        """Per-process session; sockets inherited across fork are never reused"""
+        self._ensure_sessions()
+        return self._session
+
+    @property
+    def direct_session(self) -> requests.Session:
+        """Per-process session that never retries"""
+        self._ensure_sessions()
+        return self._direct_session
+
+    def _ensure_sessions(self):
+        if self._session is None or self._session_pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._session_pid != os.getpid():
+                    self._session = self._build_session(self.retries)
+                    self._direct_session = self._build_session(0)
+                    self._session_pid = os.getpid()
+                    self._requests_per_host = {}
+
+    def stats(self) -> Dict[str, Dict]:
+        """Per-host request and connection counts; reused = requests served on an existing socket"""
+        connections: Dict[str, int] = {}
+        sessions = (self._session, self._direct_session) if self._session_pid == os.getpid() else ()
+        for session in filter(None, sessions):
+            # The same adapter is mounted for http:// and https://
+            for adapter in {id(adapter): adapter for adapter in session.adapters.values()}.values():
+                pools = adapter.poolmanager.pools
+                for key in list(pools.keys()):
+                    pool = pools.get(key)
+                    if pool is None:
+                        continue
+                    host = pool.host if pool.port in (None, 80, 443) else f"{pool.host}:{pool.port}"
+                    connections[host] = connections.get(host, 0) + pool.num_connections
+
+        stats = {}
+        for host, request_count in self._requests_per_host.items():
+            opened = connections.get(host, 0)
+            stats[host] = {
+                'requests': request_count,
+                'connections_opened': opened,
+                'connections_reused': max(0, request_count - opened),
+                'reuse_ratio': round(max(0, request_count - opened) / request_count, 4) if request_count else 0
+            }
+        return stats
+
+    def _build_session(self, retries: int) -> requests.Session:
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=retry
+        )
+        session = requests.Session()
+        session.headers.update({
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+            'User-Agent': 'ai-yield-aggregator/2.0'
+        })
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+# Shared client for the DeFi service, API fallbacks and the yield updater
+http_client = HttpClient(
+    pool_maxsize=int(os.environ.get('HTTP_POOL_MAXSIZE', 8)),
+    retries=int(os.environ.get('HTTP_RETRIES', 2)),
+    backoff_factor=float(os.environ.get('HTTP_BACKOFF_FACTOR', 0.3))
+)
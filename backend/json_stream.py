@@ -0,0 +1,110 @@
+"""
+Streaming JSON Extraction
+Pulls matching entries out of large JSON arrays without materializing the whole document
+"""
+
+import codecs
+import json
+from typing import Any, Callable, Iterable, Iterator, Optional, Sequence
+
+_WHITESPACE = ' \t\n\r'
+# Characters that can still extend a number ('1.' + '5', '1e' + '5', '1e-' + '5')
+_NUMBER_CHARS = frozenset('0123456789.eE+-')
+_decoder = json.JSONDecoder()
+
+class _ChunkReader:
+    """Incrementally decoded text buffer over an iterable of byte chunks"""
+
+    def __init__(self, chunks: Iterable[bytes], compact_threshold: int = 1 << 16):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._compact_threshold = compact_threshold
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """Append the next chunk to the buffer; returns False at end of input"""
+        if self.eof:
+            return False
+        # Drop consumed text so the buffer only ever holds the current item plus one chunk
+        if self.pos > self._compact_threshold:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        for chunk in self._chunks:
+            if chunk:
+                self.buf += self._decoder.decode(chunk)
+                return True
+        self.buf += self._decoder.decode(b'', final=True)
+        self.eof = True
+        return False
+
+    def peek(self) -> str:
+        """Return the next non-whitespace character without consuming it ('' at EOF)"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos}, got {self.peek()!r}")
+        self.pos += 1
+
+    def read_value(self) -> Any:
+        """Decode one complete JSON value, pulling more chunks until it is fully buffered"""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+                # A scalar ending exactly at the buffer edge may continue in the next chunk, and so
+                # may a number followed only by a partial fraction or exponent
+                tail = self.buf[end:]
+                if self.eof or (tail and not (isinstance(value, (int, float)) and not isinstance(value, bool)
+                                              and _NUMBER_CHARS.issuperset(tail))):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+def _seek_path(reader: _ChunkReader, path: Sequence[str]):
+    """Advance the reader to the first element of the array found at path"""
+    for key in path:
+        reader.expect('{')
+        while True:
+            if reader.peek() == '}':
+                raise KeyError(key)
+            name = reader.read_value()
+            reader.expect(':')
+            if name == key:
+                break
+            # Sibling values are decoded and discarded one at a time
+            reader.read_value()
+            if reader.peek() == ',':
+                reader.pos += 1
+    reader.expect('[')
+
+def iter_array_items(chunks: Iterable[bytes], path: Sequence[str] = (),
+                     predicate: Optional[Callable[[Any], bool]] = None) -> Iterator[Any]:
+    """Yield items of the JSON array at path (a sequence of object keys) that match predicate"""
+    reader = _ChunkReader(chunks)
+    _seek_path(reader, path)
+
+    if reader.peek() == ']':
+        return
+    while True:
+        item = reader.read_value()
+        if predicate is None or predicate(item):
+            yield item
+        separator = reader.peek()
+        if separator == ',':
+            reader.pos += 1
+        elif separator == ']':
+            return
+        else:
+            raise ValueError(f"Malformed JSON array at offset {reader.pos}")
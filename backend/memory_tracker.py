@@ -0,0 +1,236 @@
+"""
+Memory Tracker
+Runtime-switchable tracemalloc accounting: top allocation sites, growth since a
+baseline, peak allocation while parsing upstream payloads, and estimated sizes
+of long-lived components (snapshot, caches) for sizing gunicorn workers
+"""
+
+import os
+import sys
+import json
+import time
+import types
+import logging
+import tempfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import fields, is_dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# Never followed when sizing: shared infrastructure, not data owned by a component
+_OPAQUE_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+                 logging.Logger, threading.Thread)
+
+try:
+    import psutil
+except ImportError:  # RSS is omitted from reports without psutil
+    psutil = None
+
+def deep_sizeof(obj: Any) -> int:
+    """Approximate bytes retained by obj and everything it references (shared objects counted once)"""
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        current = stack.pop()
+        if id(current) in seen or isinstance(current, _OPAQUE_TYPES):
+            continue
+        seen.add(id(current))
+        nbytes = getattr(current, 'nbytes', None)
+        if isinstance(nbytes, int) and not isinstance(current, (bytes, bytearray, memoryview)):
+            # numpy arrays; memory-mapped ones report their mapped size
+            total += nbytes
+            continue
+        total += sys.getsizeof(current)
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset)) or type(current).__name__ == 'deque':
+            stack.extend(current)
+        elif is_dataclass(current) and not isinstance(current, type):
+            stack.extend(getattr(current, field.name) for field in fields(current))
+        elif hasattr(current, '__dict__'):
+            stack.append(vars(current))
+    return total
+
+class MemoryTracker:
+    """
+    Tracing is started and stopped per process; enable()/disable() also write a small
+    control file that sync() (called at most once per sync_interval, e.g. before each
+    request) reads, so one admin call switches every worker sharing the directory
+    """
+
+    def __init__(self, control_path: Optional[str] = None, frames: int = 10, sync_interval: float = 1.0):
+        self.logger = logging.getLogger(__name__)
+        self.control_path = control_path or os.path.join(tempfile.gettempdir(), 'ai-yield-aggregator', 'memory_tracing.json')
+        self.frames = frames
+        self.sync_interval = sync_interval
+
+        self._components: Dict[str, Callable[[], Any]] = {}
+        self._peaks: Dict[str, Dict[str, int]] = {}
+        # [start, highest peak seen] of every measure() block still open, on any thread
+        self._open: List[List[int]] = []
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._control_mtime: Optional[float] = None
+        self._next_sync = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(self.control_path)), mode=0o700, exist_ok=True)
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def enable(self, frames: Optional[int] = None):
+        """Start tracing here and ask every other process to do the same"""
+        self._write_control({'enabled': True, 'frames': frames or self.frames})
+        self.start(frames)
+
+    def disable(self):
+        self._write_control({'enabled': False})
+        self.stop()
+
+    def sync(self):
+        """Follow the shared control file; cheap enough to call on every request"""
+        now = time.monotonic()
+        if now < self._next_sync:
+            return
+        self._next_sync = now + self.sync_interval
+        try:
+            mtime = os.stat(self.control_path).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self._control_mtime:
+            return
+        self._control_mtime = mtime
+        try:
+            with open(self.control_path) as f:
+                control = json.load(f)
+        except (OSError, ValueError):
+            return
+        if control.get('enabled'):
+            self.start(int(control.get('frames', self.frames)))
+        else:
+            self.stop()
+
+    def set_baseline(self):
+        """Remember the current heap so reports show what grew since (e.g. across refreshes)"""
+        if self.tracing:
+            self._baseline = self._snapshot()
+
+    def reset(self):
+        """Forget a switch left by a previous run (called when gunicorn starts)"""
+        try:
+            os.remove(self.control_path)
+        except FileNotFoundError:
+            pass
+
+    def add_component(self, name: str, size: Callable[[], Any]):
+        """Report size() (bytes, or a dict of named byte counts) as the memory held by a long-lived component"""
+        self._components[name] = size
+
+    @contextmanager
+    def measure(self, name: str) -> Iterator[None]:
+        """
+        Record how far traced memory rose above its starting point inside the block.
+        Blocks may nest: the peak a nested block resets is folded into the blocks around
+        it first. The peak is process-wide, so blocks overlapping on other threads inflate it
+        """
+        if not self.tracing:
+            yield
+            return
+        with self._lock:
+            start, peak = tracemalloc.get_traced_memory()
+            for block in self._open:
+                block[1] = max(block[1], peak)
+            tracemalloc.reset_peak()
+            own = [start, start]
+            self._open.append(own)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._open = [block for block in self._open if block is not own]
+                if self.tracing:
+                    peak = tracemalloc.get_traced_memory()[1]
+                    for block in self._open:
+                        block[1] = max(block[1], peak)
+                    growth = max(0, own[1] - start, peak - start)
+                    entry = self._peaks.setdefault(name, {'last_bytes': 0, 'max_bytes': 0, 'samples': 0})
+                    entry['last_bytes'] = growth
+                    entry['max_bytes'] = max(entry['max_bytes'], growth)
+                    entry['samples'] += 1
+
+    def report(self, limit: int = 20) -> Dict[str, Any]:
+        report: Dict[str, Any] = {
+            'pid': os.getpid(),
+            'tracing': self.tracing,
+            'rss_bytes': psutil.Process().memory_info().rss if psutil is not None else None,
+            'components': {},
+            'peaks': {name: dict(entry) for name, entry in self._peaks.items()}
+        }
+        for name, size in self._components.items():
+            try:
+                report['components'][name] = size()
+            except Exception as e:
+                self.logger.error(f"Could not size memory component {name}: {e}")
+                report['components'][name] = None
+
+        if not self.tracing:
+            return report
+
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = self._snapshot()
+        report['traced'] = {'current_bytes': current, 'peak_bytes': peak, 'overhead_bytes': tracemalloc.get_tracemalloc_memory()}
+        report['top_allocations'] = [self._format_stat(stat) for stat in snapshot.statistics('lineno')[:limit]]
+        report['by_file'] = [self._format_stat(stat) for stat in snapshot.statistics('filename')[:limit]]
+        if self._baseline is not None:
+            report['growth_since_baseline'] = [
+                {**self._format_stat(stat), 'size_diff_bytes': stat.size_diff, 'count_diff': stat.count_diff}
+                for stat in snapshot.compare_to(self._baseline, 'lineno')[:limit]
+            ]
+        return report
+
+    def start(self, frames: Optional[int] = None):
+        """Start tracing in this process only (enable() switches every process)"""
+        if self.tracing:
+            return
+        frames = frames or self.frames
+        tracemalloc.start(frames)
+        self._baseline = None
+        self.logger.info(f"Memory tracing started in pid {os.getpid()} ({frames} frames)")
+
+    def stop(self):
+        """Stop tracing in this process only"""
+        if not self.tracing:
+            return
+        tracemalloc.stop()
+        self._baseline = None
+        self.logger.info(f"Memory tracing stopped in pid {os.getpid()}")
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>')
+        ))
+
+    def _format_stat(self, stat: tracemalloc.Statistic) -> Dict[str, Any]:
+        frame = stat.traceback[0]
+        return {'site': f"{frame.filename}:{frame.lineno}", 'size_bytes': stat.size, 'count': stat.count}
+
+    def _write_control(self, control: Dict[str, Any]):
+        tmp_path = f"{self.control_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(control, f)
+        os.replace(tmp_path, self.control_path)
+        # Our own state is set directly; do not re-apply the file on the next sync
+        self._control_mtime = os.stat(self.control_path).st_mtime
+
+# Shared tracker for the API workers; MEMORY_TRACING=true starts tracing at import
+memory_tracker = MemoryTracker(
+    os.path.join(os.environ['DEFI_LOCK_DIR'], 'memory_tracing.json') if os.environ.get('DEFI_LOCK_DIR') else None,
+    frames=int(os.environ.get('MEMORY_TRACE_FRAMES', 10))
+)
+if os.environ.get('MEMORY_TRACING', 'false').lower() in ('1', 'true', 'yes'):
+    memory_tracker.start()
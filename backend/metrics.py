@@ -0,0 +1,324 @@
+"""
+Metrics
+Prometheus counters, gauges and histograms kept in memory per process, flushed
+to a shared directory and merged across gunicorn workers (and the yield
+updater) into one text exposition at scrape time
+"""
+
+import os
+import json
+import time
+import atexit
+import bisect
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import psutil
+except ImportError:  # process RSS/CPU are omitted without psutil
+    psutil = None
+
+# Seconds; spans cache hits (sub-millisecond) to upstream calls near their timeout
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self._registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+
+    def describe(self) -> Dict:
+        return {'type': self.kind, 'help': self.documentation, 'labelnames': list(self.labelnames)}
+
+    def samples(self) -> List:
+        return [[list(key), value] for key, value in self._values.items()]
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames) or any(name not in labels for name in self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._registry.updating():
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+class Gauge(_Metric):
+    """Per-process value; merged output carries a pid label and drops processes that have exited"""
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._registry.updating():
+            self._values[key] = float(value)
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def describe(self) -> Dict:
+        return {**super().describe(), 'buckets': list(self.buckets)}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        # Per-bucket (not cumulative) counts, the last one being +Inf; then sum and count
+        index = bisect.bisect_left(self.buckets, value)
+        with self._registry.updating():
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observe the wall time of the with block, whether or not it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+class MetricsRegistry:
+    """
+    Each process writes its samples to <directory>/<pid>.json every flush_interval
+    seconds (and on exit); render() merges every file so any worker can answer a
+    scrape for all of them. Counters and histograms of exited processes are kept
+    so totals never go backwards; their gauges are dropped
+    """
+
+    def __init__(self, directory: Optional[str] = None, flush_interval: float = 5.0):
+        self.logger = logging.getLogger(__name__)
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'ai-yield-aggregator', 'metrics')
+        self.flush_interval = flush_interval
+
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        atexit.register(self._flush_on_exit)
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(self, name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], None]):
+        """Call collector before every flush, e.g. to set gauges derived from live state"""
+        self._collectors.append(collector)
+
+    @contextmanager
+    def updating(self) -> Iterator[None]:
+        self._ensure_process()
+        with self._lock:
+            yield
+
+    def flush(self):
+        """Write this process's samples to its file"""
+        self._ensure_process()
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                self.logger.error(f"Metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+
+        with self._lock:
+            payload = {
+                'pid': self._pid,
+                'metrics': {name: {**metric.describe(), 'samples': metric.samples()} for name, metric in self._metrics.items()}
+            }
+        path = os.path.join(self.directory, f"{self._pid}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(payload, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    def render(self) -> str:
+        """Prometheus text exposition of every process's samples"""
+        self.flush()
+        merged: Dict[str, Dict] = {}
+        live_pids = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    payload = json.load(f)
+            except (OSError, ValueError):
+                continue
+            pid = payload['pid']
+            alive = _is_alive(pid)
+            if alive:
+                live_pids.append(pid)
+            for name, metric in payload['metrics'].items():
+                self._merge(merged, name, metric, pid, alive)
+
+        lines: List[str] = []
+        for name in sorted(merged):
+            _format_metric(lines, name, merged[name])
+        _format_process_metrics(lines, sorted(live_pids))
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        """Remove every process file, e.g. when the gunicorn master starts"""
+        for filename in os.listdir(self.directory):
+            if filename.endswith(('.json', '.tmp')):
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except FileNotFoundError:
+                    pass
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"Metric {metric.name} is already registered with a different type or labels")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def _ensure_process(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            if self._pid is not None:
+                # Forked: samples recorded before the fork belong to the parent's file
+                for metric in self._metrics.values():
+                    metric._values.clear()
+            self._pid = pid
+        threading.Thread(target=self._run, name='metrics-flush', daemon=True).start()
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                self.logger.error(f"Could not flush metrics: {e}")
+
+    def _flush_on_exit(self):
+        if self._pid == os.getpid():
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+    def _merge(self, merged: Dict[str, Dict], name: str, metric: Dict, pid: int, alive: bool):
+        kind = metric['type']
+        labelnames = metric['labelnames'] + (['pid'] if kind == 'gauge' else [])
+        target = merged.setdefault(name, {**metric, 'labelnames': labelnames, 'samples': {}})
+        if target['type'] != kind or target.get('buckets') != metric.get('buckets'):
+            self.logger.warning(f"Skipping samples of {name} from pid {pid}: definition differs between processes")
+            return
+
+        samples = target['samples']
+        for labels, value in metric['samples']:
+            if kind == 'gauge':
+                if alive:
+                    samples[tuple(labels) + (str(pid),)] = value
+            elif kind == 'counter':
+                samples[tuple(labels)] = samples.get(tuple(labels), 0.0) + value
+            else:
+                entry = samples.get(tuple(labels))
+                if entry is None:
+                    samples[tuple(labels)] = [list(value[0]), value[1], value[2]]
+                else:
+                    entry[0] = [a + b for a, b in zip(entry[0], value[0])]
+                    entry[1] += value[1]
+                    entry[2] += value[2]
+
+def _is_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+def _format_metric(lines: List[str], name: str, metric: Dict):
+    lines.append(f"# HELP {name} {metric['help']}")
+    lines.append(f"# TYPE {name} {metric['type']}")
+    names = metric['labelnames']
+    for labels, value in sorted(metric['samples'].items()):
+        if metric['type'] != 'histogram':
+            lines.append(f"{name}{_format_labels(names, labels)} {_format_value(value)}")
+            continue
+        counts, total, count = value
+        cumulative = 0
+        for bound, bucket_count in zip(list(metric['buckets']) + [float('inf')], counts):
+            cumulative += bucket_count
+            lines.append(f"{name}_bucket{_format_labels(names + ['le'], list(labels) + [_format_value(bound)])} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(names, labels)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(names, labels)} {count}")
+
+def _format_process_metrics(lines: List[str], pids: List[int]):
+    if psutil is None:
+        return
+    memory, cpu = [], []
+    for pid in pids:
+        try:
+            process = psutil.Process(pid)
+            with process.oneshot():
+                memory.append((pid, process.memory_info().rss))
+                times = process.cpu_times()
+                cpu.append((pid, times.user + times.system))
+        except psutil.Error:
+            continue
+    for name, kind, documentation, samples in (
+        ('process_resident_memory_bytes', 'gauge', 'Resident set size of each live process', memory),
+        ('process_cpu_seconds_total', 'counter', 'User and system CPU time of each live process', cpu)
+    ):
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {kind}")
+        for pid, value in samples:
+            lines.append(f"{name}{_format_labels(['pid'], [pid])} {_format_value(value)}")
+
+# Shared registry for the API workers and the yield updater (point METRICS_DIR at the same place for both)
+metrics = MetricsRegistry(
+    os.environ.get('METRICS_DIR') or (
+        os.path.join(os.environ['DEFI_LOCK_DIR'], 'metrics') if os.environ.get('DEFI_LOCK_DIR') else None
+    ),
+    flush_interval=float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+)
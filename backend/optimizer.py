@@ -0,0 +1,84 @@
+"""
+Portfolio Optimization Engine
+Vectorized mean-variance allocation with per-pool allocation caps
+"""
+
+from typing import Optional, Union
+
+import numpy as np
+
+ArrayLike = Union[float, np.ndarray]
+
+def mean_variance_weights(expected_returns: np.ndarray, volatilities: np.ndarray, risk_aversion: ArrayLike,
+                          max_allocation: ArrayLike = 1.0, mask: Optional[np.ndarray] = None,
+                          iterations: int = 60) -> np.ndarray:
+    """
+    Solve  max_w  mu.w - (lambda / 2) * w' diag(sigma^2) w  s.t.  sum(w) = 1, 0 <= w <= cap
+
+    expected_returns/volatilities have shape (n,) for n candidate pools. risk_aversion,
+    max_allocation and mask may carry a leading batch dimension (m,) / (m, n) to solve m
+    problems at once; the result is (n,) for a single problem or (m, n) for a batch.
+
+    With a diagonal covariance the KKT conditions give w_i = clip((mu_i - nu) / (lambda sigma_i^2), 0, cap_i),
+    so the only unknown per problem is the budget multiplier nu, found by vectorized bisection.
+    """
+    mu = np.asarray(expected_returns, dtype=np.float64)
+    sigma = np.maximum(np.asarray(volatilities, dtype=np.float64), 1e-6)
+    single = np.ndim(risk_aversion) == 0 and np.ndim(max_allocation) <= 1 and (mask is None or np.ndim(mask) == 1)
+
+    lam = np.atleast_1d(np.asarray(risk_aversion, dtype=np.float64))[:, None]
+    eligible = np.ones((1, mu.size), dtype=bool) if mask is None else np.atleast_2d(np.asarray(mask, dtype=bool))
+    batch = max(lam.shape[0], eligible.shape[0], np.atleast_2d(max_allocation).shape[0])
+    eligible = np.broadcast_to(eligible, (batch, mu.size))
+    cap = np.broadcast_to(np.atleast_2d(np.asarray(max_allocation, dtype=np.float64)), (batch, mu.size))
+
+    # Raise caps where they cannot add up to a fully invested portfolio
+    counts = eligible.sum(axis=1, keepdims=True)
+    cap = np.where(eligible, np.maximum(cap, 1.0 / np.maximum(counts, 1)), 0.0)
+
+    scale = lam * sigma ** 2
+    masked_mu = np.where(eligible, mu, np.nan)
+    # At nu = hi every weight is 0, at nu = lo every weight sits at its cap
+    hi = np.nanmax(np.where(counts > 0, masked_mu, 0.0), axis=1, keepdims=True)
+    lo = np.nanmin(np.where(counts > 0, masked_mu - scale * cap, 0.0), axis=1, keepdims=True)
+
+    for _ in range(iterations):
+        nu = (lo + hi) / 2
+        total = np.clip((mu - nu) / scale, 0.0, cap).sum(axis=1, keepdims=True)
+        over = total > 1.0
+        lo = np.where(over, nu, lo)
+        hi = np.where(over, hi, nu)
+
+    weights = np.clip((mu - (lo + hi) / 2) / scale, 0.0, cap)
+    totals = weights.sum(axis=1, keepdims=True)
+    weights = np.divide(weights, totals, out=np.zeros_like(weights), where=totals > 0)
+
+    return weights[0] if single else weights
+
+def cap_weights(weights: np.ndarray, max_allocation: ArrayLike) -> np.ndarray:
+    """
+    Clip weights to max_allocation and hand the clipped excess to the uncapped nonzero
+    weights in proportion to their size, so each row keeps its total. weights is (n,) or
+    (m, n) with max_allocation a scalar or (m, 1); caps too low for a row's total are
+    raised to total / held weights, as in mean_variance_weights
+    """
+    single = np.ndim(weights) == 1
+    base = np.atleast_2d(np.asarray(weights, dtype=np.float64))
+    held = base > 0
+    total = base.sum(axis=1, keepdims=True)
+    counts = held.sum(axis=1, keepdims=True)
+    cap = np.broadcast_to(np.atleast_2d(np.asarray(max_allocation, dtype=np.float64)), base.shape)
+    cap = np.maximum(cap, total / np.maximum(counts, 1))
+
+    capped = np.minimum(base, cap)
+    # Each pass caps at least one more weight, so n passes always settle
+    for _ in range(base.shape[1]):
+        free = np.where(held & (capped < cap), base, 0.0)
+        deficit = total - capped.sum(axis=1, keepdims=True)
+        free_total = free.sum(axis=1, keepdims=True)
+        if not np.any((deficit > 1e-12) & (free_total > 0)):
+            break
+        share = np.divide(deficit * free, free_total, out=np.zeros_like(free), where=free_total > 0)
+        capped = np.minimum(capped + share, cap)
+
+    return capped[0] if single else capped
@@ -0,0 +1,249 @@
+"""
+Request Profiling
+Opt-in cProfile of individual requests (admin header or sampling rate) and a
+low-rate stack sampler for production, both written as pstats or collapsed
+stacks (flamegraph.pl / speedscope input) to a local directory
+"""
+
+import os
+import sys
+import time
+import cProfile
+import hmac
+import logging
+import random
+import re
+import tempfile
+import threading
+from collections import Counter
+from typing import Dict, Iterable, Optional
+
+from flask import Response, g, request
+
+PROFILE_HEADER = 'X-Profile'
+
+# Python 3.12+ allows one active cProfile per interpreter, so requests take turns
+_PROFILE_LOCK = threading.Lock()
+
+def collapse_stack(frame, root: str = '') -> str:
+    """Frame chain as one collapsed-stack line (outermost first, ';'-separated)"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}".replace(';', ':').replace(' ', '_'))
+        frame = frame.f_back
+    if root:
+        names.append(root.replace(';', ':').replace(' ', '_'))
+    return ';'.join(reversed(names))
+
+def write_collapsed(path: str, stacks: Counter):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    os.replace(tmp_path, path)
+
+class _ThreadSampler:
+    """Samples one thread's stack every interval seconds until stopped"""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-sampler', daemon=True)
+
+    def start(self) -> '_ThreadSampler':
+        self._thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        self._stop_event.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse_stack(frame)] += 1
+
+class RequestProfiler:
+    """
+    Profiles requests to the given routes when they carry `X-Profile: <admin token>`
+    or are picked by sample_rate. Each profiled request leaves <id>.pstats (cProfile)
+    and <id>.collapsed (1 ms stack samples) in directory and gets an X-Profile-Id header
+    """
+
+    def __init__(self, directory: Optional[str] = None, routes: Iterable[str] = ('/api/optimize', '/api/protocols'),
+                 admin_token: Optional[str] = None, sample_rate: float = 0.0, sample_interval: float = 0.001,
+                 max_files: int = 200):
+        self.logger = logging.getLogger(__name__)
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'ai-yield-aggregator', 'profiles')
+        self.routes = frozenset(routes)
+        # Without an admin token the header is ignored and only sampling can select requests
+        self.admin_token = admin_token
+        self.sample_rate = sample_rate
+        self.sample_interval = sample_interval
+        # Oldest request profiles beyond max_files are deleted
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        self._stats = {'profiled': 0, 'rejected_tokens': 0, 'write_errors': 0, 'skipped_busy': 0}
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.admin_token) or self.sample_rate > 0
+
+    def start(self):
+        """before_request hook"""
+        if not self.enabled or request.url_rule is None or request.url_rule.rule not in self.routes:
+            return
+        if not self._selected():
+            return
+        # Skip rather than wait while another request is being profiled
+        if not _PROFILE_LOCK.acquire(blocking=False):
+            self._count('skipped_busy')
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler (outside this class) is already active
+            _PROFILE_LOCK.release()
+            self._count('skipped_busy')
+            return
+        g.profile = (profile, _ThreadSampler(threading.get_ident(), self.sample_interval).start(), time.perf_counter())
+
+    def finish(self, response: Response) -> Response:
+        """after_request hook"""
+        state = g.pop('profile', None)
+        if state is None:
+            return response
+        profile, sampler, started = state
+        profile.disable()
+        _PROFILE_LOCK.release()
+        stacks = sampler.stop()
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        route = request.url_rule.rule.strip('/').replace('/', '_')
+        profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{threading.get_ident() % 100000}-{route}-{elapsed_ms:.0f}ms"
+        try:
+            profile.dump_stats(os.path.join(self.directory, f"{profile_id}.pstats"))
+            write_collapsed(os.path.join(self.directory, f"{profile_id}.collapsed"), stacks)
+            self._prune()
+        except OSError as e:
+            self._count('write_errors')
+            self.logger.error(f"Could not write request profile {profile_id}: {e}")
+            return response
+
+        self._count('profiled')
+        response.headers['X-Profile-Id'] = profile_id
+        return response
+
+    def discard(self, exc: Optional[BaseException] = None):
+        """teardown_request hook: stop profiling a request that ended without a response"""
+        state = g.pop('profile', None)
+        if state is not None:
+            state[0].disable()
+            _PROFILE_LOCK.release()
+            state[1].stop()
+
+    def stats(self) -> Dict:
+        return {
+            **self._stats,
+            'directory': self.directory,
+            'routes': sorted(self.routes),
+            'sample_rate': self.sample_rate,
+            'header_enabled': bool(self.admin_token)
+        }
+
+    def _selected(self) -> bool:
+        token = request.headers.get(PROFILE_HEADER)
+        if token is not None and self.admin_token:
+            if hmac.compare_digest(token.encode(), self.admin_token.encode()):
+                return True
+            self._count('rejected_tokens')
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _prune(self):
+        profiles = sorted(
+            name for name in os.listdir(self.directory) if name.endswith('.pstats')
+        )
+        for name in profiles[:max(0, len(profiles) - self.max_files)]:
+            for suffix in ('.pstats', '.collapsed'):
+                try:
+                    os.remove(os.path.join(self.directory, name[:-len('.pstats')] + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+class StackSampler:
+    """
+    Always-on sampler for production: every interval seconds it records the stack of
+    every other thread (rooted at the thread name), and every flush_interval seconds
+    writes the aggregate to samples-<time>-<pid>-<n>.collapsed. At the default 10 ms the
+    cost is one sys._current_frames() walk per tick and no tracing of the code itself
+    """
+
+    def __init__(self, directory: Optional[str] = None, interval: float = 0.01, flush_interval: float = 60.0,
+                 max_files: int = 500):
+        self.logger = logging.getLogger(__name__)
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'ai-yield-aggregator', 'profiles')
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.max_files = max_files
+
+        self._stacks: Counter = Counter()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {'samples': 0, 'files': 0}
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self) -> Dict:
+        return {**self._stats, 'running': self._thread is not None and self._thread.is_alive(), 'interval': self.interval}
+
+    def _run(self):
+        own_id = threading.get_ident()
+        next_flush = time.monotonic() + self.flush_interval
+        while not self._stop_event.wait(self.interval):
+            # Numbered pool threads (defi-fetch_0, defi-fetch_1, ...) share one root
+            names = {thread.ident: re.sub(r'\d+', 'N', thread.name) for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self._stacks[collapse_stack(frame, names.get(thread_id, 'unknown'))] += 1
+            self._stats['samples'] += 1
+            if time.monotonic() >= next_flush:
+                self._flush()
+                next_flush = time.monotonic() + self.flush_interval
+        self._flush()
+
+    def _flush(self):
+        if not self._stacks:
+            return
+        stacks, self._stacks = self._stacks, Counter()
+        path = os.path.join(self.directory, f"samples-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{self._stats['files']}.collapsed")
+        try:
+            write_collapsed(path, stacks)
+            self._stats['files'] += 1
+            files = sorted(name for name in os.listdir(self.directory) if name.startswith('samples-'))
+            for name in files[:max(0, len(files) - self.max_files)]:
+                os.remove(os.path.join(self.directory, name))
+        except OSError as e:
+            self.logger.error(f"Could not write stack samples: {e}")
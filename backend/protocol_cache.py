@@ -0,0 +1,166 @@
+"""
+Protocol Snapshot Cache
+TTL cache with stale-while-revalidate semantics around DeFi protocol data
+"""
+
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+from dataclasses import dataclass
+
+from defi_service import ProtocolAPY
+from metrics import metrics
+
+CACHE_LOOKUPS = metrics.counter('defi_protocol_cache_lookups_total', 'Protocol snapshot lookups by outcome', ['result'])
+
+@dataclass(frozen=True)
+class ProtocolSnapshot:
+    data: Dict[str, ProtocolAPY]
+    version: int
+    fetched_at: float
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.fetched_at
+
+class ProtocolDataCache:
+    def __init__(self, loader: Callable[[], Dict[str, ProtocolAPY]], ttl: float = 300, max_stale: float = 3600):
+        self.logger = logging.getLogger(__name__)
+        self.loader = loader
+        # Snapshots younger than ttl are fresh; up to max_stale they are served while refreshing
+        self.ttl = ttl
+        self.max_stale = max(max_stale, ttl)
+
+        self._snapshot: Optional[ProtocolSnapshot] = None
+        self._version = 0
+        self._publish_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._refreshing = False
+        self._listeners: List[Callable[[ProtocolSnapshot], None]] = []
+
+        self._stats = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'refreshes': 0,
+            'refresh_errors': 0
+        }
+
+    @property
+    def snapshot(self) -> Optional[ProtocolSnapshot]:
+        """Current snapshot as is, without loading or revalidating"""
+        return self._snapshot
+
+    def get(self) -> Dict[str, ProtocolAPY]:
+        """Return the current protocol data, loading or revalidating as needed"""
+        return self.get_snapshot().data
+
+    def get_snapshot(self) -> ProtocolSnapshot:
+        """Return the current snapshot; stale snapshots are served while one refresh runs"""
+        snapshot = self._snapshot
+
+        if snapshot is not None:
+            age = snapshot.age
+            if age < self.ttl:
+                self._stats['hits'] += 1
+                CACHE_LOOKUPS.inc(result='hit')
+                return snapshot
+            if age < self.max_stale:
+                self._stats['stale_hits'] += 1
+                CACHE_LOOKUPS.inc(result='stale')
+                self._refresh_in_background()
+                return snapshot
+
+        self._stats['misses'] += 1
+        CACHE_LOOKUPS.inc(result='miss')
+        with self._load_lock:
+            # Another thread may have loaded the data while we waited for the lock
+            current = self._snapshot
+            if current is not None and current is not snapshot and current.age < self.ttl:
+                return current
+            try:
+                return self._refresh()
+            except Exception as e:
+                if current is None:
+                    raise
+                self.logger.error(f"Protocol data refresh failed, serving stale snapshot: {e}")
+                return current
+
+    def publish(self, data: Dict[str, ProtocolAPY]) -> ProtocolSnapshot:
+        """Atomically replace the current snapshot with new data"""
+        with self._publish_lock:
+            snapshot = self._swap(dict(data))
+        self._notify(snapshot)
+        return snapshot
+
+    def update(self, data: Dict[str, ProtocolAPY]) -> ProtocolSnapshot:
+        """Publish the current snapshot with some protocols replaced (e.g. fetches that finished late)"""
+        # Merge under the lock so concurrent partial updates never drop each other's protocols
+        with self._publish_lock:
+            current = self._snapshot
+            snapshot = self._swap({**(current.data if current else {}), **data})
+        self._notify(snapshot)
+        return snapshot
+
+    def add_listener(self, listener: Callable[[ProtocolSnapshot], None]):
+        """Call listener with every newly published snapshot (on the publishing thread)"""
+        self._listeners.append(listener)
+
+    def invalidate(self):
+        """Drop the current snapshot so the next read reloads it"""
+        self._snapshot = None
+
+    def stats(self) -> Dict:
+        """Return hit/miss counters and the age of the current snapshot"""
+        snapshot = self._snapshot
+        lookups = self._stats['hits'] + self._stats['stale_hits'] + self._stats['misses']
+        return {
+            **self._stats,
+            'hit_ratio': round((self._stats['hits'] + self._stats['stale_hits']) / lookups, 4) if lookups else 0,
+            'version': snapshot.version if snapshot else 0,
+            'age_seconds': round(snapshot.age, 2) if snapshot else None,
+            'ttl_seconds': self.ttl,
+            'max_stale_seconds': self.max_stale,
+            'refreshing': self._refreshing
+        }
+
+    def _swap(self, data: Dict[str, ProtocolAPY]) -> ProtocolSnapshot:
+        # Caller holds _publish_lock
+        self._version += 1
+        snapshot = ProtocolSnapshot(data=data, version=self._version, fetched_at=time.time())
+        self._snapshot = snapshot
+        return snapshot
+
+    def _notify(self, snapshot: ProtocolSnapshot):
+        for listener in self._listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                self.logger.error(f"Snapshot listener {getattr(listener, '__name__', listener)} failed: {e}")
+
+    def _refresh(self) -> ProtocolSnapshot:
+        try:
+            data = self.loader()
+        except Exception:
+            self._stats['refresh_errors'] += 1
+            raise
+        self._stats['refreshes'] += 1
+        return self.publish(data)
+
+    def _refresh_in_background(self):
+        with self._publish_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                with self._load_lock:
+                    self._refresh()
+            except Exception as e:
+                self.logger.error(f"Background protocol data refresh failed: {e}")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name='protocol-cache-refresh', daemon=True).start()
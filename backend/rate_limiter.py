@@ -0,0 +1,99 @@
+"""
+Rate Limiter
+Token buckets kept in a SQLite file so every gunicorn worker on the host draws
+from the same per-client, per-endpoint budget
+"""
+
+import os
+import math
+import time
+import sqlite3
+import logging
+import tempfile
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+@dataclass(frozen=True)
+class RateLimitResult:
+    allowed: bool
+    limit: int
+    remaining: int
+    retry_after: int  # Seconds until one token is available again (0 when allowed)
+
+class TokenBucketLimiter:
+    """
+    One row per bucket holding (tokens, updated_at); a check refills the bucket for
+    the time elapsed and takes a token inside a single short write transaction
+    """
+
+    def __init__(self, path: Optional[str] = None, busy_timeout: float = 1.0, prune_every: int = 1000,
+                 max_idle: float = 3600):
+        self.logger = logging.getLogger(__name__)
+        self.path = path or os.path.join(tempfile.gettempdir(), 'ai-yield-aggregator', 'rate_limits.sqlite3')
+        self.busy_timeout = busy_timeout
+        # Buckets idle for longer than max_idle (>= any window) are full again, so they are deleted now and then
+        self.prune_every = prune_every
+        self.max_idle = max_idle
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._checks = 0
+        self._stats = {'allowed': 0, 'limited': 0, 'errors': 0}
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), mode=0o700, exist_ok=True)
+
+    def check(self, key: str, capacity: int, window: float) -> RateLimitResult:
+        """Take one token from bucket key (capacity tokens, refilled evenly over window seconds)"""
+        rate = capacity / window
+        now = time.time()
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                row = conn.execute('SELECT tokens, updated_at FROM buckets WHERE key = ?', (key,)).fetchone()
+                tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+                allowed = tokens >= 1
+                if allowed:
+                    tokens -= 1
+                conn.execute(
+                    'INSERT INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?) '
+                    'ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at',
+                    (key, tokens, now)
+                )
+            self._maybe_prune(conn, now)
+        except sqlite3.Error as e:
+            # Never take the API down because the limiter store is unavailable
+            self._count('errors')
+            self.logger.error(f"Rate limiter unavailable, allowing request: {e}")
+            return RateLimitResult(True, capacity, capacity, 0)
+
+        self._count('allowed' if allowed else 'limited')
+        retry_after = 0 if allowed else max(1, math.ceil((1 - tokens) / rate))
+        return RateLimitResult(allowed, capacity, int(tokens), retry_after)
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self._stats)
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections must not cross threads, and must not survive fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _maybe_prune(self, conn: sqlite3.Connection, now: float):
+        with self._lock:
+            self._checks += 1
+            if self._checks % self.prune_every:
+                return
+        with conn:
+            conn.execute('DELETE FROM buckets WHERE updated_at < ?', (now - self.max_idle,))
+
+    def _count(self, outcome: str):
+        with self._lock:
+            self._stats[outcome] += 1
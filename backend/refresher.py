@@ -0,0 +1,136 @@
+"""
+Protocol Refresher
+Background scheduler that keeps the protocol snapshot current so request
+handlers never wait on upstream I/O
+"""
+
+import os
+import heapq
+import random
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from apy_history import APYHistoryStore
+from defi_service import DeFiService
+from memory_tracker import memory_tracker
+from protocol_cache import ProtocolDataCache, ProtocolSnapshot
+
+class ProtocolRefresher:
+    def __init__(self, service: DeFiService, cache: ProtocolDataCache,
+                 default_interval: float = 300, default_jitter: float = 30,
+                 history: Optional[APYHistoryStore] = None):
+        self.logger = logging.getLogger(__name__)
+        self.service = service
+        self.cache = cache
+        # Every live fetched market is also appended to the on-disk APY history
+        self.history = history
+        self.default_interval = default_interval
+        self.default_jitter = default_jitter
+
+        self._last_refresh: Dict[str, float] = {}
+        self._schedule: List[Tuple[float, str]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._thread_pid: Optional[int] = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self) -> bool:
+        """Start the scheduler thread in the current process (no-op if already running)"""
+        with self._lock:
+            if self.is_running():
+                return False
+            self._stop_event = threading.Event()
+            self._schedule = [(0.0, protocol_id) for protocol_id in self.service.protocols]
+            heapq.heapify(self._schedule)
+            self._thread = threading.Thread(target=self._run, name='protocol-refresher', daemon=True)
+            self._thread_pid = os.getpid()
+            self._thread.start()
+        self.logger.info(f"Protocol refresher started in process {self._thread_pid}")
+        return True
+
+    def stop(self, timeout: float = 5.0):
+        """Signal the scheduler to stop and wait for the in-flight refresh to finish"""
+        with self._lock:
+            thread = self._thread
+            self._stop_event.set()
+            self._thread = None
+        if thread is not None and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(timeout)
+        self.logger.info("Protocol refresher stopped")
+
+    def is_running(self) -> bool:
+        # Threads do not survive fork, so a thread started in the parent does not count
+        return (
+            self._thread is not None
+            and self._thread_pid == os.getpid()
+            and self._thread.is_alive()
+        )
+
+    def status(self) -> Dict:
+        """Return per-protocol refresh state for diagnostics"""
+        now = time.time()
+        next_due = {protocol_id: due for due, protocol_id in list(self._schedule)}
+        return {
+            'running': self.is_running(),
+            'protocols': {
+                protocol_id: {
+                    'interval': self._interval(protocol_id),
+                    'last_refresh_age': round(now - self._last_refresh[protocol_id], 2) if protocol_id in self._last_refresh else None,
+                    'next_refresh_in': round(max(0.0, next_due[protocol_id] - time.monotonic()), 2) if protocol_id in next_due else None
+                }
+                for protocol_id in self.service.protocols
+            }
+        }
+
+    def refresh(self, protocol_ids: List[str]) -> Optional[ProtocolSnapshot]:
+        """Fetch the given protocols and publish a new snapshot if anything came back"""
+        with memory_tracker.measure('refresh'):
+            fetched = self.service.fetch_protocols(protocol_ids)
+        if not fetched:
+            return None
+
+        now = time.time()
+        for protocol_id in fetched:
+            self._last_refresh[protocol_id] = now
+        # Merge into the published snapshot, which late deliveries also update
+        snapshot = self.cache.update(fetched)
+
+        # Stale and fallback results repeat old or made-up numbers, which must not become samples
+        live = {protocol_id: apy_data for protocol_id, apy_data in fetched.items() if apy_data.status == 'live'}
+        if self.history is not None and live:
+            try:
+                self.history.append_markets(live, now)
+            except Exception as e:
+                self.logger.error(f"Could not record APY history for {', '.join(live)}: {e}")
+        return snapshot
+
+    def _interval(self, protocol_id: str) -> float:
+        return self.service.protocols[protocol_id].get('refresh_interval', self.default_interval)
+
+    def _next_due(self, protocol_id: str, now: float) -> float:
+        jitter = self.service.protocols[protocol_id].get('refresh_jitter', self.default_jitter)
+        return now + max(1.0, self._interval(protocol_id) + random.uniform(-jitter, jitter))
+
+    def _run(self):
+        stop_event = self._stop_event
+        while not stop_event.is_set():
+            now = time.monotonic()
+            due = []
+            while self._schedule and self._schedule[0][0] <= now:
+                due.append(heapq.heappop(self._schedule)[1])
+
+            if due:
+                try:
+                    snapshot = self.refresh(due)
+                    if snapshot:
+                        self.logger.info(f"Published protocol snapshot v{snapshot.version} ({', '.join(due)})")
+                except Exception as e:
+                    self.logger.error(f"Error refreshing {', '.join(due)}: {e}")
+                now = time.monotonic()
+                for protocol_id in due:
+                    heapq.heappush(self._schedule, (self._next_due(protocol_id, now), protocol_id))
+
+            wait = self._schedule[0][0] - time.monotonic() if self._schedule else self.default_interval
+            stop_event.wait(max(0.0, wait))
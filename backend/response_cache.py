@@ -0,0 +1,141 @@
+"""
+Response Cache
+Serialized JSON bodies (and their compressed variants) memoized per data
+version, served with strong ETags so unchanged payloads cost a 304, plus
+Accept-Encoding negotiated compression for every other response
+"""
+
+import gzip
+import json
+import hashlib
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+# Preferred first when the client accepts several with the same quality
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/javascript', 'image/svg+xml')
+
+def compress(data: bytes, encoding: str, gzip_level: int = 6, brotli_quality: int = 5) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=brotli_quality)
+    return gzip.compress(data, compresslevel=gzip_level)
+
+@dataclass
+class CachedBody:
+    version: Hashable
+    body: bytes
+    etag: str
+    encoded: Dict[str, bytes] = field(default_factory=dict)
+
+class ResponseCache:
+    def __init__(self, min_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 5):
+        # Bodies smaller than min_size are sent uncompressed: the headers and CPU cost more than they save
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+        # Only the latest version of each key is kept
+        self._entries: Dict[str, CachedBody] = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0, 'builds': 0, 'not_modified': 0,
+            'compressions': 0, 'compressed_from_cache': 0, 'bytes_in': 0, 'bytes_out': 0
+        }
+
+    def get(self, key: str, version: Hashable, build: Callable[[], Any]) -> CachedBody:
+        """Cached body for key at version, serializing build() only when the version changed"""
+        entry = self._entries.get(key)
+        if entry is not None and entry.version == version:
+            self._stats['hits'] += 1
+            return entry
+
+        body = json.dumps(build(), separators=(',', ':')).encode()
+        entry = CachedBody(version=version, body=body, etag=hashlib.sha256(body).hexdigest()[:32])
+        with self._lock:
+            self._entries[key] = entry
+            self._stats['builds'] += 1
+        return entry
+
+    def respond(self, key: str, version: Hashable, build: Callable[[], Any], max_age: int = 0) -> Response:
+        """JSON response for key at version; 304 when the client already holds this ETag"""
+        entry = self.get(key, version, build)
+        encoding = self.negotiate(len(entry.body))
+        # Strong ETags identify the exact bytes, so each encoding gets its own
+        etag = f"{entry.etag}-{encoding}" if encoding else entry.etag
+
+        if request.if_none_match.contains(etag):
+            self._stats['not_modified'] += 1
+            response = Response(status=304)
+        elif encoding:
+            response = Response(self._encoded(entry, encoding), mimetype='application/json')
+            response.headers['Content-Encoding'] = encoding
+        else:
+            response = Response(entry.body, mimetype='application/json')
+
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = f"public, max-age={max_age}, must-revalidate"
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def negotiate(self, size: int) -> Optional[str]:
+        """Best encoding the client accepts for a body of size bytes, or None to send it as is"""
+        if size < self.min_size:
+            return None
+        return request.accept_encodings.best_match(ENCODINGS)
+
+    def compress_response(self, response: Response) -> Response:
+        """after_request hook: compress uncached responses the client can decode"""
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers
+                or not (response.mimetype in COMPRESSIBLE_MIMETYPES or response.mimetype.startswith('text/'))):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        data = response.get_data()
+        encoding = self.negotiate(len(data))
+        if encoding is None:
+            return response
+
+        compressed = compress(data, encoding, self.gzip_level, self.brotli_quality)
+        self._count_compression(len(data), len(compressed))
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    def memory_usage(self) -> int:
+        """Bytes of serialized and compressed bodies held"""
+        return sum(len(entry.body) + sum(map(len, entry.encoded.values())) for entry in list(self._entries.values()))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            'encodings': list(ENCODINGS),
+            'min_size': self.min_size,
+            'compression_ratio': round(self._stats['bytes_out'] / self._stats['bytes_in'], 4) if self._stats['bytes_in'] else None,
+            'entries': {key: str(entry.version) for key, entry in self._entries.items()}
+        }
+
+    def _encoded(self, entry: CachedBody, encoding: str) -> bytes:
+        # Compression is paid once per version and encoding
+        data = entry.encoded.get(encoding)
+        if data is None:
+            data = entry.encoded[encoding] = compress(entry.body, encoding, self.gzip_level, self.brotli_quality)
+            self._count_compression(len(entry.body), len(data))
+        else:
+            self._stats['compressed_from_cache'] += 1
+        return data
+
+    def _count_compression(self, size_in: int, size_out: int):
+        with self._lock:
+            self._stats['compressions'] += 1
+            self._stats['bytes_in'] += size_in
+            self._stats['bytes_out'] += size_out
@@ -0,0 +1,151 @@
+"""
+Single-Flight Coalescing
+Ensures only one refresh per key runs at a time, within a process and across gunicorn workers
+"""
+
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: fall back to in-process coalescing only
+    fcntl = None
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key within one process"""
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self._stats = {'executed': 0, 'coalesced': 0}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Run fn for key, or wait for and share the result of the call already in flight"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats['executed'] += 1
+            else:
+                self._stats['coalesced'] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self._stats)
+
+class SharedLease:
+    """
+    Cross-process lease backed by a lock file per key: the holder runs fn and
+    publishes its result to a sibling file, other workers block on the lock and
+    reuse that result while it is younger than result_ttl. Results rejected by
+    shareable (e.g. placeholders served during an outage) are returned to the
+    caller only, so other workers run fn themselves
+    """
+
+    def __init__(self, directory: Optional[str] = None, result_ttl: float = 15.0, wait_timeout: float = 30.0,
+                 encode: Callable[[Any], Any] = lambda value: value,
+                 decode: Callable[[Any], Any] = lambda value: value,
+                 shareable: Callable[[Any], bool] = lambda value: True):
+        self.logger = logging.getLogger(__name__)
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'ai-yield-aggregator')
+        self.result_ttl = result_ttl
+        self.wait_timeout = wait_timeout
+        self.encode = encode
+        self.decode = decode
+        self.shareable = shareable
+        self._stats = {'executed': 0, 'reused': 0, 'lock_timeouts': 0, 'not_shared': 0}
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+
+    def run(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Run fn under the cross-process lease for key, or reuse a result another worker just produced"""
+        if fcntl is None:
+            self._stats['executed'] += 1
+            return fn()
+
+        lock_path = os.path.join(self.directory, f"{key}.lock")
+        result_path = os.path.join(self.directory, f"{key}.json")
+
+        with open(lock_path, 'a+') as lock_file:
+            locked = self._acquire(lock_file)
+            try:
+                found, value = self._read_result(result_path)
+                if found:
+                    self._stats['reused'] += 1
+                    return value
+
+                self._stats['executed'] += 1
+                value = fn()
+                if not self.shareable(value):
+                    self._stats['not_shared'] += 1
+                elif locked:
+                    self._write_result(result_path, value)
+                return value
+            finally:
+                if locked:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self._stats)
+
+    def _acquire(self, lock_file) -> bool:
+        # Poll rather than block forever so a wedged worker cannot stall everyone else
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    self._stats['lock_timeouts'] += 1
+                    self.logger.warning(f"Timed out waiting for lease {lock_file.name}, running without it")
+                    return False
+                time.sleep(0.05)
+
+    def _read_result(self, path: str):
+        try:
+            if time.time() - os.path.getmtime(path) > self.result_ttl:
+                return False, None
+            with open(path) as f:
+                return True, self.decode(json.load(f))
+        except (OSError, ValueError, TypeError):
+            return False, None
+
+    def _write_result(self, path: str, value: Any):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.encode(value), f)
+            # Atomic rename so readers never see a partially written result
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            self.logger.error(f"Could not publish shared result {path}: {e}")
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
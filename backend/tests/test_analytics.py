@@ -0,0 +1,26 @@
+import pytest
+
+from analytics import AnalyticsEngine
+from apy_history import APYHistoryStore
+
+def make_engine(tmp_path, apys):
+    store = APYHistoryStore(str(tmp_path / 'apy_history.bin'), min_interval=0)
+    for day, apy in enumerate(apys):
+        store.append([('weighted', 'USDC', apy, 0.0)], timestamp=day * 86400)
+    engine = AnalyticsEngine(store, 'weighted')
+    engine.sync()
+    return engine
+
+def test_value_drawdown_only_follows_negative_yield(tmp_path):
+    # The last day is still in progress and not folded in yet
+    engine = make_engine(tmp_path, [12.0, 6.0, 6.0, 6.0])
+    assert engine.drawdown()['max'] == 0.0
+
+    engine = make_engine(tmp_path / 'negative', [10.0, -365.0, 5.0, 5.0])
+    assert engine.drawdown()['max'] == pytest.approx(0.01)
+
+def test_apy_drawdown_is_the_fall_from_the_peak_apy(tmp_path):
+    engine = make_engine(tmp_path, [8.0, 12.0, 6.0, 9.0, 9.0])
+
+    assert engine.apy_drawdown()['max'] == pytest.approx(0.5)
+    assert engine.apy_drawdown()['current'] == pytest.approx(0.25)
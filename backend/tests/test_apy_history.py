@@ -0,0 +1,55 @@
+import numpy as np
+
+from apy_history import APYHistoryStore
+
+def make_store(tmp_path, **kwargs):
+    return APYHistoryStore(str(tmp_path / 'apy_history.bin'), **kwargs)
+
+def test_append_and_range_round_trip(tmp_path):
+    store = make_store(tmp_path, min_interval=0)
+    store.append([('aave', 'USDC', 4.5, 1e9), ('aave', 'DAI', 3.25, 5e8)], timestamp=1000)
+    store.append([('aave', 'USDC', 4.75, 1.1e9)], timestamp=2000)
+
+    records = store.range()
+    assert len(store) == 3
+    assert records['timestamp'].tolist() == [1000, 1000, 2000]
+    assert records['protocol'].tolist() == [b'aave'] * 3
+    assert records['token'].tolist() == [b'USDC', b'DAI', b'USDC']
+    assert np.allclose(records['apy'], [4.5, 3.25, 4.75])
+    assert np.allclose(records['tvl'], [1e9, 5e8, 1.1e9])
+
+def test_range_bounds_are_half_open(tmp_path):
+    store = make_store(tmp_path, min_interval=0)
+    for timestamp in (100, 200, 300):
+        store.append([('compound', 'USDC', timestamp / 100, 0.0)], timestamp=timestamp)
+
+    assert store.range(200, 300)['timestamp'].tolist() == [200]
+    assert store.range(start=200)['timestamp'].tolist() == [200, 300]
+    assert store.range(end=200)['timestamp'].tolist() == [100]
+    assert len(store.range(400)) == 0
+
+def test_series_filters_one_market_and_keeps_the_latest(tmp_path):
+    store = make_store(tmp_path, min_interval=0)
+    for timestamp in range(10):
+        store.append([('yearn', 'USDC', float(timestamp), 0.0), ('curve', 'USDC', -1.0, 0.0)], timestamp=timestamp)
+
+    series = store.series('yearn', 'USDC', start=2, end=8, limit=3)
+    assert series['timestamp'].tolist() == [5, 6, 7]
+    assert series['apy'].tolist() == [5.0, 6.0, 7.0]
+    assert len(store.series('yearn', 'DAI')) == 0
+
+def test_samples_closer_than_min_interval_are_dropped(tmp_path):
+    store = make_store(tmp_path, min_interval=60)
+    assert store.append([('aave', 'USDC', 4.0, 0.0)], timestamp=1000) == 1
+    assert store.append([('aave', 'USDC', 4.1, 0.0)], timestamp=1030) == 0
+    assert store.append([('aave', 'USDC', 4.2, 0.0)], timestamp=1060) == 1
+    assert store.range()['apy'].tolist() == [4.0, 4.2]
+
+def test_file_grows_and_reopens_with_the_same_records(tmp_path):
+    store = make_store(tmp_path, min_interval=0, initial_capacity=4)
+    for timestamp in range(10):
+        store.append([('compound', 'USDC', timestamp * 0.5, 0.0)], timestamp=timestamp)
+
+    reopened = make_store(tmp_path, min_interval=0)
+    assert len(reopened) == 10
+    assert reopened.range()['apy'].tolist() == [timestamp * 0.5 for timestamp in range(10)]
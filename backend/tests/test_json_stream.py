@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from json_stream import iter_array_items
+
+DOCUMENT = json.dumps({
+    'meta': {'count': 3, 'source': 'test'},
+    'data': {
+        'poolData': [
+            {'name': 'USDC', 'apy': 1.5, 'tvl': 12e-3, 'fee': -4.25e+2, 'ok': True},
+            {'name': 'DAI', 'apy': 1e5, 'tvl': 0, 'fee': None, 'ok': False},
+            {'name': 'FRAX é', 'apy': -0.125, 'tvl': 3.75E-7, 'fee': 10, 'ok': True}
+        ]
+    }
+}).encode()
+EXPECTED = json.loads(DOCUMENT)['data']['poolData']
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 7, 64, len(DOCUMENT)])
+def test_items_survive_any_chunk_size(size):
+    assert list(iter_array_items(chunked(DOCUMENT, size), path=('data', 'poolData'))) == EXPECTED
+
+def test_every_split_point_of_a_number():
+    # Splits right after '.', 'e' and the exponent sign must not end the number early
+    data = b'[1.5, 12e-3, -4.25e+2, 3.75E-7, 1e5, 10]'
+    expected = json.loads(data)
+    for split in range(1, len(data)):
+        assert list(iter_array_items([data[:split], data[split:]])) == expected, split
+
+def test_predicate_filters_items():
+    items = iter_array_items(chunked(DOCUMENT, 4), path=('data', 'poolData'), predicate=lambda item: item['ok'])
+    assert [item['name'] for item in items] == ['USDC', 'FRAX é']
+
+def test_multibyte_characters_split_across_chunks():
+    data = json.dumps(['é中\U0001f600'], ensure_ascii=False).encode()
+    assert list(iter_array_items(chunked(data, 1))) == ['é中\U0001f600']
+
+def test_missing_path_raises_key_error():
+    with pytest.raises(KeyError):
+        list(iter_array_items([DOCUMENT], path=('data', 'missing')))
+
+def test_truncated_document_raises():
+    with pytest.raises(ValueError):
+        list(iter_array_items([b'[{"apy": 1.5}, {"apy": ']))
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from defi_service import DeFiService, ProtocolAPY
+from optimizer import mean_variance_weights
+
+RETURNS = np.array([0.12, 0.09, 0.07, 0.05, 0.03])
+VOLATILITIES = np.array([0.20, 0.12, 0.08, 0.05, 0.02])
+
+@pytest.mark.parametrize('risk_aversion', [0.5, 2.0, 10.0, 100.0])
+@pytest.mark.parametrize('max_allocation', [0.25, 0.4, 1.0])
+def test_weights_fill_the_budget_within_caps(risk_aversion, max_allocation):
+    weights = mean_variance_weights(RETURNS, VOLATILITIES, risk_aversion, max_allocation)
+
+    assert weights.shape == RETURNS.shape
+    assert weights.sum() == pytest.approx(1.0)
+    assert np.all(weights >= 0)
+    assert np.all(weights <= max_allocation + 1e-9)
+
+def test_caps_too_low_to_fill_the_budget_are_raised_to_an_even_split():
+    weights = mean_variance_weights(RETURNS, VOLATILITIES, 2.0, max_allocation=0.1)
+
+    assert weights == pytest.approx(np.full(5, 0.2))
+
+def test_masked_pools_get_nothing():
+    mask = np.array([True, False, True, False, True])
+    weights = mean_variance_weights(RETURNS, VOLATILITIES, 2.0, 0.5, mask=mask)
+
+    assert weights.sum() == pytest.approx(1.0)
+    assert np.all(weights[~mask] == 0)
+    assert np.all(weights[mask] <= 0.5 + 1e-9)
+
+def test_batch_matches_single_solves():
+    risk_aversion = np.array([0.5, 4.0, 50.0])
+    max_allocation = np.array([[1.0], [0.4], [0.3]])
+    mask = np.array([[True] * 5, [True, True, True, True, False], [False, True, True, True, True]])
+
+    batch = mean_variance_weights(RETURNS, VOLATILITIES, risk_aversion, max_allocation, mask=mask)
+
+    assert batch.shape == (3, 5)
+    for row in range(3):
+        single = mean_variance_weights(RETURNS, VOLATILITIES, risk_aversion[row], max_allocation[row, 0], mask=mask[row])
+        assert batch[row] == pytest.approx(single)
+
+def test_higher_risk_aversion_moves_weight_to_low_volatility_pools():
+    bold = mean_variance_weights(RETURNS, VOLATILITIES, 0.5)
+    cautious = mean_variance_weights(RETURNS, VOLATILITIES, 100.0)
+
+    assert bold[0] > cautious[0]
+    assert cautious[-1] > bold[-1]
+
+def test_unknown_strategy_is_rejected():
+    service = DeFiService()
+    protocol_data = {'aave': ProtocolAPY('aave', 4.0, 1e9, 3.0, ['USDC'])}
+
+    with pytest.raises(ValueError):
+        service.optimize_portfolio(1000, 'medium', protocol_data, strategy='bogus')
@@ -0,0 +1,50 @@
+import pytest
+
+import rate_limiter
+from rate_limiter import TokenBucketLimiter
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(rate_limiter.time, 'time', lambda: now[0])
+    return now
+
+@pytest.fixture
+def limiter(tmp_path):
+    return TokenBucketLimiter(str(tmp_path / 'rate_limits.sqlite3'))
+
+def test_full_bucket_allows_capacity_requests(limiter, clock):
+    results = [limiter.check('client:/api/optimize', 3, 60) for _ in range(3)]
+
+    assert all(result.allowed for result in results)
+    assert [result.remaining for result in results] == [2, 1, 0]
+    assert all(result.retry_after == 0 for result in results)
+
+def test_retry_after_is_the_time_until_one_token_refills(limiter, clock):
+    for _ in range(3):
+        limiter.check('client:/api/optimize', 3, 60)
+
+    # 3 tokens per 60 s refill one token every 20 s
+    limited = limiter.check('client:/api/optimize', 3, 60)
+    assert not limited.allowed
+    assert limited.retry_after == 20
+
+    clock[0] += 10
+    assert limiter.check('client:/api/optimize', 3, 60).retry_after == 10
+
+    clock[0] += 10
+    assert limiter.check('client:/api/optimize', 3, 60).allowed
+
+def test_retry_after_is_at_least_one_second(limiter, clock):
+    for _ in range(100):
+        limiter.check('client:/api/prices', 100, 1)
+
+    limited = limiter.check('client:/api/prices', 100, 1)
+    assert not limited.allowed
+    assert limited.retry_after == 1
+
+def test_buckets_are_independent(limiter, clock):
+    limiter.check('a', 1, 60)
+
+    assert not limiter.check('a', 1, 60).allowed
+    assert limiter.check('b', 1, 60).allowed
@@ -0,0 +1,58 @@
+from apy_history import APYHistoryStore
+from defi_service import ProtocolAPY
+from protocol_cache import ProtocolDataCache
+from refresher import ProtocolRefresher
+
+class StubService:
+    """Serves canned fetch results in place of the upstream APIs"""
+
+    def __init__(self, results):
+        self.results = results
+        self.protocols = {protocol_id: {} for protocol_id in results}
+
+    def fetch_protocols(self, protocol_ids):
+        return {protocol_id: self.results[protocol_id] for protocol_id in protocol_ids}
+
+def make_refresher(tmp_path, results):
+    history = APYHistoryStore(str(tmp_path / 'apy_history.bin'), min_interval=0)
+    refresher = ProtocolRefresher(StubService(results), ProtocolDataCache(lambda: {}), history=history)
+    return refresher, history
+
+def test_fallback_refresh_writes_no_history(tmp_path):
+    refresher, history = make_refresher(tmp_path, {
+        'compound': ProtocolAPY('compound', 8.5, 2500000000, 2.5, ['USDC'], status='fallback'),
+        'aave': ProtocolAPY('aave', 12.3, 1800000000, 3.0, ['USDC'], status='fallback')
+    })
+
+    snapshot = refresher.refresh(['compound', 'aave'])
+
+    assert snapshot is not None
+    assert len(history) == 0
+
+def test_only_live_markets_are_recorded(tmp_path):
+    refresher, history = make_refresher(tmp_path, {
+        'compound': ProtocolAPY('compound', 4.2, 1e9, 2.5, ['USDC']),
+        'aave': ProtocolAPY('aave', 12.3, 1800000000, 3.0, ['USDC'], status='fallback'),
+        'yearn': ProtocolAPY('yearn', 7.1, 8e8, 3.5, ['USDC'], status='stale')
+    })
+
+    refresher.refresh(['compound', 'aave', 'yearn'])
+
+    records = history.range()
+    assert records['protocol'].tolist() == [b'compound']
+    assert records['apy'].tolist() == [4.2]
+
+def test_refresh_keeps_results_delivered_late(tmp_path):
+    refresher, _ = make_refresher(tmp_path, {
+        'compound': ProtocolAPY('compound', 4.2, 1e9, 2.5, ['USDC']),
+        'aave': ProtocolAPY('aave', 12.3, 1800000000, 3.0, ['USDC'], status='fallback')
+    })
+    refresher.refresh(['compound', 'aave'])
+    # A fetch that missed its deadline lands through the late result listener
+    late = ProtocolAPY('aave', 3.9, 2e9, 3.0, ['USDC'])
+    refresher.cache.update({'aave': late})
+
+    snapshot = refresher.refresh(['compound'])
+
+    assert snapshot.data['aave'] is late
+    assert snapshot.version == 3
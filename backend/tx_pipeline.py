@@ -0,0 +1,264 @@
+"""
+Transaction Pipeline
+Non-blocking submission, local nonce management, fee caching and background
+receipt tracking for updater transactions
+"""
+
+import time
+import statistics
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from web3.exceptions import TransactionNotFound
+
+from metrics import metrics
+
+# Same series as the contract reads, labelled by JSON-RPC method
+RPC_LATENCY = metrics.histogram('rpc_request_seconds', 'Latency of JSON-RPC round trips', ['method'])
+TX_SECONDS = metrics.histogram(
+    'updater_transaction_seconds', 'Time to sign and broadcast a transaction, and from first broadcast to its receipt',
+    ['stage'], buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30, 60, 120, 300, 600)
+)
+TX_OUTCOMES = metrics.counter('updater_transactions_total', 'Updater transactions by outcome', ['outcome'])
+
+class NonceManager:
+    """Hands out nonces locally; syncs from the chain on first use and after errors"""
+
+    def __init__(self, w3, address: str):
+        self.w3 = w3
+        self.address = address
+        self._next_nonce: Optional[int] = None
+        self._lock = threading.Lock()
+        self.stats = {'rpc_calls': 0, 'rpc_calls_saved': 0, 'resyncs': 0}
+
+    def next_nonce(self) -> int:
+        with self._lock:
+            if self._next_nonce is None:
+                # 'pending' includes our own transactions still in the mempool
+                with RPC_LATENCY.time(method='eth_getTransactionCount'):
+                    self._next_nonce = self.w3.eth.get_transaction_count(self.address, 'pending')
+                self.stats['rpc_calls'] += 1
+            else:
+                self.stats['rpc_calls_saved'] += 1
+            nonce = self._next_nonce
+            self._next_nonce += 1
+            return nonce
+
+    def resync(self):
+        """Forget the local nonce so the next call re-reads it from the chain"""
+        with self._lock:
+            self._next_nonce = None
+            self.stats['resyncs'] += 1
+
+class FeeOracle:
+    """Short-TTL cache of EIP-1559 fee parameters, falling back to legacy gasPrice"""
+
+    def __init__(self, w3, ttl: float = 15, reward_percentile: float = 50, base_fee_multiplier: float = 2,
+                 min_priority_fee: int = 10 ** 8):
+        self.w3 = w3
+        self.ttl = ttl
+        self.reward_percentile = reward_percentile
+        # maxFeePerGas = base_fee_multiplier * next base fee + tip, so the tx survives several full blocks
+        self.base_fee_multiplier = base_fee_multiplier
+        self.min_priority_fee = min_priority_fee
+        self._fees: Optional[Dict[str, int]] = None
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self.stats = {'rpc_calls': 0, 'rpc_calls_saved': 0}
+
+    def fees(self) -> Dict[str, int]:
+        """Fee fields ready to merge into a transaction dict"""
+        with self._lock:
+            if self._fees is not None and time.monotonic() - self._fetched_at < self.ttl:
+                self.stats['rpc_calls_saved'] += 1
+                return dict(self._fees)
+            self._fees = self._estimate()
+            self._fetched_at = time.monotonic()
+            return dict(self._fees)
+
+    def invalidate(self):
+        with self._lock:
+            self._fees = None
+
+    def _estimate(self) -> Dict[str, int]:
+        self.stats['rpc_calls'] += 1
+        try:
+            with RPC_LATENCY.time(method='eth_feeHistory'):
+                history = self.w3.eth.fee_history(5, 'latest', [self.reward_percentile])
+        except Exception:
+            history = None
+
+        base_fees = (history or {}).get('baseFeePerGas') or []
+        if not base_fees:
+            # Pre-London chain: plain gas price
+            self.stats['rpc_calls'] += 1
+            with RPC_LATENCY.time(method='eth_gasPrice'):
+                return {'gasPrice': self.w3.eth.gas_price}
+
+        # The last entry is the base fee of the next block
+        next_base_fee = base_fees[-1]
+        rewards = [reward[0] for reward in history.get('reward') or [] if reward]
+        priority_fee = max(int(statistics.median(rewards)) if rewards else 0, self.min_priority_fee)
+        return {
+            'maxPriorityFeePerGas': priority_fee,
+            'maxFeePerGas': int(next_base_fee * self.base_fee_multiplier) + priority_fee
+        }
+
+@dataclass
+class PendingTransaction:
+    nonce: int
+    transaction: Dict[str, Any]
+    tx_hashes: List[bytes]
+    first_sent_at: float
+    last_sent_at: float
+    replacements: int = 0
+    on_confirmed: Optional[Callable[[Any], None]] = None
+    on_failed: Optional[Callable[[str], None]] = None
+
+class TransactionPipeline:
+    def __init__(self, w3, account, poll_interval: float = 2.0, receipt_timeout: float = 600,
+                 replace_after: float = 90, max_replacements: int = 3, fee_bump: float = 1.125,
+                 fee_oracle: Optional[FeeOracle] = None):
+        self.w3 = w3
+        self.account = account
+        self.fee_oracle = fee_oracle
+        # Receipts are polled every poll_interval; a tx unmined after replace_after is re-sent
+        # with fees bumped by fee_bump (nodes require >= 10%), up to max_replacements times
+        self.poll_interval = poll_interval
+        self.receipt_timeout = receipt_timeout
+        self.replace_after = replace_after
+        self.max_replacements = max_replacements
+        self.fee_bump = fee_bump
+
+        self._pending: Dict[int, PendingTransaction] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {'submitted': 0, 'confirmed': 0, 'reverted': 0, 'replaced': 0, 'dropped': 0}
+
+    def start(self):
+        """Start the background receipt tracker"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='tx-pipeline', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def submit(self, transaction: Dict[str, Any], on_confirmed: Optional[Callable[[Any], None]] = None,
+               on_failed: Optional[Callable[[str], None]] = None) -> bytes:
+        """Sign and broadcast a fully built transaction, returning its hash without waiting for a receipt"""
+        tx_hash = self._send(transaction)
+        now = time.monotonic()
+        with self._lock:
+            self._pending[transaction['nonce']] = PendingTransaction(
+                nonce=transaction['nonce'],
+                transaction=dict(transaction),
+                tx_hashes=[tx_hash],
+                first_sent_at=now,
+                last_sent_at=now,
+                on_confirmed=on_confirmed,
+                on_failed=on_failed
+            )
+            self.stats['submitted'] += 1
+        TX_OUTCOMES.inc(outcome='submitted')
+        return tx_hash
+
+    def poll(self):
+        """Check every pending transaction once; called from the tracker thread"""
+        with self._lock:
+            pending = list(self._pending.values())
+
+        for tx in pending:
+            try:
+                receipt = self._find_receipt(tx)
+                if receipt is not None:
+                    self._finish(tx)
+                    TX_SECONDS.observe(time.monotonic() - tx.first_sent_at, stage='confirm')
+                    if receipt['status'] == 1:
+                        self.stats['confirmed'] += 1
+                        TX_OUTCOMES.inc(outcome='confirmed')
+                        if tx.on_confirmed:
+                            tx.on_confirmed(receipt)
+                    else:
+                        self.stats['reverted'] += 1
+                        TX_OUTCOMES.inc(outcome='reverted')
+                        if tx.on_failed:
+                            tx.on_failed(f"reverted in block {receipt['blockNumber']}")
+                    continue
+
+                now = time.monotonic()
+                if now - tx.first_sent_at > self.receipt_timeout:
+                    self._finish(tx)
+                    self.stats['dropped'] += 1
+                    TX_OUTCOMES.inc(outcome='dropped')
+                    print(f"⌛ Transaction with nonce {tx.nonce} not mined after {self.receipt_timeout:.0f}s, giving up")
+                    if tx.on_failed:
+                        tx.on_failed('receipt timeout')
+                elif now - tx.last_sent_at > self.replace_after and tx.replacements < self.max_replacements:
+                    self._replace(tx)
+            except Exception as e:
+                print(f"❌ Error tracking transaction with nonce {tx.nonce}: {e}")
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self.poll()
+            self._stop_event.wait(self.poll_interval)
+
+    def _send(self, transaction: Dict[str, Any]) -> bytes:
+        with TX_SECONDS.time(stage='send'):
+            signed_txn = self.account.sign_transaction(transaction)
+            return self.w3.eth.send_raw_transaction(signed_txn.rawTransaction)
+
+    def _find_receipt(self, tx: PendingTransaction):
+        # Any of the replacement hashes may be the one that got mined
+        for tx_hash in reversed(tx.tx_hashes):
+            try:
+                with RPC_LATENCY.time(method='eth_getTransactionReceipt'):
+                    return self.w3.eth.get_transaction_receipt(tx_hash)
+            except TransactionNotFound:
+                continue
+        return None
+
+    def _replace(self, tx: PendingTransaction):
+        """Re-send the same nonce with bumped fees to speed up a stuck transaction"""
+        replacement = dict(tx.transaction)
+        if self.fee_oracle is not None:
+            self.fee_oracle.invalidate()
+            current = self.fee_oracle.fees()
+        else:
+            current = {'gasPrice': self.w3.eth.gas_price}
+
+        # Never go below the current market fees, and always beat the previous attempt
+        if 'maxFeePerGas' in replacement:
+            for key in ('maxFeePerGas', 'maxPriorityFeePerGas'):
+                replacement[key] = max(int(replacement[key] * self.fee_bump) + 1, current.get(key, 0))
+        else:
+            replacement['gasPrice'] = max(
+                int(replacement['gasPrice'] * self.fee_bump) + 1,
+                current.get('gasPrice', current.get('maxFeePerGas', 0))
+            )
+
+        tx_hash = self._send(replacement)
+        with self._lock:
+            tx.transaction = replacement
+            tx.tx_hashes.append(tx_hash)
+            tx.last_sent_at = time.monotonic()
+            tx.replacements += 1
+            self.stats['replaced'] += 1
+        TX_OUTCOMES.inc(outcome='replaced')
+        print(f"⛽ Replaced stuck transaction (nonce {tx.nonce}, attempt {tx.replacements}): {tx_hash.hex()}")
+
+    def _finish(self, tx: PendingTransaction):
+        with self._lock:
+            self._pending.pop(tx.nonce, None)
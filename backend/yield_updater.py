@@ -5,7 +5,6 @@ Cheapest way to provide real yield data to the smart contract
 Updates contract with real APY data from DeFi protocols
 """
 
-import requests
 import time
 import json
 from datetime import datetime
@@ -14,14 +13,29 @@ from eth_account import Account
 import os
 from dotenv import load_dotenv
 
+from apy_history import DEFAULT_HISTORY_PATH, APYHistoryStore
+from contract_reads import (
+    AGGREGATOR_VIEW_ABI, BlockTracker, CachedContractReader, ContractReader, format_stats, read_aggregator_state
+)
+from http_client import http_client
+from metrics import metrics
+from tx_pipeline import FeeOracle, NonceManager, TransactionPipeline
+
 load_dotenv()
 
+CYCLE_SECONDS = metrics.histogram(
+    'updater_cycle_seconds', 'Duration of one updater cycle (contract read, APY fetch, update submission)',
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+)
+
 class YieldUpdater:
-    def __init__(self):
-        # Contract configuration
-        self.contract_address = "0x44dc2AaDF5a87918526dc377e06733B6562D546E"  # Production contract
-        self.private_key = os.getenv("PRIVATE_KEY")
-        self.rpc_url = os.getenv("SEPOLIA_URL")
+    def __init__(self, contract_address=None, rpc_url=None, private_key=None):
+        # Contract configuration (override with CONTRACT_ADDRESS/RPC_URL to run against a local Hardhat node)
+        self.contract_address = Web3.to_checksum_address(
+            contract_address or os.getenv("CONTRACT_ADDRESS", "0x44dc2AaDF5a87918526dc377e06733B6562D546E")  # Production contract
+        )
+        self.private_key = private_key or os.getenv("PRIVATE_KEY")
+        self.rpc_url = rpc_url or os.getenv("RPC_URL") or os.getenv("SEPOLIA_URL")
         
         # Initialize Web3
         self.w3 = Web3(Web3.HTTPProvider(self.rpc_url))
@@ -39,20 +53,7 @@ class YieldUpdater:
                 "stateMutability": "nonpayable",
                 "type": "function"
             },
-            {
-                "inputs": [],
-                "name": "getStats",
-                "outputs": [
-                    {"name": "totalDeposits_", "type": "uint256"},
-                    {"name": "totalFeesCollected_", "type": "uint256"},
-                    {"name": "totalYieldGenerated_", "type": "uint256"},
-                    {"name": "contractBalance_", "type": "uint256"},
-                    {"name": "currentAPY_", "type": "uint256"},
-                    {"name": "lastUpdate_", "type": "uint256"}
-                ],
-                "stateMutability": "view",
-                "type": "function"
-            }
+            *AGGREGATOR_VIEW_ABI
         ]
         
         self.contract = self.w3.eth.contract(
@@ -60,6 +61,18 @@ class YieldUpdater:
             abi=self.contract_abi
         )
         
+        # Contract state is read in one Multicall3 call or JSON-RPC batch, and only again once a new block lands
+        self.block_tracker = BlockTracker(
+            self.w3,
+            poll_interval=float(os.getenv("BLOCK_POLL_INTERVAL", 1)),
+            reorg_depth=int(os.getenv("REORG_DEPTH", 6))
+        )
+        self.reader = CachedContractReader(
+            ContractReader(self.w3, rpc_url=self.rpc_url, mode=os.getenv("CONTRACT_READ_MODE", "auto")),
+            self.block_tracker
+        )
+        self.watched_users = [address.strip() for address in os.getenv("WATCH_ADDRESSES", "").split(",") if address.strip()]
+        
         # DeFi protocol APIs
         self.protocols = {
             "compound": {
@@ -85,20 +98,42 @@ class YieldUpdater:
         }
         
         self.last_apy = 922  # Starting APY in basis points (9.22%)
+        self.pending_apy = None  # APY of the update transaction currently in flight
+        
+        # Nonces and fees are served locally so signing does not wait on RPC round trips
+        self.chain_id = None
+        self.nonce_manager = NonceManager(self.w3, self.account.address)
+        self.fee_oracle = FeeOracle(self.w3, ttl=float(os.getenv("FEE_CACHE_TTL", 15)))
+        self._rpc_saved_reported = 0
+        
+        # Submitted transactions are tracked in the background so the fetch loop never blocks on receipts
+        self.tx_pipeline = TransactionPipeline(
+            self.w3,
+            self.account,
+            poll_interval=float(os.getenv("TX_POLL_INTERVAL", 2)),
+            receipt_timeout=float(os.getenv("TX_RECEIPT_TIMEOUT", 600)),
+            replace_after=float(os.getenv("TX_REPLACE_AFTER", 90)),
+            fee_oracle=self.fee_oracle
+        )
+        self.last_protocol_apy = {}  # Last extracted APY per protocol, reused on 304/identical payloads
+        self.apy_fallbacks = []  # Protocols that fell back to the default APY in the last fetch
+        
+        # Weighted APY history, read by the API's portfolio performance endpoint
+        self.history = APYHistoryStore(
+            DEFAULT_HISTORY_PATH,
+            min_interval=float(os.getenv("APY_HISTORY_MIN_INTERVAL", 60))
+        )
         
     def fetch_real_apy(self):
         """Fetch real APY data from DeFi protocols"""
         total_weighted_apy = 0
         total_weight = 0
         successful_protocols = 0
+        self.apy_fallbacks = []
         
         for protocol_id, config in self.protocols.items():
             try:
-                response = requests.get(config["api_url"], timeout=10)
-                response.raise_for_status()
-                data = response.json()
-                
-                apy = self._extract_apy(protocol_id, data)
+                apy = self._fetch_protocol_apy(protocol_id, config)
                 if apy > 0:
                     total_weighted_apy += apy * config["weight"]
                     total_weight += config["weight"]
@@ -108,6 +143,7 @@ class YieldUpdater:
             except Exception as e:
                 print(f"❌ {config['name']} failed: {e}")
                 # Use fallback APY for failed protocols
+                self.apy_fallbacks.append(protocol_id)
                 total_weighted_apy += 8.0 * config["weight"]  # 8% fallback
                 total_weight += config["weight"]
         
@@ -115,8 +151,31 @@ class YieldUpdater:
             average_apy = total_weighted_apy / total_weight
             return int(average_apy * 100)  # Convert to basis points
         else:
+            self.apy_fallbacks = list(self.protocols)
             return 922  # Fallback to 9.22%
     
+    def _fetch_protocol_apy(self, protocol_id, config):
+        """Fetch one protocol's APY, reusing the last value when the payload is unchanged"""
+        previous = self.last_protocol_apy.get(protocol_id)
+        body = http_client.get_if_changed(
+            config["api_url"],
+            key=f"updater:{protocol_id}",
+            force=previous is None,
+            timeout=10
+        )
+        if body is None:
+            print(f"♻️  {config['name']}: payload unchanged, reusing {previous:.2f}% APY")
+            return previous
+        
+        with body:
+            apy = self._extract_apy(protocol_id, body.json())
+            if apy is None:
+                # Leave the body uncommitted so the next cycle refetches instead of reusing a fallback
+                raise ValueError("no USDC market in the response")
+            body.commit()
+            self.last_protocol_apy[protocol_id] = apy
+            return apy
+    
     def _extract_apy(self, protocol_id, data):
         """Extract APY from protocol-specific API response"""
         try:
@@ -146,93 +205,145 @@ class YieldUpdater:
         except Exception as e:
             print(f"Error extracting APY from {protocol_id}: {e}")
             
-        return 8.0  # Fallback APY
+        return None  # fetch_real_apy falls back to 8%
     
     def update_contract_yield(self, new_apy, source="backend"):
-        """Update the smart contract with new yield data"""
+        """Submit a yield update to the smart contract without waiting for it to be mined"""
         try:
+            if self.pending_apy is not None:
+                print(f"⏳ Update to {self.pending_apy/100:.2f}% APY still pending, skipping new submission")
+                return False
+            
             # Check if update is significant enough (1% change)
             apy_change = abs(new_apy - self.last_apy)
             if apy_change < 100:  # Less than 1% change
                 print(f"⏭️  APY change too small ({apy_change/100:.2f}%), skipping update")
                 return False
             
-            # Build transaction
+            if self.chain_id is None:
+                self.chain_id = self.w3.eth.chain_id
+            
+            # Build transaction from the local nonce and cached fees
             transaction = self.contract.functions.updateYieldData(
                 new_apy,
                 source
             ).build_transaction({
                 'from': self.account.address,
+                'chainId': self.chain_id,
                 'gas': 200000,
-                'gasPrice': self.w3.eth.gas_price,
-                'nonce': self.w3.eth.get_transaction_count(self.account.address),
+                'nonce': self.nonce_manager.next_nonce(),
+                **self.fee_oracle.fees()
             })
             
-            # Sign and send transaction
-            signed_txn = self.w3.eth.account.sign_transaction(transaction, self.private_key)
-            tx_hash = self.w3.eth.send_raw_transaction(signed_txn.rawTransaction)
+            # Sign and send transaction; the pipeline tracks the receipt in the background
+            self.pending_apy = new_apy
+            tx_hash = self.tx_pipeline.submit(
+                transaction,
+                on_confirmed=lambda receipt: self._on_update_confirmed(new_apy, receipt),
+                on_failed=lambda reason: self._on_update_failed(new_apy, reason)
+            )
             
             print(f"🚀 Yield update transaction sent: {tx_hash.hex()}")
-            
-            # Wait for confirmation
-            receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash)
-            if receipt.status == 1:
-                print(f"✅ Yield updated successfully: {new_apy/100:.2f}% APY")
-                self.last_apy = new_apy
-                return True
-            else:
-                print("❌ Transaction failed")
-                return False
+            return True
                 
         except Exception as e:
+            self.pending_apy = None
+            # The nonce may not have been consumed (or was already used); re-read it next time
+            self.nonce_manager.resync()
             print(f"❌ Error updating contract: {e}")
             return False
     
+    def _on_update_confirmed(self, new_apy, receipt):
+        print(f"✅ Yield updated successfully: {new_apy/100:.2f}% APY (block {receipt['blockNumber']})")
+        self.last_apy = new_apy
+        self.pending_apy = None
+    
+    def _on_update_failed(self, new_apy, reason):
+        print(f"❌ Yield update to {new_apy/100:.2f}% APY failed: {reason}")
+        self.pending_apy = None
+        self.nonce_manager.resync()
+    
+    def rpc_calls_saved(self):
+        """RPC round trips avoided by the nonce manager and fee cache since the last call"""
+        total = self.nonce_manager.stats['rpc_calls_saved'] + self.fee_oracle.stats['rpc_calls_saved']
+        saved = total - self._rpc_saved_reported
+        self._rpc_saved_reported = total
+        return saved
+    
+    def record_history(self, new_apy, stats=None):
+        """Append the weighted APY (and total deposits when known) to the APY history"""
+        try:
+            tvl = stats['total_deposits'] if stats else 0.0
+            self.history.append([('weighted', 'USDC', new_apy / 100, tvl)])
+        except Exception as e:
+            print(f"❌ Error recording APY history: {e}")
+    
     def get_contract_stats(self):
         """Get current contract statistics"""
         try:
-            stats = self.contract.functions.getStats().call()
-            return {
-                'total_deposits': stats[0] / 1e6,  # Convert from wei to USDC
-                'total_fees': stats[1] / 1e6,
-                'total_yield': stats[2] / 1e6,
-                'contract_balance': stats[3] / 1e6,
-                'current_apy': stats[4] / 100,  # Convert from basis points
-                'last_update': stats[5]
-            }
+            return format_stats(self.reader.read([self.contract.functions.getStats()])[0])
         except Exception as e:
             print(f"❌ Error getting contract stats: {e}")
             return None
     
+    def get_contract_state(self, users=()):
+        """Get contract statistics plus each user's position and USDC balance in one round trip"""
+        try:
+            return read_aggregator_state(self.reader, self.contract, users)
+        except Exception as e:
+            print(f"❌ Error getting contract state: {e}")
+            return None
+    
     def run_yield_updater(self, update_interval=300):  # 5 minutes
         """Run the yield updater service"""
         print("🚀 Starting Yield Updater Service...")
         print(f"📊 Update interval: {update_interval} seconds")
         print(f"📋 Contract: {self.contract_address}")
         
+        self.tx_pipeline.start()
+        next_run = time.monotonic()
+        
         while True:
             try:
                 print(f"\n⏰ {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - Checking yield data...")
+                cycle_started = time.perf_counter()
                 
-                # Get current contract stats
-                stats = self.get_contract_stats()
+                # Get current contract stats and watched positions in one read
+                state = self.get_contract_state(self.watched_users)
+                stats = state['stats'] if state else None
                 if stats:
                     print(f"📈 Current contract APY: {stats['current_apy']:.2f}%")
                     print(f"💰 Total deposits: ${stats['total_deposits']:.2f}")
                     print(f"💸 Total fees: ${stats['total_fees']:.2f}")
+                for user, position in (state['positions'] if state else {}).items():
+                    print(f"👤 {user}: ${position.get('total_deposited', 0):.2f} deposited, ${position['wallet_usdc'] or 0:.2f} USDC in wallet")
                 
                 # Fetch real APY data
                 new_apy = self.fetch_real_apy()
                 print(f"🎯 New weighted APY: {new_apy/100:.2f}%")
+                if self.apy_fallbacks:
+                    print(f"⏭️  Not recording history: {', '.join(self.apy_fallbacks)} used the fallback APY")
+                else:
+                    self.record_history(new_apy, stats)
+                for host, host_stats in http_client.stats().items():
+                    print(f"🔌 {host}: {host_stats['connections_reused']}/{host_stats['requests']} requests on reused connections")
                 
-                # Update contract if significant change
+                # Submit a contract update if significant change; confirmation is tracked in the background
                 if self.update_contract_yield(new_apy, "real_defi_data"):
-                    print("✅ Contract updated with real yield data!")
+                    print("📨 Contract update submitted with real yield data!")
                 else:
-                    print("⏭️  No significant change, skipping update")
+                    print("⏭️  No update submitted this cycle")
+                CYCLE_SECONDS.observe(time.perf_counter() - cycle_started)
+                print(f"📦 Pending transactions: {self.tx_pipeline.pending_count()}")
+                print(f"🧮 RPC calls saved this cycle: {self.rpc_calls_saved()}")
+                read_stats = self.reader.stats()
+                print(f"🧱 Contract reads: {read_stats['hits']} cached, {read_stats['misses']} fetched (head block {read_stats['block']['head']})")
                 
-                print(f"😴 Sleeping for {update_interval} seconds...")
-                time.sleep(update_interval)
+                # Keep a fixed cadence regardless of how long this cycle took
+                next_run = max(next_run + update_interval, time.monotonic())
+                sleep_for = max(0, next_run - time.monotonic())
+                print(f"😴 Sleeping for {sleep_for:.0f} seconds...")
+                time.sleep(sleep_for)
                 
             except KeyboardInterrupt:
                 print("\n🛑 Yield updater stopped by user")
@@ -241,6 +352,9 @@ class YieldUpdater:
                 print(f"❌ Error in yield updater: {e}")
                 print("😴 Sleeping for 60 seconds before retry...")
                 time.sleep(60)
+                next_run = time.monotonic()
+        
+        self.tx_pipeline.stop()
 
 if __name__ == "__main__":
     updater = YieldUpdater()